@@ -37,6 +37,7 @@ from .task import TaskGenerator, Task, Tasklet, value, CachedFunction, iterateta
 from .compound import CompoundTaskGenerator, CompoundTask
 from .barrier import barrier, bvalue
 from .options import set_jugdir
+from .hash import set_hash_algorithm
 
 from .jug import init, is_jug_running
 from .backends import file_store, dict_store, redis_store
@@ -56,6 +57,7 @@ __all__ = [
     'bvalue',
 
     'set_jugdir',
+    'set_hash_algorithm',
 
     'init',
     'is_jug_running',
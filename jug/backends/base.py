@@ -154,6 +154,25 @@ class base_store(metaclass=ABCMeta):
             Whether the key was present
         '''
 
+    def rename(self, old, new):
+        '''
+        store.rename(old, new)
+
+        Moves the entry associated with ``old`` to ``new``.
+
+        Default implementation loads and saves the object again, but this can
+        be overridden for efficiency.
+
+        Parameters
+        ----------
+        old : str
+            Existing key
+        new : str
+            New key
+        '''
+        self.dump(self.load(old), new)
+        self.remove(old)
+
     @abstractmethod
     def cleanup(self, active, keeplocks=False):
         '''
@@ -211,6 +230,46 @@ class base_store(metaclass=ABCMeta):
         base_lock : Generic lock
         '''
 
+    def lock_many(self, names):
+        '''
+        locked = store.lock_many(names)
+
+        Tries to acquire the locks for all of ``names``.
+
+        Default implementation calls ``getlock(name).get()`` for each name, but
+        this can be overridden for efficiency (e.g., to use a single round-trip
+        to a server). Stores where this is not possible should raise
+        ``NotImplementedError``.
+
+        Parameters
+        ----------
+        names : sequence of str
+            Keys
+
+        Returns
+        -------
+        locked : list of bool
+            Whether each lock was created
+        '''
+        return [self.getlock(name).get() for name in names]
+
+    def release_many(self, names):
+        '''
+        store.release_many(names)
+
+        Releases the locks for all of ``names`` (see ``lock_many``).
+
+        Default implementation calls ``getlock(name).release()`` for each name,
+        but this can be overridden for efficiency.
+
+        Parameters
+        ----------
+        names : sequence of str
+            Keys
+        '''
+        for name in names:
+            self.getlock(name).release()
+
     @abstractmethod
     def close(self):
         '''
@@ -235,6 +294,54 @@ class base_store(metaclass=ABCMeta):
     def metadata(self, t):
         return None
 
+    def watch(self):
+        '''
+        watcher = store.watch()
+
+        Returns an object whose ``wait(timeout)`` method blocks until a result
+        is (or may have been) written to the store or ``timeout`` seconds have
+        passed, and which should be closed with ``close()``. ``wait`` returns
+        False if the timeout expired and, otherwise, either the set of the
+        names of the results which were written or True (if these are not
+        known).
+
+        Results written after ``watch()`` returns are guaranteed to be noticed
+        (i.e., one can call ``watch()``, then check the store, and then
+        ``wait()`` without missing any changes).
+
+        The default implementation just sleeps (i.e., polling).
+
+        Returns
+        -------
+        watcher : store watcher
+        '''
+        return polling_watcher()
+
+
+class polling_watcher:
+    '''
+    watcher = polling_watcher()
+
+    Store watcher which does not get notifications (``wait(timeout)`` simply
+    sleeps for ``timeout`` seconds)
+    '''
+    def wait(self, timeout):
+        '''
+        changed = watcher.wait(timeout)
+
+        Returns
+        -------
+        changed : bool or set
+            False if the timeout expired. Otherwise, the names of the results
+            which were written (or True if they are not known)
+        '''
+        from time import sleep
+        sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
 
 class base_lock(metaclass=ABCMeta):
     '''
@@ -325,3 +432,19 @@ class base_lock(metaclass=ABCMeta):
         -------
         failed : boolean
         '''
+
+    def age(self):
+        '''
+        age = lock.age()
+
+        Returns how long ago (in seconds) the lock was acquired, or None if
+        this is not known (including when the lock does not exist or the task
+        is marked as failed).
+
+        The default implementation always returns None.
+
+        Returns
+        -------
+        age : float or None
+        '''
+        return None
@@ -105,6 +105,13 @@ class dict_store(base_store):
         return False
 
 
+    def rename(self, old, new):
+        '''
+        store.rename(old, new)
+        '''
+        self.store[_resultname(new)] = self.store.pop(_resultname(old))
+
+
     def cleanup(self, active, keeplocks=False):
         '''
         nr_removed = store.cleanup(active, keeplocks=False)
@@ -35,11 +35,14 @@ import shutil
 from subprocess import Popen
 from time import time
 
-from .base import base_store, base_lock
+from .base import base_store, base_lock, polling_watcher
 from jug.backends.encode import encode_to, decode_from
 
 MAX_FILESIZE_IN_PACK = 512
 
+# Packed values may be None
+_missing = object()
+
 
 def fsync_dir(fname):
     import errno
@@ -179,8 +182,7 @@ class file_store(base_store):
         but does it in a way that is guaranteed to be atomic even over NFS and
         using compression on the disk for faster access.
         '''
-        if name in self.packed:
-            del self.packed[name]
+        if self.packed.pop(name, _missing) is not _missing:
             self.resave_pack()
 
         self._maybe_create()
@@ -357,6 +359,24 @@ class file_store(base_store):
         return bool(self.remove_many([name]))
 
 
+    def rename(self, old, new):
+        '''
+        store.rename(old, new)
+
+        Moves the entry associated with ``old`` to ``new`` (without copying
+        the data).
+        '''
+        if old in self.packed:
+            self.packed[new] = self.packed.pop(old)
+            self.resave_pack()
+            return
+        if self.packed.pop(new, _missing) is not _missing:
+            self.resave_pack()
+        new = self._getfname(new)
+        os.makedirs(dirname(new), exist_ok=True)
+        os.rename(self._getfname(old), new)
+
+
     def cleanup(self, active, keeplocks=False):
         '''
         nr_removed = store.cleanup(active, keeplocks)
@@ -439,6 +459,59 @@ class file_store(base_store):
         '''
         return file_based_lock(self.jugdir, name)
 
+    def watch(self):
+        '''
+        watcher = store.watch()
+
+        Uses inotify where available (see ``inotify_watcher``) and polling
+        otherwise
+        '''
+        try:
+            return inotify_watcher(self.jugdir)
+        except (OSError, AttributeError) as e:
+            logging.info('jug.file_store: not using inotify (%s)', e)
+            return polling_watcher()
+
+    def lock_many(self, names):
+        '''
+        locked = store.lock_many(names)
+
+        Acquires several locks (see ``file_based_lock.get``), creating the lock
+        directory and the lock file contents only once.
+        '''
+        import socket
+        from datetime import datetime
+        lockdir = path.join(self.jugdir, 'locks')
+        os.makedirs(lockdir, exist_ok=True)
+        content = 'PID {0} on HOSTNAME {1}\nLock created on {2}\n'.format(
+                        os.getpid(),
+                        socket.gethostname(),
+                        datetime.now().strftime('%Y-%m-%d (%Hh%M.%S)'))
+        content = content.encode('utf-8')
+        locked = []
+        for name in names:
+            try:
+                fd = os.open(file_based_lock(self.jugdir, name).fullname, os.O_RDWR|os.O_CREAT|os.O_EXCL)
+            except FileExistsError:
+                locked.append(False)
+            else:
+                try:
+                    os.write(fd, content)
+                finally:
+                    os.close(fd)
+                locked.append(True)
+        return locked
+
+    def release_many(self, names):
+        '''
+        store.release_many(names)
+        '''
+        for name in names:
+            try:
+                os.unlink(file_based_lock(self.jugdir, name).fullname)
+            except OSError:
+                pass
+
     def close(self):
         '''
         store.close()
@@ -488,6 +561,120 @@ class file_store(base_store):
             shutil.rmtree(jugdir)
 
 
+# Flags from <sys/inotify.h>
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+class inotify_watcher:
+    '''
+    watcher = inotify_watcher(jugdir)
+
+    Store watcher for ``file_store`` using Linux's inotify: it watches the
+    jugdir (for new shard directories) and each shard directory (for results
+    being renamed into place).
+
+    Note that inotify only reports changes made on this machine: with a
+    network filesystem, results written by other machines are only seen when
+    the timeout expires.
+
+    Raises OSError if inotify is not available.
+    '''
+    def __init__(self, jugdir):
+        import ctypes
+        import ctypes.util
+        if not sys.platform.startswith('linux'):
+            raise OSError('jug.file_store: inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'jug.file_store: inotify_init1 failed')
+        self.jugdir = jugdir
+        self.shards = {}
+        try:
+            os.makedirs(jugdir, exist_ok=True)
+            self.root = self._add_watch(jugdir, _IN_CREATE | _IN_MOVED_TO)
+            for d in os.listdir(jugdir):
+                self._add_shard(d)
+        except:
+            self.close()
+            raise
+
+    def _add_watch(self, dname, mask):
+        import ctypes
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dname), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'jug.file_store: inotify_add_watch failed', dname)
+        return wd
+
+    def _add_shard(self, d):
+        '''Returns whether ``d`` is a shard directory which was not watched'''
+        if len(d) != 2 or d in self.shards.values():
+            return False
+        dname = path.join(self.jugdir, d)
+        if not path.isdir(dname):
+            return False
+        self.shards[self._add_watch(dname, _IN_MOVED_TO | _IN_CREATE)] = d
+        return True
+
+    def _read_events(self):
+        '''
+        Returns the names of the new results in the pending events (or True if
+        events were lost)
+        '''
+        import struct
+        header = struct.Struct('iIII')
+        names = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return (True if overflow else names)
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, nlen = header.unpack_from(data, pos)
+                pos += header.size
+                name = data[pos:pos + nlen].rstrip(b'\0').decode('utf-8', 'replace')
+                pos += nlen
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                elif wd == self.root:
+                    if mask & _IN_ISDIR and self._add_shard(name):
+                        # Results may have been moved into it already
+                        for f in os.listdir(path.join(self.jugdir, name)):
+                            names.add((name + f).encode('utf-8'))
+                elif wd in self.shards:
+                    names.add((self.shards[wd] + name).encode('utf-8'))
+
+    def wait(self, timeout):
+        '''
+        changed = watcher.wait(timeout)
+
+        Returns the names of the results which were written (True if these are
+        not known, or False if the timeout expired)
+        '''
+        import select
+        deadline = time() + timeout
+        while True:
+            remaining = deadline - time()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready:
+                names = self._read_events()
+                if names:
+                    return names
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
 class file_based_lock(base_lock):
     '''
     file_based_lock: File-system based locks
@@ -594,6 +781,21 @@ class file_based_lock(base_lock):
 
         return False
 
+    def age(self):
+        '''
+        age = lock.age()
+
+        Returns how long ago (in seconds) the lock was created (based on the
+        modification time of the lock file)
+        '''
+        try:
+            st = os.stat(self.fullname)
+        except OSError:
+            return None
+        if st.st_mtime == self._FAILED_TIMESTAMP[1]:
+            return None
+        return max(0., time() - st.st_mtime)
+
 
 class file_keepalive_store(file_store):
     def __repr__(self):
@@ -618,6 +820,15 @@ class file_keepalive_store(file_store):
         '''
         return file_keepalive_based_lock(self.jugdir, name)
 
+    def lock_many(self, names):
+        '''
+        store.lock_many(names)
+
+        Not supported: each lock is refreshed by its own monitor process, which
+        is tied to the lock object
+        '''
+        raise NotImplementedError
+
 
 class file_keepalive_based_lock(file_based_lock):
     '''
@@ -709,6 +920,24 @@ class file_keepalive_based_lock(file_based_lock):
         self.stop_monitor()
         return super(file_keepalive_based_lock, self).fail()
 
+    def age(self):
+        '''
+        age = lock.age()
+
+        The lock file is touched regularly by the monitor process, so the
+        creation time is read from the lock file's contents
+        '''
+        from datetime import datetime
+        try:
+            with open(self.fullname) as ifile:
+                for line in ifile:
+                    if line.startswith('Lock created on '):
+                        created = datetime.strptime(line[len('Lock created on '):].strip(), '%Y-%m-%d (%Hh%M.%S)')
+                        return max(0., (datetime.now() - created).total_seconds())
+        except (OSError, ValueError):
+            pass
+        return None
+
     def is_failed(self):
         '''
         failed = lock.is_failed()
@@ -48,6 +48,9 @@ def _lockname(name):
         name = name.encode('utf-8')
     return b'lock:' + name
 
+# Channel on which the names of new results are published
+_RESULTS_CHANNEL = b'jug:results'
+
 _LOCKED = b'L'
 _FAILED = b'F'
 
@@ -80,7 +83,10 @@ class redis_store(base_store):
         s = encode(object)
         if s:
             s = b64encode(s)
-        self.redis.set(_resultname(name), s)
+        pipe = self.redis.pipeline()
+        pipe.set(_resultname(name), s)
+        pipe.publish(_RESULTS_CHANNEL, name)
+        pipe.execute()
 
 
     def can_load(self, name):
@@ -113,6 +119,13 @@ class redis_store(base_store):
         return self.redis.delete(_resultname(name))
 
 
+    def rename(self, old, new):
+        '''
+        store.rename(old, new)
+        '''
+        self.redis.rename(_resultname(old), _resultname(new))
+
+
     def cleanup(self, active, keeplocks=False):
         '''
         nr_removed = store.cleanup(active, keeplocks=False)
@@ -154,6 +167,44 @@ class redis_store(base_store):
         return redis_lock(self.redis, name)
 
 
+    def watch(self):
+        '''
+        watcher = store.watch()
+
+        Subscribes to the notifications published by ``dump``
+        '''
+        return redis_watcher(self.redis)
+
+
+    def lock_many(self, names):
+        '''
+        locked = store.lock_many(names)
+
+        Acquires all the locks in a single pipeline (see ``redis_lock.get``)
+        '''
+        lnames = [_lockname(name) for name in names]
+        pipe = self.redis.pipeline()
+        for lname in lnames:
+            pipe.getset(lname, _LOCKED)
+        previous = pipe.execute()
+
+        failed = [lname for lname, prev in zip(lnames, previous) if prev == _FAILED]
+        if failed:
+            pipe = self.redis.pipeline()
+            for lname in failed:
+                pipe.set(lname, _FAILED)
+            pipe.execute()
+        return [(prev is None) for prev in previous]
+
+
+    def release_many(self, names):
+        '''
+        store.release_many(names)
+        '''
+        if names:
+            self.redis.delete(*[_lockname(name) for name in names])
+
+
     def close(self):
         # It seems some versions of the protocol are implemented differently
         # and do not have the ``disconnect`` method
@@ -164,6 +215,41 @@ class redis_store(base_store):
 
 
 
+class redis_watcher:
+    '''
+    watcher = redis_watcher(redis)
+
+    Store watcher based on redis' publish/subscribe
+    '''
+    def __init__(self, redis):
+        self.pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(_RESULTS_CHANNEL)
+
+    def wait(self, timeout):
+        '''
+        changed = watcher.wait(timeout)
+
+        Returns the names of the results which were written (or False if the
+        timeout expired)
+        '''
+        from time import time
+        deadline = time() + timeout
+        while True:
+            remaining = deadline - time()
+            if remaining <= 0:
+                return False
+            message = self.pubsub.get_message(timeout=remaining)
+            if message is not None:
+                names = set()
+                while message is not None:
+                    names.add(message['data'])
+                    message = self.pubsub.get_message(timeout=0)
+                return names
+
+    def close(self):
+        self.pubsub.close()
+
+
 class redis_lock(base_lock):
     '''
     redis_lock
@@ -32,6 +32,28 @@ class BarrierError(Exception):
     '''
     pass
 
+# Set by jug.jug.ResumableJugfile. If not None, it is called when a barrier is
+# not satisfied (instead of raising BarrierError) and returns once the tasks
+# may have been run (or raises BarrierError itself)
+_barrier_wait = None
+
+def _set_barrier_wait(f):
+    '''
+    previous = _set_barrier_wait(f)
+
+    (``jug.barrier`` is shadowed by the ``barrier`` function in the ``jug``
+    package, so the variable is set through this function)
+    '''
+    global _barrier_wait
+    previous = _barrier_wait
+    _barrier_wait = f
+    return previous
+
+def _wait_or_raise():
+    if _barrier_wait is None:
+        raise BarrierError
+    _barrier_wait()
+
 
 def _can_load_limit_recursion(tsk, alltasks):
     # This is a hack to get around Python limitations with recursion (Python doesn't like it)
@@ -80,9 +102,13 @@ def barrier():
     # jug.task.alltasks = []
     # we would still be referring to the old version
     from .task import alltasks
-    for t in reversed(alltasks):
-        if not _can_load_limit_recursion(t, alltasks):
-            raise BarrierError
+    while True:
+        for t in reversed(alltasks):
+            if not _can_load_limit_recursion(t, alltasks):
+                break
+        else:
+            return
+        _wait_or_raise()
 
 
 def bvalue(t):
@@ -147,8 +173,9 @@ def bvalue(t):
     barrier : Checks that **all** tasks have results available.
     '''
     from .task import value
-    try:
-        return value(t)
-    except:
-        raise BarrierError
+    while True:
+        try:
+            return value(t)
+        except:
+            _wait_or_raise()
 
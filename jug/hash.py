@@ -20,74 +20,481 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 #  THE SOFTWARE.
 
-def hash_update(M, elems):
+import pickle
+
+# Encoded forms of the most common names and values (which are all small
+# integers or short strings), so that they do not need to be pickled again
+_SMALL_INTS = [pickle.dumps(i) for i in range(1024)]
+_MAX_CACHED_STR = 64
+_MAX_CACHE_SIZE = 65536
+_encoded = {}
+
+# Types which are encoded as their pickle (they cannot have a __jug_hash__
+# method)
+_PICKLED_TYPES = frozenset([int, float, complex, str, bytes, bool, type(None)])
+
+_LIST_TYPE = repr(list).encode('utf-8')
+_TUPLE_TYPE = repr(tuple).encode('utf-8')
+
+
+def _encode(e):
+    '''
+    data = _encode(e)
+
+    Returns ``pickle.dumps(e)`` for an object of one of the ``_PICKLED_TYPES``
+    (using the cached encodings when possible)
+    '''
+    tp = type(e)
+    if tp is int and 0 <= e < 1024:
+        return _SMALL_INTS[e]
+    if (tp is str or tp is bytes) and len(e) <= _MAX_CACHED_STR:
+        data = _encoded.get(e)
+        if data is None:
+            data = pickle.dumps(e)
+            if len(_encoded) >= _MAX_CACHE_SIZE:
+                _encoded.clear()
+            _encoded[e] = data
+        return data
+    return pickle.dumps(e)
+
+
+# Size of the chunks in which arrays which are not contiguous are hashed
+_ARRAY_CHUNK_NBYTES = 1 << 20
+
+
+def _hash_ndarray(M, e):
+    M.update(b'np.ndarray')
+    M.update(pickle.dumps(e.dtype))
+    M.update(pickle.dumps(e.shape))
+    try:
+        buffer = e.data
+        M.update(buffer)
+    except:
+        _hash_array_chunks(M, e)
+
+
+def _hash_array_chunks(M, e):
     '''
-    M = hash_update(M, elems)
+    _hash_array_chunks(M, e)
+
+    Updates ``M`` with the contents of ``e`` in C order (i.e., the same data
+    as ``M.update(e.copy().data)``), copying at most ``_ARRAY_CHUNK_NBYTES``
+    at a time, so that large strided views or Fortran-ordered arrays do not
+    need to be copied whole.
+    '''
+    import numpy as np
+    buffersize = max(1, _ARRAY_CHUNK_NBYTES // max(1, e.itemsize))
+    for chunk in np.nditer(e,
+                        flags=['external_loop', 'buffered', 'refs_ok', 'zerosize_ok'],
+                        buffersize=buffersize,
+                        order='C'):
+        M.update(np.ascontiguousarray(chunk).data)
+
+
+# Maps types to functions ``encoder(M, obj)`` which update the hash object
+# ``M`` with ``obj`` (see ``register_hash_encoder``)
+_encoders = {}
+
+
+def register_hash_encoder(cls, encoder):
+    '''
+    register_hash_encoder(cls, encoder)
+
+    Registers a function to hash objects of type ``cls`` (which cannot be
+    given a ``__jug_hash__`` method). Without an encoder, objects are hashed
+    by pickling them, which is slower and, for some types, not deterministic.
+
+    Only objects whose type is exactly ``cls`` are encoded with ``encoder``
+    (not those of subclasses). Lists, tuples, sets, dictionaries, and the
+    basic types (numbers, strings, bytes, and None) cannot be overridden.
+
+    Parameters
+    ----------
+    cls : type
+    encoder : callable
+        Called as ``encoder(M, obj)``, it should call ``M.update(data)`` with
+        data (bytes) which identifies ``obj``
+    '''
+    if cls in _PICKLED_TYPES or cls in (list, tuple, set, dict):
+        raise ValueError('jug.hash.register_hash_encoder: cannot override the encoding of {}'.format(cls.__name__))
+    _encoders[cls] = encoder
+
+
+def _find_encoder(tp):
+    '''Returns the encoder for ``tp`` (or None)'''
+    encoder = _encoders.get(tp)
+    if encoder is None and tp.__name__ == 'ndarray' and tp.__module__ == 'numpy':
+        # Registered when first seen, so that numpy is never imported here
+        encoder = _encoders[tp] = _hash_ndarray
+    return encoder
+
+
+# With hash algorithms other than the default, large tuples and arrays are
+# hashed as the digest of their contents (a Merkle tree). For immutable
+# objects (tuples of immutable values and read-only arrays), the digest is
+# cached by identity, so that a large argument shared by many tasks is only
+# hashed once. Lists, sets, and dictionaries can be modified at any time, so
+# their digests could not be cached and they are hashed inline (as with the
+# default algorithm). The default algorithm keeps hashing the contents every
+# time, as this changes the hashes (and existing jugdirs use the default).
+_merkle = False
+_MERKLE_MIN_LEN = 256
+_MERKLE_MIN_NBYTES = 1 << 20
+_MAX_CACHED_DIGESTS = 4096
+
+# Maps id(obj) to (obj, digest) for tuples (which do not support weak
+# references, so they are kept alive until ``clear_hash_cache`` is called at
+# the end of each ``jug execute`` cycle) and to (weak reference, digest) for
+# arrays
+_digests = {}
+_array_digests = {}
+
+
+def _cache_digest(cache, key, entry):
+    if len(cache) >= _MAX_CACHED_DIGESTS:
+        try:
+            cache.pop(next(iter(cache)), None)
+        except (StopIteration, RuntimeError):
+            # Modified by another thread
+            pass
+    cache[key] = entry
+
+
+def _is_readonly_array(e):
+    '''
+    readonly = _is_readonly_array(e)
+
+    Returns whether the contents of the numpy array ``e`` cannot change (a
+    read-only view of a writeable array can still change)
+    '''
+    if e.dtype.hasobject:
+        return False
+    while e is not None:
+        if _find_encoder(type(e)) is not _hash_ndarray:
+            return type(e) is bytes
+        if e.flags.writeable:
+            return False
+        e = e.base
+    return True
+
+
+def _is_immutable(e):
+    '''
+    immutable = _is_immutable(e)
+
+    Returns whether ``e`` (and everything it contains) cannot be modified, so
+    that its digest can be cached by identity
+    '''
+    stack = [e]
+    while stack:
+        e = stack.pop()
+        tp = type(e)
+        if tp in _PICKLED_TYPES or hasattr(e, '__jug_hash__'):
+            continue
+        if tp is tuple or tp is frozenset:
+            stack.extend(e)
+        elif _find_encoder(tp) is _hash_ndarray and _is_readonly_array(e):
+            continue
+        else:
+            return False
+    return True
+
+
+def _container_digest(e, use_cache):
+    '''
+    digest = _container_digest(e, use_cache)
+
+    Returns the digest of the contents of a large tuple
+    '''
+    key = id(e)
+    if use_cache:
+        entry = _digests.get(key)
+        if entry is not None and entry[0] is e:
+            return entry[1]
+    h = new_hash_object()
+    hash_update(h, [('merkle', e)], use_cache=use_cache, _expand=e)
+    digest = h.digest()
+    if _is_immutable(e):
+        _cache_digest(_digests, key, (e, digest))
+    return digest
+
+
+def _array_digest(e, use_cache):
+    '''
+    digest = _array_digest(e, use_cache)
+
+    Returns the digest of a large numpy array
+    '''
+    import weakref
+    key = id(e)
+    if use_cache:
+        entry = _array_digests.get(key)
+        if entry is not None and entry[0]() is e:
+            return entry[1]
+    h = new_hash_object()
+    _hash_ndarray(h, e)
+    digest = h.digest()
+    if not _is_readonly_array(e):
+        return digest
+    _cache_digest(_array_digests, key, (weakref.ref(e, lambda _, key=key: _array_digests.pop(key, None)), digest))
+    return digest
+
+
+def clear_hash_cache():
+    '''
+    clear_hash_cache()
+
+    Forgets the cached digests of large arguments (see ``hash_update``)
+    '''
+    _digests.clear()
+    _array_digests.clear()
+
+
+def hash_update(M, elems, use_cache=True, _expand=None):
+    '''
+    M = hash_update(M, elems, use_cache=True)
 
     Update the hash object ``M`` with the sequence ``elems``.
 
+    Objects with a ``__jug_hash__`` method, lists, tuples, sets,
+    dictionaries, numpy arrays, and objects of types with a registered
+    encoder (see ``register_hash_encoder``) are handled specially. Anything
+    else is pickled.
+
+    With a hash algorithm other than the default (see
+    ``set_hash_algorithm``), large tuples and numpy arrays contribute the
+    digest of their contents. For tuples of immutable values and read-only
+    arrays, this digest is cached (so an argument shared by many tasks is only
+    hashed once) until ``clear_hash_cache`` is called or, for arrays, the
+    array is freed.
+
     Parameters
     ----------
     M : hashlib object
         An object on which the update method will be called
     elems : sequence of 2-tuples
+    use_cache : bool, optional
+        If False, cached digests are not used (but they are updated). This is
+        used in debug mode to check that arguments were not modified.
 
     Returns
     -------
     M : hashlib object
         This is the same object as the argument
     '''
-    import pickle
-
-    try:
-        import numpy as np
-    except ImportError:
-        np = None
-    for n,e in elems:
-        M.update(pickle.dumps(n))
-        if hasattr(e, '__jug_hash__'):
-            M.update(e.__jug_hash__())
-        elif type(e) in (list, tuple):
-            M.update(repr(type(e)).encode('utf-8'))
-            hash_update(M, enumerate(e))
-        elif type(e) == set:
-            M.update(b'set')
-            # With randomized hashing, different runs of Python might result in
-            # different orders, so sort. We cannot trust that all the elements
-            # in the set will be comparable, so we convert them to their hashes
-            # beforehand.
-            items = [hash_one(el) for el in e]
-            items.sort()
-            hash_update(M, enumerate(items))
-        elif type(e) == dict:
-            M.update(b'dict')
-            items = [(hash_one(k),v) for k,v in e.items()]
-            items.sort(key=(lambda k_v:k_v[0]))
-
-            hash_update(M, items)
-        elif np is not None and type(e) == np.ndarray:
-            M.update(b'np.ndarray')
-            M.update(pickle.dumps(e.dtype))
-            M.update(pickle.dumps(e.shape))
-            try:
-                buffer = e.data
-                M.update(buffer)
-            except:
-                M.update(e.copy().data)
+    # Nested containers are traversed with an explicit stack of iterators
+    # (instead of recursively), so that deep nesting is not limited by the
+    # recursion limit. The data is the same as with a recursive traversal.
+    stack = [iter(elems)]
+    while stack:
+        for n,e in stack[-1]:
+            M.update(_encode(n))
+            tp = type(e)
+            if tp in _PICKLED_TYPES:
+                M.update(_encode(e))
+            elif _merkle and tp is tuple and len(e) >= _MERKLE_MIN_LEN and e is not _expand:
+                M.update(b'merkle')
+                M.update(_container_digest(e, use_cache))
+            elif tp is list or tp is tuple:
+                M.update(_LIST_TYPE if tp is list else _TUPLE_TYPE)
+                stack.append(enumerate(e))
+                break
+            elif tp is set:
+                M.update(b'set')
+                # With randomized hashing, different runs of Python might result in
+                # different orders, so sort. We cannot trust that all the elements
+                # in the set will be comparable, so we convert them to their hashes
+                # beforehand.
+                items = [_hash_one(el, use_cache) for el in e]
+                items.sort()
+                stack.append(enumerate(items))
+                break
+            elif tp is dict:
+                M.update(b'dict')
+                items = [(_hash_one(k, use_cache),v) for k,v in e.items()]
+                items.sort(key=(lambda k_v:k_v[0]))
+                stack.append(iter(items))
+                break
+            elif hasattr(e, '__jug_hash__'):
+                M.update(e.__jug_hash__())
+            else:
+                encoder = _find_encoder(tp)
+                if encoder is _hash_ndarray and _merkle and e.nbytes >= _MERKLE_MIN_NBYTES:
+                    M.update(b'merkle')
+                    M.update(_array_digest(e, use_cache))
+                elif encoder is not None:
+                    encoder(M, e)
+                else:
+                    M.update(pickle.dumps(e))
         else:
-            M.update(pickle.dumps(e))
+            stack.pop()
     return M
 
+DEFAULT_HASH_ALGORITHM = 'sha1'
+
+# Key under which the hash algorithm of a jugdir is saved in the store
+_HASH_ALGORITHM_KEY = b'jug-hash-algorithm'
+
+# Algorithm used by ``new_hash_object`` (as returned by
+# ``parse_hash_algorithm``) and the one explicitly requested (if any)
+_algorithm = DEFAULT_HASH_ALGORITHM
+_constructor = None
+_requested = None
+
+
+def parse_hash_algorithm(spec):
+    '''
+    spec, constructor = parse_hash_algorithm(spec)
+
+    Parses a hash algorithm specification: the name of an algorithm which is
+    available on all platforms (e.g., ``'sha1'`` or ``'sha256'``), optionally
+    followed by a digest size in bytes for ``blake2b`` and ``blake2s`` (e.g.,
+    ``'blake2b-20'``).
+
+    Returns
+    -------
+    spec : str
+        Normalized specification
+    constructor : callable
+        Returns a new hash object when called without arguments
+    '''
+    import hashlib
+    from functools import partial
+    name = spec.strip().lower()
+    digest_size = None
+    base, _, size = name.rpartition('-')
+    if base and size.isdigit():
+        name = base
+        digest_size = int(size)
+    if name not in hashlib.algorithms_guaranteed or name.startswith('shake_'):
+        raise ValueError("jug: unknown hash algorithm {!r} (valid options include {})".format(
+                spec, ', '.join(sorted(a for a in hashlib.algorithms_guaranteed if not a.startswith('shake_')))))
+    constructor = getattr(hashlib, name)
+    if digest_size is not None:
+        max_size = {'blake2b': 64, 'blake2s': 32}.get(name)
+        if max_size is None:
+            raise ValueError("jug: hash algorithm '{}' does not take a digest size".format(name))
+        if not (1 <= digest_size <= max_size):
+            raise ValueError("jug: the digest size of '{}' must be between 1 and {}".format(name, max_size))
+        if digest_size != max_size:
+            constructor = partial(constructor, digest_size=digest_size)
+            name = '{}-{}'.format(name, digest_size)
+    return name, constructor
+
+
+def set_hash_algorithm(spec):
+    '''
+    set_hash_algorithm(spec)
+
+    Sets the algorithm used to compute task hashes. This is the programmatic
+    equivalent of passing ``--hash-algorithm=...`` on the command line.
+
+    A jugdir records the algorithm with which it was created (see
+    ``select_hash_algorithm``): use ``jug rehash`` to change the algorithm of
+    an existing jugdir.
+
+    Parameters
+    ----------
+    spec : str or None
+        See ``parse_hash_algorithm``. ``None`` restores the default
+        (``'sha1'``, unless the jugdir records a different algorithm)
+    '''
+    global _requested
+    from .task import Task
+    if spec is None:
+        _use(DEFAULT_HASH_ALGORITHM)
+        _requested = None
+        return
+    _requested = _use(spec)
+    # Called from a jugfile, after the store was set up
+    if Task.store is not None:
+        select_hash_algorithm(Task.store)
+
+
+def _use(spec):
+    global _algorithm, _constructor, _merkle
+    spec, constructor = parse_hash_algorithm(spec)
+    if spec != _algorithm:
+        clear_hash_cache()
+    _algorithm = spec
+    _constructor = (None if _algorithm == DEFAULT_HASH_ALGORITHM else constructor)
+    _merkle = (_algorithm != DEFAULT_HASH_ALGORITHM)
+    return _algorithm
+
+
+def hash_algorithm():
+    '''
+    spec = hash_algorithm()
+
+    Returns the algorithm currently used to compute task hashes
+    '''
+    return _algorithm
+
+
+def load_hash_algorithm(store):
+    '''
+    spec = load_hash_algorithm(store)
+
+    Returns the hash algorithm recorded in ``store`` (or None if none was
+    recorded, in which case the default is used)
+    '''
+    if store.can_load(_HASH_ALGORITHM_KEY):
+        return store.load(_HASH_ALGORITHM_KEY)
+    return None
+
+
+def save_hash_algorithm(store, spec):
+    '''
+    save_hash_algorithm(store, spec)
+
+    Records ``spec`` as the hash algorithm of ``store``
+    '''
+    store.dump(spec, _HASH_ALGORITHM_KEY)
+
+
+def select_hash_algorithm(store):
+    '''
+    spec = select_hash_algorithm(store)
+
+    Selects the hash algorithm for ``store``. This is the algorithm recorded
+    in the store (or the default, for stores which do not record one). An
+    empty store takes the one requested with ``set_hash_algorithm`` (which is
+    then recorded).
+
+    Raises ``RuntimeError`` if the requested algorithm is not the one used by
+    the store, as mixing them would silently recompute all results.
+    '''
+    recorded = load_hash_algorithm(store)
+    if _requested is None:
+        return _use(recorded or DEFAULT_HASH_ALGORITHM)
+    if recorded is None and _requested != DEFAULT_HASH_ALGORITHM:
+        try:
+            has_results = any(True for _ in store.list())
+        except NotImplementedError:
+            has_results = False
+        if not has_results:
+            save_hash_algorithm(store, _requested)
+            recorded = _requested
+    if (recorded or DEFAULT_HASH_ALGORITHM) != _requested:
+        raise RuntimeError(
+            "jug: the results in this jugdir were computed with hash algorithm '{}' (not '{}').\n"
+            "Use `jug rehash --to={}` to convert them (or do not set the hash algorithm).".format(
+                recorded or DEFAULT_HASH_ALGORITHM, _requested, _requested))
+    return _use(_requested)
+
+
 def new_hash_object():
     '''
     M = new_hash_object()
 
-    Returns a new hash object
+    Returns a new hash object (see ``set_hash_algorithm``)
 
     Returns
     -------
     M : hashlib object
     '''
+    if _constructor is not None:
+        return _constructor()
     import hashlib
     return hashlib.sha1()
 
@@ -106,7 +513,11 @@ def hash_one(obj):
     -------
     hvalue : str
     '''
+    return _hash_one(obj, True)
+
+
+def _hash_one(obj, use_cache):
     h = new_hash_object()
-    hash_update(h, [('hash1', obj)])
+    hash_update(h, [('hash1', obj)], use_cache=use_cache)
     return h.hexdigest().encode('utf-8')
 
@@ -8,6 +8,7 @@ _known_hooks = frozenset([
         'execute.task-loadable',
         'execute.task-executed1',
         'execute.task-pre-execute',
+        'execute.task-too-large',
         'execute.finished_pre_status',
         'execute.finished_post_status',
         ])
@@ -22,7 +22,8 @@
 #  THE SOFTWARE.
 
 
-import itertools
+from collections import defaultdict
+import inspect
 import logging
 import os
 import sys
@@ -43,9 +44,9 @@ def is_jug_running():
     return _is_jug_running
 
 
-def init(jugfile=None, jugdir=None, on_error='exit', store=None):
+def init(jugfile=None, jugdir=None, on_error='exit', store=None, hash_threads=None):
     '''
-    store, jugspace = init(jugfile='jugfile.py', jugdir='jugdata', on_error='exit', store=None)
+    store, jugspace = init(jugfile='jugfile.py', jugdir='jugdata', on_error='exit', store=None, hash_threads=None)
 
     Initializes jug (create backend connection, ...).
     Imports jugfile
@@ -60,21 +61,50 @@ def init(jugfile=None, jugdir=None, on_error='exit', store=None):
         What to do if import fails (default: exit)
     store : storage object, optional
         If used, this is returned as ``store`` again.
+    hash_threads : int, optional
+        If larger than 1, the hashes of all tasks are computed using this
+        many threads (see ``jug.task.hash_tasks``) after the jugfile is
+        loaded. Otherwise, they are computed when first needed.
 
     Returns
     -------
     store : storage object
     jugspace : dictionary
     '''
-    import types
     from .options import set_jugdir
+    from .hash import select_hash_algorithm
     assert on_error in ('exit', 'propagate'), 'jug.init: on_error option is not valid.'
 
     if jugfile is None:
         jugfile = 'jugfile'
     if store is None:
         store = set_jugdir(jugdir)
+    else:
+        select_hash_algorithm(store)
 
+    jugspace = _new_jugspace(jugfile)
+    try:
+        _exec_jugfile(jugfile, jugspace)
+    except BarrierError:
+        jugspace['__jug__hasbarrier__'] = True
+    except Exception as e:
+        _import_failed(jugfile, e, on_error)
+
+    if hash_threads is not None and int(hash_threads) > 1:
+        task.hash_tasks(task.alltasks, int(hash_threads))
+
+    # The store may have been changed by the jugfile.
+    store = task.Task.store
+    return store, jugspace
+
+
+def _new_jugspace(jugfile):
+    '''
+    jugspace = _new_jugspace(jugfile)
+
+    Creates the module in which the jugfile is executed
+    '''
+    import types
     curdir = os.path.abspath('.')
     if curdir not in sys.path or curdir != sys.path[0]:
         sys.path.insert(0, curdir)
@@ -95,29 +125,896 @@ def init(jugfile=None, jugdir=None, on_error='exit', store=None):
     jugmodname = os.path.basename(jugfile[:-len('.py')])
     jugmodule = types.ModuleType(jugmodname)
     jugmodule.__file__ = os.path.abspath(jugfile)
-    jugspace = jugmodule.__dict__
     sys.modules[jugmodname] = jugmodule
+    return jugmodule.__dict__
+
+
+def _exec_jugfile(jugfile, jugspace):
+    with open(jugfile) as jfile:
+        exec(compile(jfile.read(), jugfile, 'exec'), jugspace, jugspace)
+
+
+def _import_failed(jugfile, e, on_error):
+    logging.critical("Could not import file '%s' (error: %s)", jugfile, e)
+    if on_error == 'exit':
+        import traceback
+        print(''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+        sys.exit(1)
+    else:
+        raise e
+
+
+class ResumableJugfile:
+    '''
+    jugfile = ResumableJugfile(jugfile=None, jugdir=None, on_error='exit', store=None, hash_threads=None)
+    store, jugspace = jugfile.start()
+
+    Interprets a jugfile so that it can be resumed after a barrier.
+
+    The jugfile runs in a background thread. When it reaches a ``barrier()``
+    (or ``bvalue()``) which is not satisfied, instead of raising
+    ``BarrierError`` (which forces ``jug execute`` to interpret the whole
+    jugfile again), the thread pauses. Once the caller has run the tasks
+    defined so far, calling ``resume()`` checks the barrier again and continues
+    from that point. Thus, tasks defined before the barrier (and their
+    hashes and loaded results) are kept.
+
+    ``start()`` and ``resume()`` return when the jugfile is paused or has
+    finished (see the ``finished`` attribute). ``close()`` stops the thread if
+    the jugfile has not finished.
+
+    Parameters are as for ``init`` (with ``hash_threads``, the tasks defined
+    since the last pause are hashed every time that the jugfile pauses).
+    '''
+    def __init__(self, jugfile=None, jugdir=None, on_error='exit', store=None, hash_threads=None):
+        import threading
+        assert on_error in ('exit', 'propagate'), 'jug.ResumableJugfile: on_error option is not valid.'
+        self.jugfile = (jugfile if jugfile is not None else 'jugfile')
+        self.jugdir = jugdir
+        self.on_error = on_error
+        self.store = store
+        self.hash_threads = hash_threads
+        self._nr_hashed = 0
+        self.jugspace = None
+        self.finished = False
+        self._thread = None
+        self._paused = threading.Event()
+        self._resume = threading.Event()
+        self._abort = False
+        self._error = None
+
+    def _wait(self):
+        import threading
+        if threading.current_thread() is not self._thread:
+            raise BarrierError
+        self.jugspace['__jug__hasbarrier__'] = True
+        self._resume.clear()
+        self._paused.set()
+        self._resume.wait()
+        if self._abort:
+            raise BarrierError
+
+    def _run(self):
+        try:
+            _exec_jugfile(self.jugfile, self.jugspace)
+        except BarrierError:
+            pass
+        except Exception as e:
+            self._error = e
+        finally:
+            self.finished = True
+            self._paused.set()
+
+    def _wait_for_pause(self):
+        self._paused.wait()
+        self._paused.clear()
+        if self._error is not None:
+            e, self._error = self._error, None
+            self.close()
+            _import_failed(self.jugfile, e, self.on_error)
+        if self.hash_threads is not None and int(self.hash_threads) > 1:
+            task.hash_tasks(task.alltasks[self._nr_hashed:], int(self.hash_threads))
+        self._nr_hashed = len(task.alltasks)
+
+    def start(self):
+        '''
+        store, jugspace = jugfile.start()
+
+        Starts interpreting the jugfile (see ``init``)
+        '''
+        import threading
+        from .barrier import _set_barrier_wait
+        from .options import set_jugdir
+        from .hash import select_hash_algorithm
+        if self.store is None:
+            self.store = set_jugdir(self.jugdir)
+        else:
+            select_hash_algorithm(self.store)
+        self.jugspace = _new_jugspace(self.jugfile)
+        _set_barrier_wait(self._wait)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._wait_for_pause()
+        return task.Task.store, self.jugspace
+
+    def resume(self):
+        '''
+        jugfile.resume()
+
+        Continues interpreting the jugfile after a barrier (if the barrier is
+        still not satisfied, it pauses again immediately)
+        '''
+        if self.finished:
+            return
+        self.jugspace['__jug__hasbarrier__'] = False
+        self._resume.set()
+        self._wait_for_pause()
+
+    def close(self):
+        from .barrier import _set_barrier_wait
+        if self._thread is not None and not self.finished:
+            self._abort = True
+            self._resume.set()
+            self._thread.join()
+        _set_barrier_wait(None)
+
+
+class TaskIsolationError(Exception):
+    '''
+    Raised when a task run in isolation (see ``jug execute --isolate``) times
+    out, runs out of memory, or otherwise fails in its child process
+    '''
+    pass
+
+
+def _address_space_size():
+    '''
+    nbytes = _address_space_size()
+
+    Returns the size of the address space of the current process (or 0 if it
+    cannot be determined, which is the case outside of Linux)
+    '''
     try:
-        with open(jugfile) as jfile:
-            exec(compile(jfile.read(), jugfile, 'exec'), jugspace, jugspace)
-    except BarrierError:
-        jugspace['__jug__hasbarrier__'] = True
-    except Exception as e:
-        logging.critical("Could not import file '%s' (error: %s)", jugfile, e)
-        if on_error == 'exit':
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _run_isolated(t, debug, timeout=None, memory_limit=None, after_fork=None):
+    '''
+    _run_isolated(t, debug, timeout=None, memory_limit=None, after_fork=None)
+
+    Runs ``t`` in a forked child process which can allocate at most
+    ``memory_limit`` bytes (on top of what it inherits from the parent). The
+    result is saved to the store by the child. If the child does not finish
+    within ``timeout`` seconds, it is killed.
+
+    The child only gets the calling thread, so no other thread should be
+    doing anything (and holding locks, which would never be released in the
+    child) when this is called. ``after_fork`` is called in the parent once
+    the child has been started (so, e.g., other threads can be given work).
+
+    Raises ``TaskIsolationError`` if the task does not complete successfully.
+    '''
+    from time import time, sleep
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            if memory_limit is not None:
+                import resource
+                # The address space of the child starts as a copy of the
+                # parent's, which does not count towards the limit
+                limit = _address_space_size() + memory_limit
+                resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+            t.run(debug_mode=debug)
+            code = 0
+        except MemoryError:
+            code = 2
+        except BaseException:
             import traceback
-            print(traceback.format_exc())
-            sys.exit(1)
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    if after_fork is not None:
+        after_fork()
+    deadline = (time() + timeout if timeout is not None else None)
+    delay = .001
+    while True:
+        wpid, status = os.waitpid(pid, os.WNOHANG)
+        if wpid:
+            break
+        if deadline is not None and time() > deadline:
+            import signal
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            raise TaskIsolationError('Task {} timed out (after {} seconds)'.format(t.name, timeout))
+        sleep(delay)
+        delay = min(2 * delay, .1)
+    if os.WIFSIGNALED(status):
+        raise TaskIsolationError('Task {} was killed by signal {}'.format(t.name, os.WTERMSIG(status)))
+    code = os.WEXITSTATUS(status)
+    if code == 2:
+        raise TaskIsolationError('Task {} ran out of memory (limit: {} bytes)'.format(t.name, memory_limit))
+    elif code != 0:
+        raise TaskIsolationError('Task {} failed in its child process (exit code {})'.format(t.name, code))
+
+
+def _run_task(t, debug, isolation, after_fork=None):
+    '''
+    _run_task(t, debug, isolation, after_fork=None)
+
+    Runs ``t``, in a child process if ``isolation`` (a tuple of timeout and
+    memory limit, see ``_isolation_settings``) is not None (see
+    ``_run_isolated`` for ``after_fork``)
+    '''
+    if isolation is None:
+        t.run(debug_mode=debug)
+    else:
+        _run_isolated(t, debug, *isolation, after_fork=after_fork)
+
+
+def _isolation_settings(options):
+    '''
+    isolation = _isolation_settings(options)
+
+    Returns ``(timeout, memory_limit)`` if tasks should be run in isolation,
+    None otherwise
+    '''
+    from .backends.dict_store import dict_store
+    from .result_cache import parse_size
+    timeout = options.execute_timeout
+    memory_limit = options.execute_memory_limit
+    if not (options.execute_isolate or timeout is not None or memory_limit is not None):
+        return None
+    if not hasattr(os, 'fork'):
+        logging.warning('jug: running tasks in isolation requires `fork`, which is not available. Ignoring.')
+        return None
+    if isinstance(task.Task.store, dict_store):
+        logging.warning('jug: dict_store does not support multiple processes. Not running tasks in isolation.')
+        return None
+    if timeout is not None:
+        timeout = float(timeout)
+    if memory_limit is not None:
+        memory_limit = parse_size(memory_limit)
+    return (timeout, memory_limit)
+
+
+def _lock_and_run(t, debug, keep_failed, isolation=None, on_lock=None):
+    '''
+    status = _lock_and_run(t, debug, keep_failed, isolation=None, on_lock=None)
+
+    Locks, runs, and unlocks ``t``. This is used when tasks are run outside
+    of the main loop (in worker processes or threads). If given, ``on_lock``
+    is called as soon as the lock is taken.
+
+    Returns
+    -------
+    status : str
+        One of 'executed', 'loadable' (some other process ran it), or
+        'locked' (some other process is running it)
+    '''
+    locked = False
+    task_failed = False
+    try:
+        locked = t.lock()
+        if locked and on_lock is not None:
+            on_lock()
+        if t.can_load():
+            return 'loadable'
+        if not locked:
+            return 'locked'
+        nr_tasks = len(task.alltasks)
+        _run_task(t, debug, isolation)
+        if debug and len(task.alltasks) != nr_tasks:
+            raise RuntimeError('Creating tasks while executing another task is not supported.\n'
+                        'Error detected while running task `{0}`'.format(t.name))
+        return 'executed'
+    except Exception as e:
+        task_failed = True
+        # Tasks which failed in isolation are always marked as failed
+        if keep_failed or isinstance(e, TaskIsolationError):
+            t.fail()
+            keep_failed = True
+        raise
+    finally:
+        if locked and not (task_failed and keep_failed):
+            t.unlock()
+
+
+async def _lock_and_run_async(t, debug, keep_failed):
+    '''
+    status = await _lock_and_run_async(t, debug, keep_failed)
+
+    Equivalent to ``_lock_and_run`` for tasks whose function is a coroutine
+    function. Locking (and other blocking operations) are run in the
+    loop's default executor so that other coroutines can make progress.
+    '''
+    import asyncio
+    loop = asyncio.get_running_loop()
+    locked = False
+    task_failed = False
+    try:
+        locked = await loop.run_in_executor(None, t.lock)
+        if await loop.run_in_executor(None, t.can_load):
+            return 'loadable'
+        if not locked:
+            return 'locked'
+        await t.run_async(debug_mode=debug)
+        return 'executed'
+    except Exception:
+        task_failed = True
+        if keep_failed:
+            t.fail()
+        raise
+    finally:
+        if locked and not (task_failed and keep_failed):
+            t.unlock()
+
+
+class _AsyncExecutor:
+    '''
+    executor = _AsyncExecutor()
+
+    Runs coroutines on an event loop in a background thread. ``submit``
+    returns a ``concurrent.futures.Future`` so that coroutines can be waited
+    on together with tasks running in threads or processes.
+    '''
+    def __init__(self):
+        import asyncio
+        import threading
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def shutdown(self):
+        '''Waits for all running coroutines and stops the loop'''
+        import asyncio
+        async def drain():
+            pending = [at for at in asyncio.all_tasks() if at is not asyncio.current_task()]
+            await asyncio.gather(*pending, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(drain(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def _claim_batch(t, queue, batch_size, claims, capacity=None):
+    '''
+    new_claims = _claim_batch(t, queue, batch_size, claims, capacity=None)
+
+    Locks ``t`` together with up to ``batch_size - 1`` other ready tasks (which
+    would also run in the main thread, fit in ``capacity``, and are not already
+    in ``claims``) using a single call to ``store.lock_many``. The other tasks
+    are returned to the queue.
+
+    Returns
+    -------
+    claims : dict
+        Maps each task in the batch to whether its lock was acquired (or None
+        if the store does not support batched locking)
+    '''
+    from .resources import fits, parse_resources
+    batch = [t]
+    popped = []
+    while len(batch) < batch_size:
+        nt = queue.pop()
+        if nt is None:
+            break
+        popped.append(nt)
+        if _executor_kind(nt) is not None:
+            break
+        if nt in claims or not nt.persist:
+            continue
+        if capacity is not None and not fits(parse_resources(nt.resources), {}, capacity):
+            continue
+        batch.append(nt)
+    for nt in popped:
+        queue.push_back(nt)
+    try:
+        locked = t.store.lock_many([nt.hash() for nt in batch])
+    except NotImplementedError:
+        return None
+    return dict(zip(batch, locked))
+
+
+class _ClaimGroup:
+    '''
+    Tasks locked together (see _claim_batch and _claim_chain). The locks of
+    the finished ones are released together once all of them are finished.
+    '''
+    def __init__(self, tasks):
+        self.nr_unfinished = len(tasks)
+        self.finished = []
+
+
+def _add_claims(new_claims, claims, claim_groups):
+    '''
+    _add_claims(new_claims, claims, claim_groups)
+
+    Adds the tasks locked together in ``new_claims`` (as returned by
+    _claim_batch or _claim_chain) to ``claims`` and their group (if they were
+    locked) to ``claim_groups``
+    '''
+    claims.update(new_claims)
+    group = _ClaimGroup([ct for ct, locked in new_claims.items() if locked])
+    for ct, locked in new_claims.items():
+        if locked:
+            claim_groups[ct] = group
+
+
+def _finish_claim(t, claim_groups, pending_writes, release=True):
+    '''
+    failed = _finish_claim(t, claim_groups, pending_writes, release=True)
+
+    Records that the claimed task ``t`` is finished (its lock is to be
+    released, unless ``release`` is False). Once all the tasks of its group
+    are finished, their locks are released (after saving the results which
+    are being saved in the background, see _finish_writes).
+
+    Returns whether saving any of those results failed
+    '''
+    group = claim_groups.pop(t, None)
+    if group is None:
+        return False
+    if release:
+        group.finished.append(t.hash())
+    group.nr_unfinished -= 1
+    failed = False
+    if not group.nr_unfinished and group.finished:
+        if pending_writes:
+            failed = _finish_writes(pending_writes)
+        t.store.release_many(group.finished)
+    return failed
+
+
+def _claim_chain(t, links):
+    '''
+    claims = _claim_chain(t, links)
+
+    Locks ``t`` together with the tasks in ``links`` (see
+    ``ReadyQueue.chain``) using a single call to ``store.lock_many``. The chain
+    is cut at the first link which could not be locked (the locks on the
+    links after it are released, as they would have to wait for it anyway).
+
+    Returns
+    -------
+    claims : dict
+        Maps ``t`` and the links which are to be run in this process to
+        whether their lock was acquired (or None if the store does not
+        support batched locking)
+    '''
+    try:
+        locked = t.store.lock_many([ct.hash() for ct in [t] + links])
+    except NotImplementedError:
+        return None
+    claims = {t: locked[0]}
+    release = []
+    cut = not locked[0]
+    for ct, ct_locked in zip(links, locked[1:]):
+        if not ct_locked:
+            cut = True
+        elif cut:
+            release.append(ct.hash())
         else:
-            raise
+            claims[ct] = True
+    if release:
+        t.store.release_many(release)
+    return claims
 
-    # The store may have been changed by the jugfile.
-    store = task.Task.store
-    return store, jugspace
+
+def _finish_writes(writes, max_pending=0):
+    '''
+    failed = _finish_writes(writes, max_pending=0)
+
+    Waits for the results which are being saved in the background until at
+    most ``max_pending`` are left (writes which are already finished are
+    always collected).
+
+    ``writes`` is a list of ``(task, future, unlock)`` in the order in which
+    they were submitted. If ``unlock`` is true, the lock of the task is
+    released once its result is saved (or saving failed, so that the task can
+    be run again).
+
+    Returns
+    -------
+    failed : bool
+        Whether any result could not be saved
+    '''
+    failed = False
+    while writes and (len(writes) > max_pending or writes[0][1].done()):
+        t, f, unlock = writes.pop(0)
+        try:
+            f.result()
+        except Exception as e:
+            failed = True
+            logging.critical('Could not save the result of %s: %s' % (t.name, e))
+        finally:
+            if unlock:
+                t.unlock()
+    return failed
+
+
+def _prefetch(t):
+    '''
+    _prefetch(t)
+
+    Loads the results of the dependencies of ``t`` (this is run in a
+    background thread while the previous task runs). Errors are ignored: the
+    results will be loaded again (and the errors reported) when ``t`` runs.
+    '''
+    for dep in t.dependencies():
+        if dep.persist and not dep.is_loaded():
+            try:
+                dep.value()
+            except Exception as e:
+                logging.debug('jug: could not prefetch %s (%s)', dep.name, e)
+
+
+def _update_result_cache(cache, t, running, pinned=()):
+    '''
+    _update_result_cache(cache, t, running, pinned=())
+
+    Records that ``t`` (and its dependencies) were just used and unloads
+    results if needed to stay within the budget, except for those used by
+    tasks still running (in ``running``) and those in ``pinned``.
+    '''
+    cache.use(t)
+    pinned = set(pinned)
+    for rt, _ in running.values():
+        pinned.add(rt)
+        pinned.update(rt.dependencies())
+    cache.evict(pinned)
+
+
+def _find_straggler(queue, runtimes, factor, speculated):
+    '''
+    t = _find_straggler(queue, runtimes, factor, speculated)
+
+    Looks for a task that has been running in another process for longer than
+    ``factor`` times its median runtime (based on the age of its lock).
+
+    Returns
+    -------
+    t : Task or None
+    '''
+    from statistics import median
+    for t in queue.elsewhere():
+        if t in speculated:
+            continue
+        samples = runtimes.get(t.name)
+        if not samples:
+            continue
+        lock = t.store.getlock(t.hash())
+        if lock.is_failed():
+            continue
+        age = lock.age()
+        if age is not None and age > factor * median(samples):
+            return t
+    return None
+
+
+def _speculate(t, options):
+    '''
+    executed = _speculate(t, options)
+
+    Runs ``t`` (which is locked by another process) without taking its lock.
+    Whichever copy finishes first saves the result, which is harmless as
+    saving is atomic and both copies compute the same result.
+    '''
+    logging.info('Speculatively executing %s (running elsewhere for too long)...' % t.name)
+    jug_hook('execute.task-pre-execute', (t,))
+    try:
+        t.run(debug_mode=options.debug)
+    except Exception as e:
+        # The original copy may still succeed, so this is not a failure
+        logging.warning('jug: speculative execution of %s failed (%s)', t.name, e)
+        return False
+    return True
+
+
+def _pop_fitting(t, queue, capacity, in_use):
+    '''
+    t = _pop_fitting(t, queue, capacity, in_use)
+
+    Starting with ``t`` (just returned by ``queue.pop()``), finds the first
+    ready task whose resources fit in ``capacity`` together with those
+    ``in_use``. Tasks which do not fit now are returned to the queue, while
+    those which could never fit on this node are left for other processes
+    (see ``ReadyQueue.too_large``).
+
+    Returns
+    -------
+    t : Task or None
+    '''
+    from .resources import fits, parse_resources
+    deferred = []
+    while t is not None:
+        needs = parse_resources(t.resources)
+        if fits(needs, in_use, capacity):
+            break
+        if fits(needs, {}, capacity):
+            deferred.append(t)
+        else:
+            logging.warning('jug: not running %s (it needs more resources than this node has)', t.name)
+            # Not ``running_elsewhere``: --speculate would run it here
+            queue.too_large(t)
+            jug_hook('execute.task-too-large', (t,))
+        t = queue.pop()
+    for dt in deferred:
+        queue.push_back(dt)
+    return t
+
+
+def _update_resources(in_use, t, sign):
+    from .resources import parse_resources
+    for k, v in parse_resources(t.resources).items():
+        in_use[k] += sign * v
+
+
+def _retries(t, options):
+    '''
+    retries, backoff = _retries(t, options)
+
+    Returns the number of retries for ``t`` and the initial backoff (the task
+    hints take precedence over the command line options)
+    '''
+    retries = (t.retries if t.retries is not None else options.execute_retries)
+    backoff = (t.retry_backoff if t.retry_backoff is not None else options.execute_retry_backoff)
+    return int(retries or 0), float(backoff)
+
+
+def _attempts_key(t):
+    return t.hash() + b'-attempts'
+
+
+def _retry_delay(t, options):
+    '''
+    delay = _retry_delay(t, options)
+
+    Records a failed attempt at running ``t`` and returns how long to wait
+    before running it again (or None if it should not be retried).
+
+    The number of attempts is kept in the store (next to the result), so
+    that it is shared between all processes.
+    '''
+    retries, backoff = _retries(t, options)
+    if not retries:
+        return None
+    key = _attempts_key(t)
+    try:
+        attempts = (t.store.load(key) if t.store.can_load(key) else 0) + 1
+        t.store.dump(attempts, key)
+    except Exception as e:
+        logging.warning('jug: could not record the number of attempts for %s (%s)', t.name, e)
+        return None
+    if attempts > retries:
+        # The next run starts counting again
+        t.store.remove(key)
+        return None
+    delay = backoff * 2 ** (attempts - 1)
+    logging.warning('Task %s failed (attempt %s of %s). Retrying in %.1f seconds.', t.name, attempts, retries + 1, delay)
+    return delay
+
+
+def _executor_kind(t):
+    '''
+    kind = _executor_kind(t)
+
+    Returns 'async' (for coroutine functions), 'thread', or None (which means
+    that the task runs in the main thread or in a worker process)
+    '''
+    if inspect.iscoroutinefunction(t.f):
+        return 'async'
+    return t.executor
+
+
+_pool_tasks = []
+# Shared with the worker processes: the PID of the worker which holds the
+# lock of the task with that index in ``_pool_tasks`` (or 0). If a worker
+# dies, the parent releases these locks (see _shutdown_broken_pool)
+_pool_workers = None
+# In each worker process, the results kept with --memory-budget
+_worker_cache = None
+def _pool_run_task(index, debug, keep_failed, isolation=None, memory_budget=None):
+    '''
+    status = _pool_run_task(index, debug, keep_failed, isolation=None, memory_budget=None)
+
+    Runs inside a forked worker process. The task is looked up by its index
+    in ``_pool_tasks``, which the child inherited from the parent when it was
+    forked (together with the already computed hashes and any results that
+    were loaded at that point).
+
+    The results which the task loads are kept within ``memory_budget`` (see
+    ResultCache) for the next tasks run by this worker or, without a budget,
+    unloaded once it has run.
+    '''
+    global _worker_cache
+    t = _pool_tasks[index]
+    used = _loaded_by(t)
+    inherited = set(u for u in used if u.is_loaded())
+    def on_lock():
+        _pool_workers[index] = os.getpid()
+    try:
+        return _lock_and_run(t, debug, keep_failed, isolation, on_lock=on_lock)
+    finally:
+        _pool_workers[index] = 0
+        # The parent never sees this result, so there is no point in keeping it
+        t.unload()
+        if memory_budget is not None:
+            if _worker_cache is None:
+                from .result_cache import ResultCache
+                _worker_cache = ResultCache(memory_budget)
+            for u in used:
+                if u not in inherited or u in _worker_cache.sizes:
+                    _worker_cache.touch(u)
+            _worker_cache.evict()
+        else:
+            for u in used:
+                if u not in inherited:
+                    u.unload()
+
+
+def _loaded_by(t):
+    '''
+    used = _loaded_by(t)
+
+    Returns the tasks whose results are loaded to run ``t``: its dependencies
+    and, for those which are not persisted (and are computed instead), their
+    dependencies in turn.
+    '''
+    used = []
+    seen = set()
+    deps = list(t.dependencies())
+    while deps:
+        dep = deps.pop()
+        if id(dep) in seen:
+            continue
+        seen.add(id(dep))
+        used.append(dep)
+        if not dep.persist:
+            deps.extend(dep.dependencies())
+    return used
+
+
+def _start_worker_pool(tasks, nr_jobs):
+    '''
+    pool = _start_worker_pool(tasks, nr_jobs)
+
+    Returns a pool of ``nr_jobs`` forked worker processes (or ``None`` if
+    this is not possible in the current setting, in which case execution
+    should proceed serially).
+    '''
+    import multiprocessing
+    from .backends.dict_store import dict_store
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        logging.warning('jug: parallel execution requires `fork`, which is not available. Running serially.')
+        return None
+    if isinstance(task.Task.store, dict_store):
+        logging.warning('jug: dict_store does not support multiple processes. Running serially.')
+        return None
+
+    global _pool_workers
+    # Hash everything in the parent so that the workers inherit the hashes
+    # instead of each recomputing them:
+    for t in tasks:
+        t.hash()
+    _pool_tasks[:] = tasks
+    _pool_workers = multiprocessing.get_context('fork').RawArray('i', len(tasks))
+    return _new_worker_pool(nr_jobs)
+
+
+def _new_worker_pool(nr_jobs):
+    '''
+    pool = _new_worker_pool(nr_jobs)
+
+    Forks ``nr_jobs`` worker processes. This must not be called while other
+    threads are busy (see _wait_for_threads).
+    '''
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    pool = ProcessPoolExecutor(nr_jobs, mp_context=multiprocessing.get_context('fork'))
+    # Otherwise, the workers are only forked when the first task is
+    # submitted, by which time other threads may be running
+    pool.submit(int).result()
+    return pool
+
+
+def _wait_for_threads(running, prefetching, reason):
+    '''
+    _wait_for_threads(running, prefetching, reason)
+
+    Waits until the tasks running in other threads (in ``running``) and the
+    ``prefetching`` futures are done. The child of a fork only gets the
+    calling thread: if another one held a lock at that point (loading a
+    result, logging, ...), the child could deadlock.
+    '''
+    from concurrent.futures import wait
+    busy = [f for f, (rt, _) in running.items() if _executor_kind(rt) is not None]
+    busy.extend(prefetching)
+    if busy:
+        logging.info('Waiting for %s tasks in other threads before %s...' % (len(busy), reason))
+        wait(busy)
+
+
+def _shutdown_broken_pool(pool, indices):
+    '''
+    held, crashed = _shutdown_broken_pool(pool, indices)
+
+    Shuts down ``pool`` after one of its worker processes died, and finds
+    out which of the tasks submitted to it (given by their ``indices`` in
+    ``_pool_tasks``) had been started.
+
+    Returns
+    -------
+    held : list of Task
+        Tasks whose lock was left behind by a worker
+    crashed : list of Task
+        The subset of ``held`` which may have made their worker die (the
+        other workers are stopped with SIGTERM when one of them dies)
+    '''
+    import signal
+    # ``_processes`` is private, but it is the only way to find out how each
+    # worker ended
+    processes = dict(getattr(pool, '_processes', None) or {})
+    pool.shutdown(wait=True)
+    held = []
+    crashed = []
+    for i in indices:
+        pid = _pool_workers[i]
+        if not pid:
+            continue
+        t = _pool_tasks[i]
+        held.append(t)
+        p = processes.get(pid)
+        if p is None or p.exitcode != -signal.SIGTERM:
+            crashed.append(t)
+    if not crashed:
+        # We cannot tell (e.g., SIGTERM was sent by someone else)
+        crashed = held
+    return held, crashed
+
+
+def _release_pool_locks():
+    '''
+    _release_pool_locks()
+
+    Releases the locks left behind by worker processes which died
+    '''
+    for i, t in enumerate(_pool_tasks):
+        if _pool_workers[i]:
+            _pool_workers[i] = 0
+            t.store.getlock(t.hash()).release()
+
+
+def _report_failure(t, e, options, has_dependents):
+    if options.pdb:
+        from .internal.debugger import debug_exception
+        debug_exception()
+    else:
+        logging.critical('Exception while running %s: %s' % (t.name,e))
+        if has_dependents:
+            logging.critical('Other tasks are dependent on this one! Parallel processors will be held waiting!')
 
 
 def execution_loop(tasks, options):
-    from time import sleep
+    from concurrent.futures import wait, FIRST_COMPLETED, ThreadPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    from time import time, sleep
+    from .scheduler import ReadyQueue, load_runtimes, save_runtimes
+    from .result_cache import ResultCache
+    from .resources import node_capacity, fits, parse_resources
 
     logging.info('Execute start (%s tasks)' % len(tasks))
 
@@ -127,76 +1024,390 @@ def execution_loop(tasks, options):
         tasks = [t for t in tasks if task_matcher(t.name)]
         logging.info('Non-matching tasks discarded. Remaining (%s tasks)' % len(tasks))
 
+    speculate = options.execute_speculate
+    record_runtimes = options.execute_record_runtimes or options.execute_schedule == 'critical-path' or bool(speculate)
+    previous_runtimes = None
+    if (options.execute_schedule == 'critical-path' or speculate) and tasks:
+        previous_runtimes = load_runtimes(task.Task.store)
+    queue = ReadyQueue(tasks, policy=options.execute_schedule, runtimes=previous_runtimes)
+    # Maps task names to lists of runtimes measured in this run
+    runtimes = defaultdict(list)
     # For the special (but common) case where most (if not all) of the tasks
-    # can be loaded directly, just skip them as fast as possible:
-    first_unloadable = 0
-    while (first_unloadable < len(tasks)) and tasks[first_unloadable].can_load():
-        t = tasks[first_unloadable]
-        jug_hook('execute.task-loadable', (tasks[first_unloadable],))
-        first_unloadable += 1
-    del tasks[:first_unloadable]
+    # can be loaded directly, this skips them in bulk
+    for t in queue.refresh():
+        jug_hook('execute.task-loadable', (t,))
 
     if options.debug:
         start_task_set = set([id(t) for t in task.alltasks])
 
+    nr_jobs = int(options.execute_jobs)
+    nr_threads = int(options.execute_threads)
+    # Tasks run in the main thread or in worker processes can be run in
+    # (further) child processes, see _run_isolated
+    isolation = _isolation_settings(options)
+    pool = None
+    if nr_jobs > 1 and len(queue):
+        pool = _start_worker_pool(tasks, nr_jobs)
+        pool_index = dict((id(t), i) for i, t in enumerate(_pool_tasks))
+    thread_pool = None
+    async_executor = None
+    # Maximum number of tasks running at the same time for each kind of
+    # executor (see _executor_kind)
+    limits = {
+        'thread': nr_threads,
+        'async': int(options.execute_async_concurrency),
+        }
+    if pool is not None:
+        limits[None] = nr_jobs
+    # Maps futures (of tasks submitted to worker processes or threads) to
+    # their tasks (and start times)
+    running = {}
+    # With --lock-batch (and for chains), tasks locked in advance (see
+    # _claim_batch) and the groups of tasks locked together (see _ClaimGroup)
+    lock_batch = int(options.execute_lock_batch)
+    cache = None
+    if options.execute_memory_budget is not None:
+        cache = ResultCache(options.execute_memory_budget)
+    claims = {}
+    claim_groups = {}
+    # The tasks of the last batch which have not been run yet (they are run
+    # next so that the batch is finished quickly)
+    batch = []
+
+    # Resources (see jug.resources) available on this node and used by the
+    # tasks in ``running``. These are only tracked if any task declares them
+    capacity = None
+    if any(t.resources for t in tasks):
+        capacity = node_capacity(options.execute_resources)
+    in_use = defaultdict(float)
+
+    # Created the first time that we need to wait for other processes
+    watcher = None
+    # Tasks which were speculatively executed (see _find_straggler)
+    speculated = set()
+    # Tasks which failed and were returned to the queue (see _retry_delay)
+    retried = set()
+
+    # Linear chains of tasks (see ReadyQueue.chain) are locked together and
+    # run one after the other, passing the results in memory. ``chain`` holds
+    # the links which have not been run yet. Results of the links which are
+    # used by the next one are saved in the background (by ``writer``) and
+    # their locks are only released once saving is finished
+    fuse = options.execute_fuse and isolation is None
+    chain = []
+    # With --write-behind, this is done for all tasks run in the main thread
+    # (with at most ``write_behind`` results waiting to be saved)
+    write_behind = None
+    if options.execute_write_behind is not None and isolation is None:
+        write_behind = max(1, int(options.execute_write_behind))
+    writer = None
+    pending_writes = []
+
+    # With --prefetch, the dependencies of the next task are loaded (by
+    # ``prefetcher``) while the current one runs
+    prefetcher = None
+    prefetching = []
 
     failures = False
-    prevtask = None
-    while tasks:
-        upnext = [] # tasks that can be run
-        nr_wait_cycles = int(options.execute_nr_wait_cycles)
-        for i in range(nr_wait_cycles):
-            max_cannot_run = min(len(tasks), 128)
-            if i == nr_wait_cycles - 1:
-                # in the last loop iteration, check all tasks to ensure we don't miss any
-                max_cannot_run = len(tasks)
-            for i in range(max_cannot_run):
-                # The argument for this is the following:
-                # if T' is dependent on the result of T, it is better if the
-                # processor that ran T, also runs T'. By having everyone else
-                # push T' to the end of tasks, this is more likely to happen.
-                #
-                # Furthermore, this avoids always querying the same tasks.
-                if tasks[0].can_run():
+    try:
+        while True:
+            # Tasks submitted to worker processes when one of them died
+            # (e.g., killed for using too much memory)
+            broken = []
+            for f in [f for f in running if f.done()]:
+                t, start = running.pop(f)
+                if capacity is not None:
+                    _update_resources(in_use, t, -1)
+                try:
+                    status = f.result()
+                except BrokenProcessPool as e:
+                    broken.append((t, e))
+                    continue
+                except Exception as e:
+                    retry = _retry_delay(t, options)
+                    if retry is not None:
+                        # Tasks which fail in isolation keep their lock
+                        if isinstance(e, TaskIsolationError):
+                            t.store.getlock(t.hash()).release()
+                        retried.add(t)
+                        queue.retry(t, retry)
+                        continue
+                    failures = True
+                    queue.failed(t)
+                    # The task has already been marked as failed (if
+                    # execute_keep_failed) and the lock released. Tasks with
+                    # retries were run without keep_failed and are locked
+                    # again to be marked as failed
+                    if options.execute_keep_failed and _retries(t, options)[0] and not t.is_failed() and t.lock():
+                        t.fail()
+                    _report_failure(t, e, options, queue.has_dependents(t))
+                    if not options.execute_keep_going and not isinstance(e, TaskIsolationError):
+                        raise
+                    continue
+                if status == 'loadable':
+                    queue.done(t)
+                    jug_hook('execute.task-loadable', (t,))
+                elif status == 'executed':
+                    runtimes[t.name].append(time() - start)
+                    queue.done(t)
+                    if t in retried:
+                        t.store.remove(_attempts_key(t))
+                    if cache is not None and _executor_kind(t) is not None:
+                        _update_result_cache(cache, t, running)
+                    jug_hook('execute.task-executed1', (t,))
+                else:
+                    queue.running_elsewhere(t)
+                    logging.info('Already in execution %s...' % t.name)
+            if broken:
+                logging.warning('jug: a worker process died. Starting new workers.')
+                held, crashed = _shutdown_broken_pool(pool, [pool_index[id(bt)] for bt, _ in broken])
+                _wait_for_threads(running, prefetching, 'starting new workers')
+                pool = _new_worker_pool(nr_jobs)
+                for bt, e in broken:
+                    # Any lock left behind is handled here (or, if we stop
+                    # early, by _release_pool_locks)
+                    _pool_workers[pool_index[id(bt)]] = 0
+                    lock = bt.store.getlock(bt.hash())
+                    if bt not in crashed:
+                        # Not started or stopped because another worker died
+                        if bt in held:
+                            lock.release()
+                        queue.push_back(bt)
+                        continue
+                    retry = _retry_delay(bt, options)
+                    if retry is not None:
+                        lock.release()
+                        retried.add(bt)
+                        queue.retry(bt, retry)
+                        continue
+                    failures = True
+                    queue.failed(bt)
+                    if options.execute_keep_failed:
+                        lock.fail()
+                    else:
+                        lock.release()
+                    _report_failure(bt, e, options, queue.has_dependents(bt))
+                    if not options.execute_keep_going:
+                        raise e
+
+            if options.aggressive_unload:
+                # Results are unloaded as soon as no task in the queue needs
+                # them any longer
+                for ut in queue.unused():
+                    ut.unload()
+
+            t = None
+            while chain:
+                ct = chain.pop(0)
+                if queue.is_ready(ct):
+                    t = ct
                     break
-                tasks.append(tasks.pop(0))
-            while tasks and tasks[0].can_run():
-                upnext.append(tasks.pop(0))
-            if upnext:
-                break
-            for ti,t in enumerate(tasks):
-                if t.can_run():
-                    upnext.append(tasks.pop(ti))
+                # The previous link failed: the remaining ones are returned
+                for ct in [ct] + chain:
+                    if claims.pop(ct, False):
+                        failures = _finish_claim(ct, claim_groups, pending_writes) or failures
+                del chain[:]
+            while t is None and batch:
+                bt = batch.pop(0)
+                if not queue.is_ready(bt) or bt not in claims:
+                    continue
+                # Otherwise, it is left in the queue
+                if capacity is None or fits(parse_resources(bt.resources), in_use, capacity):
+                    t = bt
+            if t is None:
+                t = queue.pop()
+                if capacity is not None:
+                    t = _pop_fitting(t, queue, capacity, in_use)
+            if t is not None and not t.persist:
+                # Computed when needed by the tasks that depend on it
+                queue.done(t)
+                continue
+            if t is not None:
+                kind = _executor_kind(t)
+                limit = limits.get(kind)
+                if limit is not None and sum(1 for (rt,_) in running.values() if _executor_kind(rt) == kind) >= limit:
+                    queue.push_back(t)
+                    wait(running, return_when=FIRST_COMPLETED)
+                    continue
+            if t is None:
+                if running:
+                    # Wake up when a task which failed may be retried
+                    wait(running, timeout=queue.retry_delay(), return_when=FIRST_COMPLETED)
+                    continue
+                if pending_writes:
+                    # Other processes may be waiting for these results
+                    failures = _finish_writes(pending_writes) or failures
+                if not len(queue):
                     break
-            if upnext:
-                break
-            logging.info('waiting %s secs for an open task...' % options.execute_wait_cycle_time)
-            sleep(int(options.execute_wait_cycle_time))
-        if not upnext:
-            logging.info('No tasks can be run!')
-            break
-        for t in upnext:
-            if t.can_load():
-                jug_hook('execute.task-loadable', (t,))
+                delay = queue.retry_delay()
+                if delay is not None:
+                    # Waiting for a retry does not count as a wait cycle
+                    sleep(delay)
+                    continue
+                wait_cycle_time = float(options.execute_wait_cycle_time)
+                # The watcher may wake up for writes which do not concern us,
+                # so the time spent waiting is limited by a deadline (not by
+                # the number of wake ups)
+                deadline = time() + int(options.execute_nr_wait_cycles) * wait_cycle_time
+                # The watcher is created before checking the store so that
+                # results written in the meanwhile are not missed
+                if watcher is None:
+                    watcher = task.Task.store.watch()
+                gave_up = False
+                # The names of the results written since the last check (if
+                # known, otherwise the whole store is checked)
+                written = None
+                while True:
+                    for ft in queue.refresh(written):
+                        jug_hook('execute.task-loadable', (ft,))
+                    if queue.has_ready() or not len(queue):
+                        break
+                    if speculate:
+                        estimates = dict(previous_runtimes)
+                        for name, ts in runtimes.items():
+                            estimates[name] = estimates.get(name, []) + ts
+                        st = _find_straggler(queue, estimates, float(speculate), speculated)
+                        if st is not None:
+                            speculated.add(st)
+                            start = time()
+                            if _speculate(st, options):
+                                runtimes[st.name].append(time() - start)
+                                queue.done(st)
+                                jug_hook('execute.task-executed1', (st,))
+                            break
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        gave_up = True
+                        break
+                    logging.info('waiting %s secs for an open task...' % options.execute_wait_cycle_time)
+                    changed = watcher.wait(min(wait_cycle_time, remaining))
+                    written = (changed if changed and changed is not True else None)
+                if gave_up:
+                    logging.info('No tasks can be run!')
+                    break
+                continue
+
+            queue.start(t)
+            if pending_writes:
+                # Results which were unloaded need to be saved before they can
+                # be loaded again
+                being_written = set(wt for wt, _, _ in pending_writes)
+                if any(dep in being_written and not dep.is_loaded() for dep in t.dependencies()):
+                    failures = _finish_writes(pending_writes) or failures
+            if capacity is not None and (kind is not None or pool is not None):
+                # Released when the future is done
+                _update_resources(in_use, t, +1)
+            # Tasks which may be retried are only marked as failed after the
+            # last attempt
+            keep_failed = options.execute_keep_failed and not _retries(t, options)[0]
+            if kind == 'async':
+                if async_executor is None:
+                    async_executor = _AsyncExecutor()
+                jug_hook('execute.task-pre-execute', (t,))
+                f = async_executor.submit(_lock_and_run_async(t, options.debug, keep_failed))
+                running[f] = (t, time())
+                continue
+            if kind == 'thread':
+                if thread_pool is None:
+                    thread_pool = ThreadPoolExecutor(nr_threads)
+                jug_hook('execute.task-pre-execute', (t,))
+                f = thread_pool.submit(_lock_and_run, t, options.debug, keep_failed)
+                running[f] = (t, time())
                 continue
+            if pool is not None:
+                jug_hook('execute.task-pre-execute', (t,))
+                try:
+                    f = pool.submit(_pool_run_task, pool_index[id(t)], options.debug, keep_failed, isolation, options.execute_memory_budget)
+                except BrokenProcessPool:
+                    # A worker died since we last checked: the tasks which
+                    # were submitted to the pool are handled (and the pool
+                    # replaced) in the next iteration
+                    if capacity is not None:
+                        _update_resources(in_use, t, -1)
+                    queue.push_back(t)
+                    submitted = [f for f, (rt, _) in running.items() if _executor_kind(rt) is None]
+                    if submitted:
+                        wait(submitted)
+                    else:
+                        _shutdown_broken_pool(pool, [])
+                        _wait_for_threads(running, prefetching, 'starting new workers')
+                        pool = _new_worker_pool(nr_jobs)
+                    continue
+                running[f] = (t, time())
+                continue
+            if fuse and t not in claims:
+                links = queue.chain(t, accept=lambda ct: _executor_kind(ct) is None and ct.persist and not ct.resources)
+                if links:
+                    chain_claims = _claim_chain(t, links)
+                    if chain_claims is None:
+                        fuse = False
+                    else:
+                        _add_claims(chain_claims, claims, claim_groups)
+                        chain = [ct for ct in links if ct in chain_claims]
+            if lock_batch > 1 and t not in claims:
+                batch_claims = _claim_batch(t, queue, lock_batch, claims, capacity)
+                if batch_claims is None:
+                    logging.warning('jug: store does not support batched locking (ignoring --lock-batch)')
+                    lock_batch = 1
+                else:
+                    _add_claims(batch_claims, claims, claim_groups)
+                    batch = [bt for bt, locked in batch_claims.items() if locked and bt is not t]
             locked = False
             task_failed = False
+            isolation_failure = False
+            # Whether the lock is released after the result is saved in the
+            # background
+            unlock_after_write = False
+            claimed = t in claims
+            # Whether the next link of a chain uses the result of ``t``
+            fused = bool(chain)
             try:
-                locked = t.lock()
-                if t.can_load(): # This can be true if the task ran between the check above and this one
+                if claimed:
+                    locked = claims.pop(t)
+                else:
+                    locked = t.lock()
+                if t.can_load(): # This can be true if the task ran since we last checked
+                    queue.done(t)
                     jug_hook('execute.task-loadable', (t,))
                 elif locked:
                     logging.info('Executing %s...' % t.name)
                     jug_hook('execute.task-pre-execute', (t,))
 
-                    if options.aggressive_unload:
-                        if prevtask is not None:
-                            active = set(id(d) for d in t.dependencies())
-                            for d in itertools.chain(prevtask.dependencies(), [prevtask]):
-                                if id(d) not in active:
-                                    d.unload()
-                        prevtask = t
-                    t.run(debug_mode=options.debug)
+                    after_fork = None
+                    if options.execute_prefetch:
+                        nt = (chain[0] if chain else queue.peek())
+                        if nt is not None:
+                            if prefetcher is None:
+                                prefetcher = ThreadPoolExecutor(1)
+                            if isolation is None:
+                                prefetching.append(prefetcher.submit(_prefetch, nt))
+                            else:
+                                # Only once the child has been forked (see
+                                # below)
+                                after_fork = (lambda nt=nt: prefetching.append(prefetcher.submit(_prefetch, nt)))
+                    if isolation is not None:
+                        _wait_for_threads(running, prefetching, 'running %s in isolation' % t.name)
+                    prefetching[:] = [f for f in prefetching if not f.done()]
+                    save_behind = fused or write_behind is not None
+                    if save_behind:
+                        if writer is None:
+                            writer = ThreadPoolExecutor(1)
+                        # Makes room for the result of ``t``
+                        max_pending = (write_behind - 1 if write_behind is not None else len(pending_writes))
+                        failures = _finish_writes(pending_writes, max_pending) or failures
+                    start = time()
+                    if save_behind:
+                        t.run(save=False, debug_mode=options.debug)
+                        unlock_after_write = not claimed
+                        pending_writes.append((t, writer.submit(t.store.dump, t._result, t.hash()), unlock_after_write))
+                    else:
+                        _run_task(t, options.debug, isolation, after_fork)
+                    runtimes[t.name].append(time() - start)
+                    queue.done(t)
+                    if t in retried:
+                        t.store.remove(_attempts_key(t))
+                    if cache is not None:
+                        _update_result_cache(cache, t, running, pinned=([t] if fused else ()))
                     jug_hook('execute.task-executed1', (t,))
                     if options.debug:
                         for nt in task.alltasks:
@@ -204,36 +1415,73 @@ def execution_loop(tasks, options):
                                 raise RuntimeError('Creating tasks while executing another task is not supported.\n'
                                             'Error detected while running task `{0}`'.format(t.name))
                 else:
+                    queue.running_elsewhere(t)
                     logging.info('Already in execution %s...' % t.name)
             except SystemExit:
                 raise
             except Exception as e:
+                retry = _retry_delay(t, options)
+                if retry is not None:
+                    # The lock is released below
+                    retried.add(t)
+                    queue.retry(t, retry)
+                    continue
                 failures = task_failed = True
+                queue.failed(t)
+                _report_failure(t, e, options, queue.has_dependents(t))
 
-                if options.pdb:
-                    from .internal.debugger import debug_exception
-                    debug_exception()
-                else:
-                    logging.critical('Exception while running %s: %s' % (t.name,e))
-                    for other in itertools.chain(upnext, tasks):
-                        for dep in other.dependencies():
-                            if dep is t:
-                                logging.critical('Other tasks are dependent on this one! Parallel processors will be held waiting!')
-
-                if options.execute_keep_failed:
+                # Tasks which failed in isolation are marked as failed and
+                # execution continues
+                isolation_failure = isinstance(e, TaskIsolationError)
+                if options.execute_keep_failed or isolation_failure:
                     t.fail()
 
-                if not options.execute_keep_going:
+                if not options.execute_keep_going and not isolation_failure:
                     raise
 
             finally:
                 if locked:
-                    # We only keep the lock if task failed and keep_failed is enabled.
-                    if not (task_failed and options.execute_keep_failed):
+                    # We only keep the lock if task failed and keep_failed is
+                    # enabled (or it failed in isolation)
+                    keep_lock = task_failed and (options.execute_keep_failed or isolation_failure)
+                    if claimed:
+                        failures = _finish_claim(t, claim_groups, pending_writes, release=not keep_lock) or failures
+                    elif not keep_lock and not unlock_after_write:
                         t.unlock()
 
-            if options.aggressive_unload and prevtask is not None:
-                prevtask.unload()
+    finally:
+        # Tasks which have not started yet are dropped, but the ones already
+        # running are allowed to finish (they hold locks)
+        for f, (t, _) in running.items():
+            # Cancelling a coroutine would interrupt it even if it has started
+            if _executor_kind(t) != 'async':
+                f.cancel()
+        # Claimed tasks which were not run are returned (together with the
+        # finished tasks of their groups)
+        to_release = [ct.hash() for ct, locked in claims.items() if locked]
+        for group in set(claim_groups.values()):
+            to_release.extend(group.finished)
+        if pending_writes:
+            failures = _finish_writes(pending_writes) or failures
+        if to_release:
+            task.Task.store.release_many(to_release)
+        if writer is not None:
+            writer.shutdown(wait=True)
+        if prefetcher is not None:
+            prefetcher.shutdown(wait=True)
+        if watcher is not None:
+            watcher.close()
+        if async_executor is not None:
+            async_executor.shutdown()
+        if thread_pool is not None:
+            thread_pool.shutdown(wait=True)
+        if pool is not None:
+            pool.shutdown(wait=True)
+            _release_pool_locks()
+            del _pool_tasks[:]
+        tasks[:] = queue.remaining()
+        if record_runtimes:
+            save_runtimes(task.Task.store, runtimes)
 
     return failures
 
@@ -248,12 +1496,15 @@ def main(argv=None):
     options = parse(argv[1:])
     jugspace = None
     store = None
+    if options.hash_algorithm:
+        from .hash import set_hash_algorithm
+        set_hash_algorithm(options.hash_algorithm)
 
 
     try:
         if options.subcommand not in ('demo', 'install-skills', 'status', 'execute', 'webstatus', 'test-jug'):
             on_error = ('propagate' if options.pdb else 'exit')
-            store, jugspace = init(options.jugfile, options.jugdir, on_error=on_error)
+            store, jugspace = init(options.jugfile, options.jugdir, on_error=on_error, hash_threads=options.hash_threads)
         from .subcommands import cmdapi
         retval = cmdapi.run(options.subcommand, options=options, store=store, jugspace=jugspace)
     except:
@@ -28,6 +28,8 @@ Options
 - jugfile: filesystem name for the Jugfile
 - cmd: command to run.
 - aggressive_unload: --aggressive-unload
+- hash_algorithm: --hash-algorithm
+- hash_threads: --hash-threads
 - invalid_name: --invalid
 - argv: Arguments not captured by jug (for script use)
 - print_out: Print function to be used for output (behaves like Python3's print)
@@ -75,6 +77,8 @@ def load_default_options(opt):
     opt.jugfile = 'jugfile.py'
     opt.subcommand = None
     opt.aggressive_unload = False
+    opt.hash_algorithm = None
+    opt.hash_threads = None
     opt.invalid_name = None
     opt.argv = None
     opt.print_out = print
@@ -243,6 +247,23 @@ def add_common_options(parser):
 Aggressively unload data from memory. This causes many more reloading of
 information, but is necessary if keeping too much in memory is leading to
 memory errors.''')
+    group.add_argument('--hash-algorithm',
+                       action='store',
+                       dest='hash_algorithm',
+                       metavar='ALGORITHM',
+                       help='''\
+Hash algorithm used to identify tasks in a new jugdir (e.g., sha256 or
+blake2b-20 for a 20 byte blake2b digest). By default, sha1 is used. Existing
+jugdirs keep the algorithm they were created with (see `jug rehash`).''')
+    group.add_argument('--hash-threads',
+                       action='store',
+                       dest='hash_threads',
+                       metavar='N',
+                       type=int,
+                       help='''\
+Compute the hashes of all tasks using N threads after loading the jugfile
+(useful when tasks have large numpy arrays as arguments). By default, each
+hash is computed when first needed.''')
     group.add_argument('--jugdir',
                        action='store',
                        dest='jugdir',
@@ -373,9 +394,11 @@ def set_jugdir(jugdir):
     store : a jug backend
     '''
     from .task import Task
+    from .hash import select_hash_algorithm
     from . import backends
     if jugdir is None:
         jugdir = 'jugdata'
     store = backends.select(jugdir)
+    select_hash_algorithm(store)
     Task.store = store
     return store
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2026, Luis Pedro Coelho <luis@luispedro.org>
+# vim: set ts=4 sts=4 sw=4 expandtab smartindent:
+# LICENSE: MIT
+'''
+resources: resources required by tasks and available on a node
+
+Tasks can declare the resources they need (e.g.,
+``TaskGenerator(resources={'mem': '30G', 'cpus': 16})``). ``jug execute`` only
+starts a task if it fits, together with the tasks it is already running, in
+the capacity of the node. Tasks which can never fit are left for other nodes.
+
+The ``mem`` resource is given in bytes (strings such as ``'30G'`` are parsed
+with ``parse_size``). All other resources (``cpus``, but also any other name,
+such as ``gpus``) are plain numbers.
+'''
+
+from .result_cache import parse_size
+
+__all__ = [
+    'fits',
+    'node_capacity',
+    'parse_resources',
+    ]
+
+
+def parse_resources(resources):
+    '''
+    resources = parse_resources(resources)
+
+    Normalizes a resource specification
+
+    Parameters
+    ----------
+    resources : dict or str or None
+        Either a dictionary (e.g., ``{'mem': '30G', 'cpus': 16}``) or a string
+        (e.g., ``'mem=30G,cpus=16'``)
+
+    Returns
+    -------
+    resources : dict
+        Maps resource names to numbers
+    '''
+    if not resources:
+        return {}
+    if isinstance(resources, str):
+        items = []
+        for tok in resources.split(','):
+            tok = tok.strip()
+            if not tok:
+                continue
+            if '=' not in tok:
+                raise ValueError("jug: cannot parse resource '{}' (expected name=value)".format(tok))
+            k, v = tok.split('=', 1)
+            items.append((k.strip(), v.strip()))
+    else:
+        items = resources.items()
+    parsed = {}
+    for k, v in items:
+        if k == 'mem':
+            v = parse_size(v)
+        else:
+            try:
+                v = float(v)
+            except (TypeError, ValueError):
+                raise ValueError("jug: resource '{}' must be a number (got {!r})".format(k, v))
+        if v < 0:
+            raise ValueError("jug: resource '{}' cannot be negative".format(k))
+        parsed[k] = v
+    return parsed
+
+
+def node_capacity(spec=None):
+    '''
+    capacity = node_capacity(spec=None)
+
+    Returns the resources available on this node. Values in ``spec`` (see
+    ``parse_resources``) take precedence; otherwise, the number of CPUs and
+    the physical memory are detected automatically.
+
+    Returns
+    -------
+    capacity : dict
+    '''
+    import os
+    capacity = {}
+    try:
+        capacity['cpus'] = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        capacity['cpus'] = float(os.cpu_count() or 1)
+    try:
+        capacity['mem'] = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    capacity.update(parse_resources(spec))
+    return capacity
+
+
+def fits(needs, in_use, capacity):
+    '''
+    ok = fits(needs, in_use, capacity)
+
+    Returns whether a task needing ``needs`` can run while ``in_use`` is
+    being used by others. Resources missing from ``capacity`` are not
+    available (except that the amount of memory is unlimited if it could not
+    be determined).
+    '''
+    for k, v in needs.items():
+        if not v:
+            continue
+        if k not in capacity:
+            if k == 'mem':
+                continue
+            return False
+        if in_use.get(k, 0) + v > capacity[k]:
+            return False
+    return True
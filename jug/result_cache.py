@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2026, Luis Pedro Coelho <luis@luispedro.org>
+# vim: set ts=4 sts=4 sw=4 expandtab smartindent:
+# LICENSE: MIT
+'''
+result_cache: keeps the results loaded in memory within a budget
+
+Used by ``jug execute --memory-budget``. Results of tasks which are computed
+or used by ``jug execute`` are tracked in least-recently-used order and, when
+their total (estimated) size exceeds the budget, the least recently used ones
+are unloaded (they will be reloaded from the store if needed again).
+'''
+
+from collections import OrderedDict
+import sys
+
+__all__ = [
+    'ResultCache',
+    'parse_size',
+    'result_size',
+    ]
+
+_SIZE_SUFFIXES = {
+    'K': 1024,
+    'M': 1024**2,
+    'G': 1024**3,
+    'T': 1024**4,
+}
+
+
+def parse_size(size):
+    '''
+    nbytes = parse_size(size)
+
+    Parses a size such as ``'8G'``, ``'512M'``, or ``'1.5T'`` (suffixes are
+    powers of 1024; a trailing ``B`` is optional). Integers are returned
+    unchanged.
+
+    Parameters
+    ----------
+    size : str or int
+
+    Returns
+    -------
+    nbytes : int
+    '''
+    if isinstance(size, int):
+        return size
+    s = size.strip().upper()
+    if s.endswith('B'):
+        s = s[:-1]
+    multiplier = 1
+    if s and s[-1] in _SIZE_SUFFIXES:
+        multiplier = _SIZE_SUFFIXES[s[-1]]
+        s = s[:-1]
+    try:
+        value = float(s)
+    except ValueError:
+        raise ValueError('jug: cannot parse size {!r} (expected something like 8G or 512M)'.format(size))
+    if value < 0:
+        raise ValueError('jug: size cannot be negative ({!r})'.format(size))
+    return int(value * multiplier)
+
+
+def result_size(r):
+    '''
+    nbytes = result_size(r)
+
+    Approximate size of a result in memory
+
+    Uses ``nbytes`` (for numpy arrays and similar objects) or
+    ``sys.getsizeof`` (which, for containers, does not include the size of the
+    elements).
+    '''
+    nbytes = getattr(r, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    try:
+        return sys.getsizeof(r)
+    except TypeError:
+        return 0
+
+
+class ResultCache:
+    '''
+    cache = ResultCache(budget)
+
+    Size-aware LRU cache of loaded task results.
+
+    The cache does not hold the results itself (they remain in the tasks), it
+    only decides which tasks to unload.
+
+    Parameters
+    ----------
+    budget : int or str
+        Maximum total size of the results (in bytes or as accepted by
+        ``parse_size``)
+    '''
+    def __init__(self, budget):
+        self.budget = parse_size(budget)
+        self.sizes = OrderedDict()
+        self.total = 0
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def touch(self, t):
+        '''
+        cache.touch(t)
+
+        Marks the result of ``t`` as recently used (if it is loaded)
+        '''
+        if t in self.sizes:
+            if t.is_loaded():
+                self.sizes.move_to_end(t)
+            else:
+                self.total -= self.sizes.pop(t)
+        elif t.is_loaded():
+            size = result_size(t._result)
+            self.sizes[t] = size
+            self.total += size
+
+    def use(self, t):
+        '''
+        cache.use(t)
+
+        Marks ``t`` and its dependencies as recently used
+        '''
+        for dep in t.dependencies():
+            self.touch(dep)
+        self.touch(t)
+
+    def evict(self, pinned=()):
+        '''
+        nr_unloaded = cache.evict(pinned=())
+
+        Unloads the least recently used results until the total is within
+        the budget. Tasks in ``pinned`` are never unloaded.
+
+        Returns
+        -------
+        nr_unloaded : int
+        '''
+        nr_unloaded = 0
+        if self.total <= self.budget:
+            return 0
+        for t in list(self.sizes):
+            if self.total <= self.budget:
+                break
+            if t in pinned:
+                continue
+            self.total -= self.sizes.pop(t)
+            t.unload()
+            nr_unloaded += 1
+        return nr_unloaded
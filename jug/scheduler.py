@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2026, Luis Pedro Coelho <luis@luispedro.org>
+# vim: set ts=4 sts=4 sw=4 expandtab smartindent:
+# LICENSE: MIT
+'''
+scheduler: keeps track of which tasks are ready to run in ``jug execute``.
+
+Instead of repeatedly asking every task whether it ``can_run()`` (which checks
+all of its dependencies in the store every time), the ``ReadyQueue`` keeps,
+for each task, the number of dependencies which have not finished, together
+with an index of reverse dependencies. When a task finishes, its dependents
+are updated and, if they have no more unfinished dependencies, moved to the
+queue of ready tasks.
+
+Tasks finished by other processes are picked up by ``refresh()``, which checks
+all the unfinished tasks against the store in bulk. Tasks which failed can be
+returned to the queue after a delay with ``retry()``.
+
+The queue also counts, for each result, how many of its tasks still need it
+(i.e., have not finished, failed, or been found to be run elsewhere). Results
+whose count drops to zero are returned by ``unused()``, so that ``jug execute
+--aggressive-unload`` can unload them exactly when they are no longer needed.
+
+Among the ready tasks, the ones with the highest ``priority`` are run first.
+Within the same priority, tasks whose dependencies are loaded in memory in
+this process (typically, because they were just computed here) are preferred,
+with the ones with the largest loaded results first: running them here saves
+saving and loading (or, at least, decoding) those results again. Remaining
+ties are broken according to the scheduling policy:
+
+fifo
+    Tasks are run in the order in which they were defined (this is the
+    default)
+critical-path
+    Tasks with the longest chain of work depending on them are run first. The
+    length of this chain is estimated from the runtimes of previous runs
+    (per task name), which are saved in the store.
+'''
+
+import heapq
+from time import monotonic
+
+from .result_cache import result_size
+
+__all__ = [
+    'ReadyQueue',
+    'load_runtimes',
+    'save_runtimes',
+    ]
+
+POLICIES = ('fifo', 'critical-path')
+
+# Key under which runtime estimates are saved in the store
+_RUNTIMES_KEY = b'jug-runtime-estimates'
+
+# Number of runtime measurements kept per task name
+_MAX_RUNTIME_SAMPLES = 64
+
+# Below this number of tasks, it is cheaper to check each one than to list
+# all the keys in the store
+_MIN_TASKS_FOR_LISTING = 64
+
+_PENDING = 'pending'
+_READY = 'ready'
+_ACTIVE = 'active'
+_ELSEWHERE = 'elsewhere'
+_FAILED = 'failed'
+_RETRY = 'retry'
+_TOO_LARGE = 'too-large'
+
+
+def _list_keys(store):
+    '''
+    keys = _list_keys(store)
+
+    Returns the set of keys in the store or None if the store does not
+    support listing.
+    '''
+    try:
+        return set(store.list())
+    except NotImplementedError:
+        return None
+
+
+def load_runtimes(store):
+    '''
+    runtimes = load_runtimes(store)
+
+    Returns the runtimes recorded in previous runs
+
+    Returns
+    -------
+    runtimes : dict
+        Maps task names to lists of runtimes (in seconds)
+    '''
+    try:
+        if store.can_load(_RUNTIMES_KEY):
+            return store.load(_RUNTIMES_KEY)
+    except Exception as e:
+        import logging
+        logging.warning('jug: could not load runtime estimates (%s)', e)
+    return {}
+
+
+def save_runtimes(store, runtimes):
+    '''
+    save_runtimes(store, runtimes)
+
+    Adds the measurements in ``runtimes`` to the ones in the store.
+
+    Several processes may do this at the same time, in which case some
+    measurements may be lost (this is acceptable as they are only used as
+    estimates).
+
+    Parameters
+    ----------
+    store : jug backend
+    runtimes : dict
+        Maps task names to lists of runtimes (in seconds)
+    '''
+    if not runtimes:
+        return
+    saved = load_runtimes(store)
+    for name, ts in runtimes.items():
+        saved[name] = (saved.get(name, []) + ts)[-_MAX_RUNTIME_SAMPLES:]
+    store.dump(saved, _RUNTIMES_KEY)
+
+
+def _mean(vs):
+    return sum(vs)/float(len(vs))
+
+
+def _loaded_size(t):
+    '''
+    nbytes = _loaded_size(t)
+
+    Total size of the results of the dependencies of ``t`` which are loaded in
+    memory
+    '''
+    return sum(result_size(dep._result) for dep in t.dependencies() if dep.is_loaded())
+
+
+def _critical_paths(tasks, rdeps, runtimes):
+    '''
+    paths = _critical_paths(tasks, rdeps, runtimes)
+
+    Estimates, for each task, the time from when it starts until all the
+    tasks which (directly or indirectly) depend on it are finished.
+
+    ``tasks`` must be in topological order (as all lists of tasks built by
+    a jugfile are).
+    '''
+    estimates = dict((name, _mean(ts)) for name, ts in runtimes.items() if ts)
+    if estimates:
+        default = _mean(list(estimates.values()))
+    else:
+        default = 1.
+    paths = {}
+    for t in reversed(tasks):
+        after = [paths[dt] for dt in rdeps.get(t, []) if dt in paths]
+        paths[t] = estimates.get(t.name, default) + max(after, default=0.)
+    return paths
+
+
+class ReadyQueue:
+    '''
+    queue = ReadyQueue(tasks, policy='fifo', runtimes=None)
+
+    Keeps track of which tasks in ``tasks`` are ready to run.
+
+    Dependencies which are not in ``tasks`` are tracked as well (but never
+    returned by ``pop()``): they are expected to be run by some other process
+    and will be picked up by ``refresh()``.
+
+    The typical usage is::
+
+        queue = ReadyQueue(tasks)
+        queue.refresh()
+        while True:
+            t = queue.pop()
+            if t is None:
+                break
+            queue.start(t)
+            t.run()
+            queue.done(t)
+
+    Parameters
+    ----------
+    tasks : list of Task
+        Tasks in topological order
+    policy : str, optional
+        One of 'fifo' (default) or 'critical-path'
+    runtimes : dict, optional
+        Maps task names to lists of previous runtimes. Used by the
+        'critical-path' policy (see ``load_runtimes``)
+    loaded_size : callable, optional
+        Returns the size of the inputs of a task which are loaded in memory
+        (by default, ``_loaded_size``). Among tasks which are otherwise
+        equal, those with larger loaded inputs are run first.
+    '''
+    def __init__(self, tasks, policy='fifo', runtimes=None, loaded_size=None):
+        if policy not in POLICIES:
+            raise ValueError('jug.scheduler: unknown policy {!r} (valid options are {})'.format(policy, ', '.join(POLICIES)))
+        self._index = {}
+        self._state = {}
+        self._nr_waiting = {}
+        self._rdeps = {}
+        # Tasks (including external dependencies) which are not known to be
+        # finished. Dependencies are inserted before the tasks which depend
+        # on them, which keeps hash computation from recursing deeply.
+        self._unfinished = {}
+        # Maps hashes to tasks (built when first needed, see ``refresh``)
+        self._by_hash = None
+        # Heaps of (key, task index), where keys start with the rank of the
+        # task (see ``_rank``). Tasks whose dependencies were loaded when they
+        # became ready are in ``_local`` (with the size of the loaded results
+        # after their rank)
+        self._ready = []
+        self._local = []
+        # Heap of (time, task index) of failed tasks to be retried
+        self._retry = []
+        # Number of tasks (in ``tasks``) which still need each result, the
+        # tasks which no longer need their dependencies, and the results
+        # which are no longer needed (see ``unused``)
+        self._nr_consumers = {}
+        self._released = set()
+        self._unused = []
+        for i, t in enumerate(tasks):
+            self._index[t] = i
+        for t in tasks:
+            n = 0
+            for dep in t.dependencies():
+                if dep not in self._index:
+                    self._unfinished[dep] = None
+                n += 1
+                self._rdeps.setdefault(dep, []).append(t)
+                self._nr_consumers[dep] = self._nr_consumers.get(dep, 0) + 1
+            self._unfinished[t] = None
+            self._nr_waiting[t] = n
+            self._state[t] = (_PENDING if n else _READY)
+        self._tasks = list(tasks)
+        self._loaded_size = (loaded_size if loaded_size is not None else _loaded_size)
+        # Loaded inputs only decide between tasks of the same rank
+        if policy == 'critical-path':
+            paths = _critical_paths(tasks, self._rdeps, runtimes or {})
+            self._rank = lambda t: (-t.priority, -paths[t])
+        else:
+            self._rank = lambda t: (-t.priority,)
+        for t in tasks:
+            if self._state[t] == _READY:
+                self._push(t)
+
+    def _push(self, t):
+        heapq.heappush(self._ready, ((self._rank(t), self._index[t]), self._index[t]))
+
+    def __len__(self):
+        '''Number of tasks which may still be run by this process'''
+        return sum(1 for s in self._state.values() if s in (_PENDING, _READY, _ACTIVE, _RETRY))
+
+    def _push_local(self, t):
+        nbytes = self._loaded_size(t)
+        if not nbytes:
+            self._push(t)
+        else:
+            heapq.heappush(self._local, ((self._rank(t), -nbytes, self._index[t]), self._index[t]))
+
+    def _top(self, heap):
+        '''Discards stale entries and returns the first valid one (or None)'''
+        while heap:
+            key, i = heap[0]
+            if self._state.get(self._tasks[i]) == _READY:
+                return key
+            heapq.heappop(heap)
+        return None
+
+    def _release_retries(self):
+        '''Moves the tasks whose retry is due to the queue of ready tasks'''
+        if not self._retry:
+            return
+        now = monotonic()
+        while self._retry and self._retry[0][0] <= now:
+            _, i = heapq.heappop(self._retry)
+            t = self._tasks[i]
+            if self._state.get(t) == _RETRY:
+                self._state[t] = _READY
+                self._push(t)
+
+    def has_ready(self):
+        self._release_retries()
+        return self._top(self._local) is not None or self._top(self._ready) is not None
+
+    def pop(self):
+        '''
+        t = queue.pop()
+
+        Returns the next ready task (or None if no task is ready)
+        '''
+        self._release_retries()
+        local = self._top(self._local)
+        ready = self._top(self._ready)
+        if local is None and ready is None:
+            return None
+        # Both keys start with the rank
+        if ready is None or (local is not None and local[0] <= ready[0]):
+            heap = self._local
+        else:
+            heap = self._ready
+        _, i = heapq.heappop(heap)
+        return self._tasks[i]
+
+    def peek(self):
+        '''
+        t = queue.peek()
+
+        Returns the task that ``pop()`` would return (without removing it)
+        '''
+        self._release_retries()
+        local = self._top(self._local)
+        ready = self._top(self._ready)
+        if local is None and ready is None:
+            return None
+        if ready is None or (local is not None and local[0] <= ready[0]):
+            _, i = self._local[0]
+        else:
+            _, i = self._ready[0]
+        return self._tasks[i]
+
+    def push_back(self, t):
+        '''
+        queue.push_back(t)
+
+        Returns a task (which had been returned by ``pop()``) to the queue.
+        '''
+        self._state[t] = _READY
+        self._push_local(t)
+
+    def start(self, t):
+        '''Marks ``t`` as being run by this process'''
+        self._state[t] = _ACTIVE
+
+    def running_elsewhere(self, t):
+        '''Marks ``t`` as being run by another process'''
+        self._state[t] = _ELSEWHERE
+        self._release(t)
+
+    def too_large(self, t):
+        '''Marks ``t`` as needing more resources than this process has (it is
+        left for other processes)'''
+        self._state[t] = _TOO_LARGE
+        self._release(t)
+
+    def failed(self, t):
+        '''Marks ``t`` as failed: its dependents will not become ready'''
+        self._state[t] = _FAILED
+        self._release(t)
+
+    def retry(self, t, delay):
+        '''
+        queue.retry(t, delay)
+
+        Returns ``t`` (which failed) to the queue after ``delay`` seconds
+        '''
+        self._state[t] = _RETRY
+        heapq.heappush(self._retry, (monotonic() + delay, self._index[t]))
+
+    def retry_delay(self):
+        '''
+        delay = queue.retry_delay()
+
+        Returns the number of seconds until the next task is to be retried (or
+        None if no task is waiting to be retried)
+        '''
+        while self._retry:
+            when, i = self._retry[0]
+            if self._state.get(self._tasks[i]) == _RETRY:
+                return max(0., when - monotonic())
+            heapq.heappop(self._retry)
+        return None
+
+    def is_finished(self, t):
+        return t not in self._unfinished
+
+    def has_dependents(self, t):
+        return bool(self._rdeps.get(t))
+
+    def done(self, t):
+        '''
+        queue.done(t)
+
+        Marks ``t`` as finished, updating its dependents
+        '''
+        if t not in self._unfinished:
+            return
+        del self._unfinished[t]
+        self._state.pop(t, None)
+        if t.persist:
+            self._release(t)
+        if t in self._index and not self._nr_consumers.get(t):
+            self._no_consumers(t)
+        for dt in self._rdeps.pop(t, []):
+            self._nr_waiting[dt] -= 1
+            if self._nr_waiting[dt] == 0 and self._state[dt] == _PENDING:
+                self._state[dt] = _READY
+                self._push_local(dt)
+
+    def _release(self, t):
+        '''Records that ``t`` no longer needs its dependencies'''
+        if t not in self._index or t in self._released:
+            return
+        self._released.add(t)
+        for dep in t.dependencies():
+            self._nr_consumers[dep] -= 1
+            if self._nr_consumers[dep] == 0:
+                self._no_consumers(dep)
+
+    def _no_consumers(self, t):
+        self._unused.append(t)
+        # The result of a task which is not persisted is computed (from its
+        # dependencies) whenever it is loaded, so its dependencies are needed
+        # for as long as it is
+        if not t.persist:
+            self._release(t)
+
+    def unused(self):
+        '''
+        tasks = queue.unused()
+
+        Returns (and forgets) the finished tasks whose results are no longer
+        needed by any task in the queue: all the tasks which depend on them
+        have finished (or failed, or are being run by other processes).
+        '''
+        unused = self._unused
+        self._unused = []
+        return [t for t in unused if t not in self._unfinished]
+
+    def refresh(self, names=None):
+        '''
+        finished = queue.refresh(names=None)
+
+        Checks the store for tasks which have been finished (typically by
+        other processes). Tasks which are currently running in this process
+        are not checked.
+
+        Parameters
+        ----------
+        names : set, optional
+            Names of the results which were written (as returned by a store
+            watcher). If given, only the tasks with these hashes are checked.
+
+        Returns
+        -------
+        finished : list of Task
+            Tasks (from the original ``tasks`` list, i.e., not external
+            dependencies) which were found to be finished
+        '''
+        if names is not None:
+            if self._by_hash is None:
+                self._by_hash = {}
+                for t in self._unfinished:
+                    self._by_hash.setdefault(t.hash(), []).append(t)
+            candidates = [t for name in names for t in self._by_hash.get(name, ())
+                            if t in self._unfinished and self._state.get(t) != _ACTIVE]
+        else:
+            candidates = [t for t in self._unfinished if self._state.get(t) != _ACTIVE]
+        if not candidates:
+            return []
+        keys = None
+        if names is None and len(candidates) >= _MIN_TASKS_FOR_LISTING:
+            keys = _list_keys(candidates[0].store)
+        finished = []
+        for t in candidates:
+            if t.is_loaded():
+                is_finished = True
+            elif keys is not None:
+                is_finished = t.hash() in keys
+            else:
+                is_finished = t.can_load()
+            if is_finished:
+                if t in self._index:
+                    finished.append(t)
+                self.done(t)
+        return finished
+
+    def is_ready(self, t):
+        return self._state.get(t) == _READY
+
+    def chain(self, t, accept=None):
+        '''
+        tasks = queue.chain(t, accept=None)
+
+        Returns the linear chain of tasks after ``t``: its only dependent,
+        the only dependent of that one, &c. Each task in the chain must have
+        no unfinished dependencies other than the previous one (so that, once
+        ``t`` starts, the whole chain can be run without waiting) and satisfy
+        ``accept(task)`` (if given).
+
+        Returns
+        -------
+        tasks : list of Task
+            Chain (not including ``t`` itself)
+        '''
+        chain = []
+        cur = t
+        while True:
+            rdeps = self._rdeps.get(cur, [])
+            if not rdeps or any(dt is not rdeps[0] for dt in rdeps):
+                break
+            nt = rdeps[0]
+            if self._state.get(nt) != _PENDING:
+                break
+            if any(dep is not cur and dep in self._unfinished for dep in nt.dependencies()):
+                break
+            if accept is not None and not accept(nt):
+                break
+            chain.append(nt)
+            cur = nt
+        return chain
+
+    def elsewhere(self):
+        '''
+        tasks = queue.elsewhere()
+
+        Returns the tasks which are being run by other processes, in their
+        original order
+        '''
+        tasks = [t for t,s in self._state.items() if s == _ELSEWHERE]
+        tasks.sort(key=self._index.get)
+        return tasks
+
+    def remaining(self):
+        '''
+        tasks = queue.remaining()
+
+        Returns the tasks which have not been run (nor found to be finished),
+        in their original order.
+        '''
+        remaining = [t for t,s in self._state.items() if s in (_PENDING, _READY, _RETRY)]
+        remaining.sort(key=self._index.get)
+        return remaining
@@ -74,26 +74,34 @@ class SleepUntilCommand(SubCommand):
             hasbarrier = jugspace.get('__jug__hasbarrier__', False)
             if not hasbarrier:
                 sys.exit(0)
-            store, jugspace = init(options.jugfile, options.jugdir, store=store)
+            store, jugspace = init(options.jugfile, options.jugdir, store=store, hash_threads=options.hash_threads)
 
 
 def _check_or_sleep_until(store, sleep_until):
     tasks = task.alltasks
     active = set(tasks)
-    for t in reversed(tasks):
-        if t not in active:
-            continue
-        while not t.can_load(store):
-            if sleep_until:
-                from time import sleep
-                sleep(12)
-            else:
-                return 1
-        for dep in task.recursive_dependencies(t):
-            try:
-                active.remove(dep)
-            except KeyError:
-                pass
+    watcher = None
+    try:
+        for t in reversed(tasks):
+            if t not in active:
+                continue
+            if sleep_until and watcher is None and not t.can_load(store):
+                # Start watching before checking again so that no result is
+                # missed
+                watcher = store.watch()
+            while not t.can_load(store):
+                if sleep_until:
+                    watcher.wait(12)
+                else:
+                    return 1
+            for dep in task.recursive_dependencies(t):
+                try:
+                    active.remove(dep)
+                except KeyError:
+                    pass
+    finally:
+        if watcher is not None:
+            watcher.close()
     return 0
 
 
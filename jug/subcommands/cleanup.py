@@ -22,6 +22,8 @@
 #  THE SOFTWARE.
 
 from .. import task
+from ..hash import _HASH_ALGORITHM_KEY, load_hash_algorithm, save_hash_algorithm
+from ..scheduler import _RUNTIMES_KEY, load_runtimes
 from . import SubCommand
 
 __all__ = [
@@ -53,7 +55,17 @@ class CleanupCommand(SubCommand):
             options.print_out('Removed {removed} failure locks'.format(removed=removed))
         else:
             tasks = task.alltasks
+            algorithm = load_hash_algorithm(store)
+            runtimes = (load_runtimes(store) if store.can_load(_RUNTIMES_KEY) else None)
             removed = store.cleanup(tasks, keeplocks=options.cleanup_keep_locks)
+            # Neither the hash algorithm of the jugdir nor the runtimes
+            # recorded by jug execute are results
+            if algorithm is not None and not store.can_load(_HASH_ALGORITHM_KEY):
+                save_hash_algorithm(store, algorithm)
+                removed -= 1
+            if runtimes is not None and not store.can_load(_RUNTIMES_KEY):
+                store.dump(runtimes, _RUNTIMES_KEY)
+                removed -= 1
             options.print_out('Removed {removed} objects'.format(removed=removed))
 
     def parse(self, parser):
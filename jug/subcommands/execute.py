@@ -49,8 +49,11 @@ class TaskStats:
     def __init__(self):
         self.loaded = defaultdict(int)
         self.executed = defaultdict(int)
+        self.too_large = defaultdict(int)
+        self._too_large_seen = set()
         register_hook('execute.task-loadable', self.loadable)
         register_hook('execute.task-executed1', self.executed1)
+        register_hook('execute.task-too-large', self.too_large1)
 
     def loadable(self, t):
         self.loaded[t.name] += 1
@@ -58,6 +61,104 @@ class TaskStats:
     def executed1(self, t):
         self.executed[t.name] += 1
 
+    def too_large1(self, t):
+        # The same task may be found in several execution cycles
+        if t.hash() not in self._too_large_seen:
+            self._too_large_seen.add(t.hash())
+            self.too_large[t.name] += 1
+
+
+def _execute_cycles(options, tstats):
+    '''
+    failures = _execute_cycles(options, tstats)
+
+    Interprets the jugfile and executes its tasks, starting again from the
+    top every time a barrier is hit
+    '''
+    from ..jug import execution_loop
+    from ..hash import clear_hash_cache
+    tasks = task.alltasks
+    store = None
+    nr_wait_cycles = int(options.execute_nr_wait_cycles)
+    noprogress = 0
+    failures = False
+    while noprogress < nr_wait_cycles:
+        del tasks[:]
+        on_error = ('propagate' if options.pdb else 'exit')
+        store, jugspace = init(options.jugfile, options.jugdir, on_error=on_error, store=store, hash_threads=options.hash_threads)
+        if options.debug:
+            for t in tasks:
+                # Trigger hash computation:
+                t.hash()
+
+        previous = sum(tstats.executed.values())
+        failures = execution_loop(tasks, options) or failures
+        # The jugfile is interpreted again in the next cycle, so the cached
+        # digests refer to arguments which would otherwise be freed
+        clear_hash_cache()
+        after = sum(tstats.executed.values())
+        done = not jugspace.get('__jug__hasbarrier__', False)
+        if done:
+            break
+        if after == previous:
+            from time import sleep
+            noprogress += 1
+            sleep(int(options.execute_wait_cycle_time))
+        else:
+            noprogress = 0
+    else:
+        logging.info('No tasks can be run!')
+    return failures
+
+
+def _execute_persistent(options, tstats):
+    '''
+    failures = _execute_persistent(options, tstats)
+
+    Interprets the jugfile once (see ``ResumableJugfile``), executing the
+    tasks defined so far whenever a barrier is hit
+    '''
+    from ..jug import execution_loop, ResumableJugfile
+    del task.alltasks[:]
+    on_error = ('propagate' if options.pdb else 'exit')
+    jugfile = ResumableJugfile(options.jugfile, options.jugdir, on_error=on_error, hash_threads=options.hash_threads)
+    nr_wait_cycles = int(options.execute_nr_wait_cycles)
+    noprogress = 0
+    failures = False
+    # Tasks which were not run in previous cycles (e.g., because they were
+    # running in another process)
+    pending = []
+    nr_seen = 0
+    try:
+        jugfile.start()
+        while True:
+            new_tasks = task.alltasks[nr_seen:]
+            nr_seen += len(new_tasks)
+            pending.extend(new_tasks)
+            if options.debug:
+                for t in new_tasks:
+                    # Trigger hash computation:
+                    t.hash()
+
+            previous = sum(tstats.executed.values())
+            failures = execution_loop(pending, options) or failures
+            after = sum(tstats.executed.values())
+            if jugfile.finished:
+                break
+            jugfile.resume()
+            if after == previous and not jugfile.finished and len(task.alltasks) == nr_seen:
+                noprogress += 1
+                if noprogress >= nr_wait_cycles:
+                    logging.info('No tasks can be run!')
+                    break
+                from time import sleep
+                sleep(int(options.execute_wait_cycle_time))
+            else:
+                noprogress = 0
+    finally:
+        jugfile.close()
+    return failures
+
 
 class ExecuteCommand(SubCommand):
     '''Execute tasks
@@ -71,48 +172,30 @@ class ExecuteCommand(SubCommand):
     def run(self, options, *args, **kwargs):
         from signal import signal, SIGTERM
         from ..hooks.exit_checks import exit_env_vars, exit_if_file_exists
-        from ..jug import execution_loop
 
         signal(SIGTERM, _sigterm)
         if not options.execute_no_check_environment:
             exit_env_vars()
             exit_if_file_exists('__jug_please_stop_running.txt')
 
-        tasks = task.alltasks
         tstats = TaskStats()
-        store = None
         register_hook_once('execute.task-loadable', '_log_loadable', _log_loadable)
 
-        nr_wait_cycles = int(options.execute_nr_wait_cycles)
-        noprogress = 0
-        failures = False
-        while noprogress < nr_wait_cycles:
-            del tasks[:]
-            on_error = ('propagate' if options.pdb else 'exit')
-            store, jugspace = init(options.jugfile, options.jugdir, on_error=on_error, store=store)
-            if options.debug:
-                for t in tasks:
-                    # Trigger hash computation:
-                    t.hash()
-
-            previous = sum(tstats.executed.values())
-            failures = execution_loop(tasks, options) or failures
-            after = sum(tstats.executed.values())
-            done = not jugspace.get('__jug__hasbarrier__', False)
-            if done:
-                break
-            if after == previous:
-                from time import sleep
-                noprogress += 1
-                sleep(int(options.execute_wait_cycle_time))
-            else:
-                noprogress = 0
+        if options.execute_persistent:
+            failures = _execute_persistent(options, tstats)
         else:
-            logging.info('No tasks can be run!')
+            failures = _execute_cycles(options, tstats)
 
         jug_hook('execute.finished_pre_status')
         maybe_print_citation_info(options)
-        print_task_summary_table(options, [("Executed", tstats.executed), ("Loaded", tstats.loaded)])
+        groups = [("Executed", tstats.executed), ("Loaded", tstats.loaded)]
+        too_large = sorted(tstats.too_large)
+        if too_large:
+            groups.append(("Too large", tstats.too_large))
+        print_task_summary_table(options, groups)
+        if too_large:
+            options.print_out('Some tasks were not run as they need more resources than this node has: {}'.format(
+                            ', '.join(too_large)))
         jug_hook('execute.finished_post_status')
 
         if failures:
@@ -141,10 +224,105 @@ class ExecuteCommand(SubCommand):
                             action='store_const', const=True,
                             dest='execute_keep_failed',
                             help='Keep failed tasks locked')
+        parser.add_argument('--retries', action='store',
+                            dest='execute_retries',
+                            metavar='N', type=int,
+                            help=("Run failed tasks again up to N times, waiting longer after each "
+                                  "failure (see --retry-backoff). Tasks can override this with "
+                                  "TaskGenerator(retries=N) (Default: {execute_retries})".format(**defaults)))
+        parser.add_argument('--retry-backoff', action='store',
+                            dest='execute_retry_backoff',
+                            metavar='SECONDS', type=float,
+                            help=("Wait SECONDS before the first retry of a failed task, doubling the wait "
+                                  "after each further failure (Default: {execute_retry_backoff})".format(**defaults)))
         parser.add_argument('--no-check-environment',
                             action='store_const', const=True,
                             dest='execute_no_check_environment',
                             help='Do not check environment variables JUG_* and file __jug_please_stop_running.txt')
+        parser.add_argument('-j', '--jobs', action='store',
+                            dest='execute_jobs',
+                            metavar='N', type=int,
+                            help=("Number of worker processes to use. The jugfile is loaded once and tasks "
+                                  "are run in forked processes (Default: {execute_jobs})".format(**defaults)))
+        parser.add_argument('--threads', action='store',
+                            dest='execute_threads',
+                            metavar='N', type=int,
+                            help=("Number of threads used to run tasks declared with executor='thread' "
+                                  "(Default: {execute_threads})".format(**defaults)))
+        parser.add_argument('--async-concurrency', action='store',
+                            dest='execute_async_concurrency',
+                            metavar='N', type=int,
+                            help=("Maximum number of tasks defined with `async def` to run concurrently "
+                                  "(Default: {execute_async_concurrency})".format(**defaults)))
+        parser.add_argument('--lock-batch', action='store',
+                            dest='execute_lock_batch',
+                            metavar='N', type=int,
+                            help=("Lock up to N ready tasks at once (reduces the overhead of locking when "
+                                  "there are many short tasks; Default: {execute_lock_batch})".format(**defaults)))
+        parser.add_argument('--fuse',
+                            action='store_const', const=True,
+                            dest='execute_fuse',
+                            help=("Fuse linear chains of tasks (experimental): a task whose result is only "
+                                  "used by a single task is locked together with it, the two are run one "
+                                  "after the other, and the intermediate result is saved in the background"))
+        parser.add_argument('--prefetch',
+                            action='store_const', const=True,
+                            dest='execute_prefetch',
+                            help=("Load the inputs of the next task in a background thread while the "
+                                  "current one runs"))
+        parser.add_argument('--write-behind', action='store',
+                            dest='execute_write_behind',
+                            metavar='N', type=int,
+                            help=("Save results in a background thread (with up to N results waiting to be "
+                                  "saved) while the next tasks run. Locks are released once the results are "
+                                  "saved (Default: disabled)"))
+        parser.add_argument('--memory-budget', action='store',
+                            dest='execute_memory_budget',
+                            metavar='SIZE',
+                            help=("Keep the results loaded in memory within SIZE (e.g., 8G or 512M), "
+                                  "unloading the least recently used ones first (Default: no limit)"))
+        parser.add_argument('--persistent',
+                            action='store_const', const=True,
+                            dest='execute_persistent',
+                            help=("Interpret the jugfile only once: at a barrier, run the tasks defined "
+                                  "so far and then continue from that point (instead of starting again "
+                                  "from the top of the jugfile)"))
+        parser.add_argument('--speculate', action='store',
+                            dest='execute_speculate',
+                            metavar='K', type=float,
+                            help=("When no task is ready, also run tasks which have been running in other "
+                                  "processes for more than K times their median runtime (from previous runs) "
+                                  "(Default: disabled)"))
+        parser.add_argument('--resources', action='store',
+                            dest='execute_resources',
+                            metavar='SPEC',
+                            help=("Resources available on this node for tasks which declare their needs "
+                                  "(e.g., mem=64G,cpus=32). By default, the memory and number of CPUs are "
+                                  "detected automatically"))
+        parser.add_argument('--isolate',
+                            action='store_const', const=True,
+                            dest='execute_isolate',
+                            help=("Run each task in a separate (forked) process. Tasks which fail, time out "
+                                  "(see --timeout), or exceed their memory limit (see --memory-limit) are "
+                                  "marked as failed and execution continues"))
+        parser.add_argument('--timeout', action='store',
+                            dest='execute_timeout',
+                            metavar='SECONDS', type=float,
+                            help="Maximum time for each task (implies --isolate)")
+        parser.add_argument('--memory-limit', action='store',
+                            dest='execute_memory_limit',
+                            metavar='SIZE',
+                            help="Maximum memory for each task, e.g., 4G (implies --isolate)")
+        parser.add_argument('--schedule', action='store',
+                            dest='execute_schedule',
+                            choices=['fifo', 'critical-path'],
+                            help=("Order in which to run ready tasks: 'fifo' (order of definition) or "
+                                  "'critical-path' (longest estimated chain of dependent work first, "
+                                  "based on runtimes from previous runs) (Default: {execute_schedule})".format(**defaults)))
+        parser.add_argument('--record-runtimes',
+                            action='store_const', const=True,
+                            dest='execute_record_runtimes',
+                            help='Record task runtimes in the store (implied by --schedule=critical-path)')
 
     def parse_defaults(self):
         wait_cycle_time = 12
@@ -152,10 +330,28 @@ class ExecuteCommand(SubCommand):
         default_values = {
             "execute_keep_going": False,
             "execute_keep_failed": False,
+            "execute_retries": 0,
+            "execute_retry_backoff": 1.0,
             "execute_target": None,
             "execute_wait_cycle_time": wait_cycle_time,
             "execute_nr_wait_cycles": (30 * 60) // wait_cycle_time,
             "execute_no_check_environment": False,
+            "execute_jobs": 1,
+            "execute_threads": 4,
+            "execute_async_concurrency": 16,
+            "execute_lock_batch": 1,
+            "execute_fuse": False,
+            "execute_prefetch": False,
+            "execute_write_behind": None,
+            "execute_memory_budget": None,
+            "execute_persistent": False,
+            "execute_speculate": None,
+            "execute_resources": None,
+            "execute_isolate": False,
+            "execute_timeout": None,
+            "execute_memory_limit": None,
+            "execute_schedule": "fifo",
+            "execute_record_runtimes": False,
         }
 
         return default_values
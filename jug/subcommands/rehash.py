@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2026, Luis Pedro Coelho <luis@luispedro.org>
+# vim: set ts=4 sts=4 sw=4 expandtab smartindent:
+# LICENSE: MIT
+'''
+rehash: converts a jugdir to a different hash algorithm (see
+``jug.hash.set_hash_algorithm``), moving the existing results to their new
+keys so that nothing needs to be recomputed.
+'''
+
+from .. import task
+from .. import hash as jug_hash
+from . import SubCommand
+
+__all__ = [
+    'rehash',
+    ]
+
+
+def _in_dependency_order(tasks):
+    '''
+    ordered = _in_dependency_order(tasks)
+
+    Returns ``tasks`` and all their (recursive) dependencies, with each task
+    after its dependencies
+    '''
+    ordered = []
+    seen = set()
+    for t in tasks:
+        if t in seen:
+            continue
+        seen.add(t)
+        stack = [(t, t.dependencies())]
+        while stack:
+            cur, deps = stack[-1]
+            for dep in deps:
+                if dep not in seen:
+                    seen.add(dep)
+                    stack.append((dep, dep.dependencies()))
+                    break
+            else:
+                stack.pop()
+                ordered.append(cur)
+    return ordered
+
+
+def rehash_store(store, tasks, algorithm):
+    '''
+    nr_moved, nr_missing = rehash_store(store, tasks, algorithm)
+
+    Moves the results of ``tasks`` from the keys computed with the current
+    hash algorithm to those computed with ``algorithm``, which is then
+    recorded as the algorithm of ``store`` (and used from then on).
+
+    Parameters
+    ----------
+    store : jug backend
+    tasks : list of Task
+        Tasks whose results are moved (e.g., ``jug.task.alltasks``); the
+        hashes of their dependencies are recomputed as well
+    algorithm : str
+        See ``jug.hash.parse_hash_algorithm``
+
+    Returns
+    -------
+    nr_moved : int
+        Number of results moved
+    nr_missing : int
+        Number of tasks without results (which will be run with the new keys)
+    '''
+    algorithm, _ = jug_hash.parse_hash_algorithm(algorithm)
+    # The hashes of all tasks (including those which are not persisted) are
+    # part of the hashes of the tasks which depend on them
+    tasks = _in_dependency_order(tasks)
+    old_keys = [t.hash() for t in tasks]
+    jug_hash._use(algorithm)
+    # Hashes are cached: recompute them (dependencies first)
+    new_keys = [t._compute_set_hash() for t in tasks]
+    persisted = [t.persist for t in tasks]
+    nr_moved = 0
+    nr_missing = 0
+    seen = set()
+    for old, new, persist in zip(old_keys, new_keys, persisted):
+        if not persist or old in seen:
+            continue
+        seen.add(old)
+        if old == new or store.can_load(new):
+            continue
+        if store.can_load(old):
+            store.rename(old, new)
+            nr_moved += 1
+        else:
+            nr_missing += 1
+    jug_hash.save_hash_algorithm(store, algorithm)
+    return nr_moved, nr_missing
+
+
+class RehashCommand(SubCommand):
+    '''Convert the jugdir to a different hash algorithm
+
+    rehash(store, options)
+
+    Moves the existing results to the keys computed with the new hash
+    algorithm (no results are recomputed)
+    '''
+    name = "rehash"
+
+    def run(self, store, options, *args, **kwargs):
+        if not options.rehash_to:
+            options.print_out('jug rehash: the new hash algorithm must be given with --to (e.g., --to=blake2b-20)')
+            return 1
+        previous = jug_hash.hash_algorithm()
+        if store.listlocks():
+            options.print_out('Warning: some tasks are locked. Other jug processes should not be running during `jug rehash`.')
+        nr_moved, nr_missing = rehash_store(store, task.alltasks, options.rehash_to)
+        options.print_out('Moved {} results from {} to {} ({} tasks have no results yet).'.format(
+                        nr_moved, previous, jug_hash.hash_algorithm(), nr_missing))
+
+    def parse(self, parser):
+        parser.add_argument('--to', action='store',
+                            dest='rehash_to',
+                            metavar='ALGORITHM',
+                            help='New hash algorithm (e.g., sha256 or blake2b-20)')
+
+    def parse_defaults(self):
+        return {
+            "rehash_to": None,
+        }
+
+
+rehash = RehashCommand()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2026, Luis Pedro Coelho <luis@luispedro.org>
+# vim: set ts=4 sts=4 sw=4 expandtab smartindent:
+# LICENSE: MIT
+'''
+simulate: predicts how long ``jug execute`` would take with a given number of
+workers, based on the runtimes recorded in previous runs (see ``jug execute
+--record-runtimes``).
+'''
+
+from collections import namedtuple
+import heapq
+
+from .. import task
+from ..scheduler import POLICIES, ReadyQueue, load_runtimes
+from . import SubCommand
+
+__all__ = [
+    'simulate',
+    ]
+
+
+Simulation = namedtuple('Simulation', ['nr_workers', 'makespan', 'work', 'utilization'])
+
+
+def _mean(vs):
+    return sum(vs)/float(len(vs))
+
+
+def _format_time(secs):
+    if secs < 60:
+        return '{:.3g}s'.format(secs)
+    secs = int(round(secs))
+    mins, secs = divmod(secs, 60)
+    if mins < 60:
+        return '{}m{:02}s'.format(mins, secs)
+    hours, mins = divmod(mins, 60)
+    return '{}h{:02}m'.format(hours, mins)
+
+
+def estimate_runtimes(tasks, runtimes):
+    '''
+    estimates, missing = estimate_runtimes(tasks, runtimes)
+
+    Estimates the runtime of each task as the mean of the runtimes recorded
+    for its name. Tasks which are not persisted take no time (their results
+    are computed by the tasks which use them). Tasks without any record get
+    the mean of all other estimates (or 1 second, if there are none).
+
+    Parameters
+    ----------
+    tasks : list of Task
+    runtimes : dict
+        Maps task names to lists of runtimes (see ``jug.scheduler.load_runtimes``)
+
+    Returns
+    -------
+    estimates : dict
+        Maps tasks to runtimes (in seconds)
+    missing : set of str
+        Names of the tasks without any recorded runtime
+    '''
+    means = dict((name, _mean(ts)) for name, ts in runtimes.items() if ts)
+    default = (_mean(list(means.values())) if means else 1.)
+    estimates = {}
+    missing = set()
+    for t in tasks:
+        if not t.persist:
+            estimates[t] = 0.
+        elif t.name in means:
+            estimates[t] = means[t.name]
+        else:
+            estimates[t] = default
+            missing.add(t.name)
+    return estimates, missing
+
+
+def critical_path(tasks, estimates):
+    '''
+    length, path = critical_path(tasks, estimates)
+
+    Finds the longest chain of dependent tasks (no schedule can finish
+    earlier than ``length``, whatever the number of workers).
+
+    Parameters
+    ----------
+    tasks : list of Task
+        Tasks in topological order
+    estimates : dict
+        Maps tasks to runtimes
+
+    Returns
+    -------
+    length : float
+    path : list of Task
+    '''
+    finish = {}
+    previous = {}
+    for t in tasks:
+        start = 0.
+        previous[t] = None
+        for dep in t.dependencies():
+            if finish.get(dep, 0.) > start:
+                start = finish[dep]
+                previous[t] = dep
+        finish[t] = start + estimates[t]
+    if not finish:
+        return 0., []
+    t = max(finish, key=finish.get)
+    length = finish[t]
+    path = []
+    while t is not None:
+        path.append(t)
+        t = previous[t]
+    path.reverse()
+    return length, path
+
+
+def simulate_execution(tasks, estimates, nr_workers, policy='fifo', runtimes=None, nr_intervals=10):
+    '''
+    result = simulate_execution(tasks, estimates, nr_workers, policy='fifo', runtimes=None, nr_intervals=10)
+
+    Discrete-event simulation of running ``tasks`` with ``nr_workers``
+    workers, each picking the next ready task in the same order as ``jug
+    execute`` (which prefers tasks whose inputs it has computed, as they are
+    still loaded in memory). Dependencies which are not in ``tasks`` are
+    assumed to be finished.
+
+    Parameters
+    ----------
+    tasks : list of Task
+        Tasks in topological order
+    estimates : dict
+        Maps tasks to runtimes (see ``estimate_runtimes``)
+    nr_workers : int
+    policy : str, optional
+        Scheduling policy (see ``jug.scheduler``)
+    runtimes : dict, optional
+        Previous runtimes (used by the 'critical-path' policy)
+    nr_intervals : int, optional
+        Number of intervals in which the utilization is reported
+
+    Returns
+    -------
+    result : Simulation
+        With fields ``nr_workers``, ``makespan`` (the total wall time),
+        ``work`` (the sum of all runtimes), and ``utilization`` (the fraction
+        of the workers that are busy in each of ``nr_intervals`` consecutive
+        intervals of equal length)
+    '''
+    # Results computed in the simulation count as loaded (all of the same
+    # size, as their actual sizes are not known)
+    finished = set()
+    loaded_size = lambda t: sum(1 for dep in t.dependencies() if dep in finished)
+    queue = ReadyQueue(tasks, policy=policy, runtimes=runtimes, loaded_size=loaded_size)
+    known = set(tasks)
+    for t in tasks:
+        for dep in t.dependencies():
+            if dep not in known:
+                queue.done(dep)
+    now = 0.
+    # Heap of (end time, order, task)
+    running = []
+    # (start, end) of every task
+    spans = []
+    while True:
+        while len(running) < nr_workers:
+            t = queue.pop()
+            if t is None:
+                break
+            queue.start(t)
+            end = now + estimates[t]
+            heapq.heappush(running, (end, len(spans), t))
+            spans.append((now, end))
+        if not running:
+            break
+        now, _, t = heapq.heappop(running)
+        finished.add(t)
+        queue.done(t)
+
+    makespan = now
+    work = sum(e - s for s, e in spans)
+    utilization = []
+    if makespan > 0:
+        width = makespan / nr_intervals
+        for i in range(nr_intervals):
+            lo = i * width
+            hi = lo + width
+            busy = sum(max(0., min(e, hi) - max(s, lo)) for s, e in spans)
+            utilization.append(busy / (width * nr_workers))
+    return Simulation(nr_workers, makespan, work, utilization)
+
+
+def _parse_workers(workers):
+    try:
+        counts = [int(w) for w in str(workers).split(',') if w.strip()]
+    except ValueError:
+        counts = []
+    if not counts or min(counts) < 1:
+        raise ValueError('jug simulate: --workers must be a list of positive integers (e.g., 10,50,200)')
+    return counts
+
+
+def _summarize_path(path):
+    '''Collapses consecutive tasks with the same name'''
+    parts = []
+    for t in path:
+        if parts and parts[-1][0] == t.name:
+            parts[-1][1] += 1
+        else:
+            parts.append([t.name, 1])
+    return ' -> '.join((name if n == 1 else '{} (x{})'.format(name, n)) for name, n in parts)
+
+
+class SimulateCommand(SubCommand):
+    '''Predict the wall time of jug execute with a given number of workers
+
+    simulate(store, options)
+
+    Simulates running the (remaining) tasks with different numbers of
+    workers, using the runtimes recorded in previous runs.
+    '''
+    name = "simulate"
+
+    def run(self, store, options, *args, **kwargs):
+        from ..backends import memoize_store
+        tasks = task.alltasks
+        if not options.simulate_from_scratch:
+            cached = memoize_store(store, list_base=True)
+            tasks = [t for t in tasks if not t.can_load(cached)]
+        runtimes = load_runtimes(store)
+        if not runtimes:
+            options.print_out('No runtimes recorded (use `jug execute --record-runtimes`): assuming 1s per task.')
+        estimates, missing = estimate_runtimes(tasks, runtimes)
+        if runtimes and missing:
+            options.print_out('No runtimes recorded for: {} (using the average of other tasks).'.format(', '.join(sorted(missing))))
+        length, path = critical_path(tasks, estimates)
+        options.print_out('Tasks: {} (total work: {})'.format(len(tasks), _format_time(sum(estimates.values()))))
+        options.print_out('Critical path: {} ({} tasks)'.format(_format_time(length), len(path)))
+        if path:
+            options.print_out('    ' + _summarize_path(path))
+        options.print_out()
+
+        options.print_out('{:>8}  {:>10}  {:>8}  {:>10}  {}'.format('Workers', 'Wall time', 'Speedup', 'Efficiency', 'Utilization over time (%)'))
+        for n in _parse_workers(options.simulate_workers):
+            r = simulate_execution(tasks, estimates, n, policy=options.simulate_schedule, runtimes=runtimes)
+            if r.makespan > 0:
+                speedup = r.work / r.makespan
+                options.print_out('{:>8}  {:>10}  {:>7.1f}x  {:>9.0f}%  {}'.format(
+                        n, _format_time(r.makespan), speedup, 100. * speedup / n,
+                        ' '.join('{:.0f}'.format(100. * u) for u in r.utilization)))
+            else:
+                options.print_out('{:>8}  {:>10}'.format(n, _format_time(0)))
+
+    def parse(self, parser):
+        defaults = self.parse_defaults()
+        parser.add_argument('--workers', action='store',
+                            dest='simulate_workers',
+                            metavar='N[,N...]',
+                            help=('Numbers of workers to simulate, separated by commas '
+                                  '(Default: {simulate_workers})'.format(**defaults)))
+        parser.add_argument('--schedule', action='store',
+                            dest='simulate_schedule',
+                            choices=list(POLICIES),
+                            help=('Scheduling policy (as in jug execute, Default: {simulate_schedule})'.format(**defaults)))
+        parser.add_argument('--from-scratch',
+                            action='store_const', const=True,
+                            dest='simulate_from_scratch',
+                            help='Simulate running all tasks (by default, only the tasks which are not finished)')
+
+    def parse_defaults(self):
+        return {
+            "simulate_workers": "1,2,4,8,16,32",
+            "simulate_schedule": "fifo",
+            "simulate_from_scratch": False,
+        }
+
+
+simulate = SimulateCommand()
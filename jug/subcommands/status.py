@@ -43,6 +43,8 @@ ready = 'ready'
 running = 'running'
 failed = 'failed'
 finished = 'finished'
+# Tasks whose results are not saved (see TaskGenerator(persist=False))
+ephemeral = 'ephemeral'
 
 
 def create_sqlite3(connection, ht, deps, rdeps):
@@ -110,7 +112,7 @@ def _open_connection(options):
 
 
 def load_jugfile(options):
-    store, _ = jug.init(options.jugfile, options.jugdir)
+    store, _ = jug.init(options.jugfile, options.jugdir, hash_threads=options.hash_threads)
     h2idx = {}
     ht = []
     deps = {}
@@ -119,7 +121,7 @@ def load_jugfile(options):
             deps[i] = [h2idx[d.hash() if isinstance(d, Task) else d._base_hash()]
                        for d in t.dependencies()]
             hash = t.hash()
-            ht.append((i, t.name, hash, unknown))
+            ht.append((i, t.name, hash, (unknown if t.persist else ephemeral)))
             h2idx[hash] = i
     except KeyError:
         import sys
@@ -147,6 +149,7 @@ class TaskStatus:
         self.ready=defaultdict(int)
         self.running=defaultdict(int)
         self.finished=defaultdict(int)
+        self.ephemeral=defaultdict(int)
 
 
 def update_status(store, ht, deps, rdeps):
@@ -154,9 +157,18 @@ def update_status(store, ht, deps, rdeps):
 
     store = memoize_store(store, list_base=True)
     dirty = {}
+    # Ephemeral tasks whose results can be computed (ht is in topological
+    # order, so these are known before the tasks that depend on them)
+    computable = set()
     for i, name, hash, status in ht:
         nstatus = None
-        if status == finished or store.can_load(hash):
+        if status == ephemeral:
+            ts.ephemeral[name] += 1
+            nstatus = ephemeral
+            if all(ht[dep][3] == finished or dep in computable or store.can_load(ht[dep][2])
+                        for dep in deps.get(i, [])):
+                computable.add(i)
+        elif status == finished or store.can_load(hash):
             ts.finished[name] += 1
             nstatus = finished
         else:
@@ -164,6 +176,8 @@ def update_status(store, ht, deps, rdeps):
             if status != ready:
                 for dep in deps.get(i, []):
                     _, _, dhash, dstatus = ht[dep]
+                    if dep in computable:
+                        continue
                     if dstatus != finished and not store.can_load(dhash):
                         can_run = False
                         break
@@ -189,6 +203,7 @@ def update_status(store, ht, deps, rdeps):
 
 
 def _print_status(options, ts):
+    n_ephemeral = sum(ts.ephemeral.values())
     if options.short:
         n_ready = sum(ts.ready.values())
         n_running = sum(ts.running.values())
@@ -208,6 +223,10 @@ def _print_status(options, ts):
                                 ("Ready", ts.ready),
                                 ("Complete", ts.finished),
                                 ("Active", ts.running)])
+    # Not a column of the table: another column leaves no room for task
+    # names in an 80 column terminal
+    if n_ephemeral:
+        options.print_out('{0} tasks are not saved (persist=False).'.format(n_ephemeral))
 
 
 def _clear_cache(options):
@@ -244,13 +263,15 @@ def _status_cached(options):
 
 
 def _status_nocache(options):
-    store, _ = jug.init(options.jugfile, options.jugdir)
+    store, _ = jug.init(options.jugfile, options.jugdir, hash_threads=options.hash_threads)
     Task.store = memoize_store(store, list_base=True)
 
     ts = TaskStatus()
 
     for t in task.alltasks:
-        if t.can_load():
+        if not t.persist:
+            ts.ephemeral[t.name] += 1
+        elif t.can_load():
             ts.finished[t.name] += 1
         elif t.can_run():
             if t.is_locked():
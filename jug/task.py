@@ -14,6 +14,9 @@ There are two main alternatives:
 '''
 
 
+import inspect
+import threading
+
 from .hash import new_hash_object, hash_update, hash_one
 
 __all__ = [
@@ -27,6 +30,14 @@ __all__ = [
 
 alltasks = []
 
+# Guards loading of results when tasks are run in several threads. A small
+# fixed set of locks is shared between all tasks (by id) to avoid allocating
+# one lock per task. No other lock is taken while holding one of these, so
+# they cannot deadlock. This is not true for tasks which are not persisted
+# (computing their result loads their dependencies), so each of these gets its
+# own lock (as they are taken in dependency order, there are no cycles).
+_load_locks = [threading.Lock() for _ in range(64)]
+
 class _getitem:
     __slots__ = ('slice',)
     def __init__(self, slice):
@@ -77,6 +88,17 @@ class Task(TaskletMixin):
     TaskGenerator : function
     '''
     store = None
+    # Execution hints (see TaskGenerator)
+    executor = None
+    priority = 0
+    resources = None
+    # If False, the result is never saved, but computed (again) whenever it
+    # is needed (see TaskGenerator)
+    persist = True
+    # Retries after a failure (None means that the default of ``jug execute``
+    # is used, see TaskGenerator)
+    retries = None
+    retry_backoff = None
     # __slots__ = ('name', 'f', 'args', 'kwargs', '_hash','_lock')
     def __init__(self, f, *args, **kwargs):
         if getattr(f, '__name__', getattr(f, 'func_name', '')) == '<lambda>':
@@ -117,20 +139,68 @@ tricky to support since the general code relies on the function name)''')
         assert self.can_run()
         if debug_mode: self._check_hash()
         self._result = self._execute()
-        if save:
+        if save and self.persist:
             name = self.hash()
             self.store.dump(self._result, name)
         if debug_mode: self._check_hash()
         return self._result
 
-    def _execute(self):
+    async def run_async(self, save=True, debug_mode=False):
+        '''
+        val = await task.run_async(save=True, debug_mode=False)
+
+        Performs a task whose function is a coroutine function (i.e., defined
+        with ``async def``). Loading the arguments and saving the result are
+        done in the event loop's default executor so as not to block other
+        coroutines.
+
+        Parameters
+        ----------
+        save : boolean, optional
+            if true, save the result to the store
+            (default: True)
+        debug_mode : boolean, optional
+            whether to run in debug mode (adds extra checks)
+
+        Returns
+        -------
+        val : return value from Task
+        '''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if debug_mode: self._check_hash()
+        args, kwargs = await loop.run_in_executor(None, self._arguments)
+        self._result = await self.f(*args, **kwargs)
+        if save and self.persist:
+            await loop.run_in_executor(None, self.store.dump, self._result, self.hash())
+        if debug_mode: self._check_hash()
+        return self._result
+
+    def _arguments(self):
         args = [value(dep) for dep in self.args]
         kwargs = dict((key,value(dep)) for key,dep in self.kwargs.items())
+        return args, kwargs
+
+    def _execute(self):
+        args, kwargs = self._arguments()
+        if inspect.iscoroutinefunction(self.f):
+            import asyncio
+            return asyncio.run(self.f(*args, **kwargs))
         return self.f(*args,**kwargs)
 
 
     def _get_result(self):
-        if not hasattr(self, '_result'): self.load()
+        if not hasattr(self, '_result'):
+            # Tasks may be running in several threads which share
+            # dependencies, so make sure that each is only loaded once
+            if self.persist:
+                lock = _load_locks[id(self) % len(_load_locks)]
+            else:
+                # setdefault is atomic, so all threads get the same lock
+                lock = self.__dict__.get('_load_lock') or self.__dict__.setdefault('_load_lock', threading.Lock())
+            with lock:
+                if not hasattr(self, '_result'):
+                    self.load()
         return self._result
 
     result = property(_get_result, doc='Result value')
@@ -161,7 +231,8 @@ tricky to support since the general code relies on the function name)''')
         '''
         t.load()
 
-        Loads the results from the storage backend.
+        Loads the results from the storage backend (or, if the task is not
+        persisted, computes them).
 
         This function *always* loads from the backend even if the task is
         already loaded. You can use `is_loaded` as a check if you want to avoid
@@ -172,6 +243,9 @@ tricky to support since the general code relies on the function name)''')
         Nothing
         '''
         assert self.can_load()
+        if not self.persist:
+            self._result = self._execute()
+            return
         try:
             self._result = self.store.load(self.hash())
         except Exception as e:
@@ -254,10 +328,14 @@ tricky to support since the general code relies on the function name)''')
         '''
         bool = task.can_load()
 
-        Returns whether result is available.
+        Returns whether result is available. For tasks which are not persisted,
+        this means that it can be computed (i.e., that the results of its
+        dependencies are available).
         '''
         if store is None:
             store = self.store
+        if not self.persist:
+            return all(dep.is_loaded() or dep.can_load(store) for dep in self.dependencies())
         return store.can_load(self.hash())
 
     def hash(self):
@@ -271,20 +349,21 @@ tricky to support since the general code relies on the function name)''')
         '''
         return self.__jug_hash__()
 
-    def _compute_set_hash(self):
+    def _compute_set_hash(self, use_cache=True):
         M = new_hash_object()
         hash_update(M,
                     [('name', self.name.encode('utf-8'))
                     ,('args', self.args)
                     ,('kwargs', self.kwargs)
-                    ])
+                    ], use_cache=use_cache)
         value = M.hexdigest().encode('utf-8')
         self.__jug_hash__ = lambda : value
         return value
 
 
     def _check_hash(self):
-        if self.hash() != self._compute_set_hash():
+        # Cached digests of large arguments would hide modifications
+        if self.hash() != self._compute_set_hash(use_cache=False):
             hash_error_msg = ('jug error: Hash value of task (name: %s) changed unexpectedly.\n' % self.name)
             hash_error_msg += 'Typical cause is that a Task function changed the value of an argument (which messes up downstream computations).'
             raise RuntimeError(hash_error_msg)
@@ -363,6 +442,8 @@ tricky to support since the general code relies on the function name)''')
 
         If the lock was not held, and exception will be raised
         '''
+        if not hasattr(self, '_lock'):
+            self._lock = self.store.getlock(self.hash())
         return self._lock.fail()
 
     def is_failed(self):
@@ -425,6 +506,9 @@ class Tasklet(TaskletMixin):
 
     def dependencies(self):
         yield self.base
+        # When the index is itself a Task (e.g., ``t[t2]``)
+        if isinstance(self.f, _getitem) and isinstance(self.f.slice, (Task, Tasklet)):
+            yield self.f.slice
     __jug_dependencies__ = dependencies
 
     def value(self):
@@ -470,6 +554,54 @@ def topological_sort(tasks):
         dfs(next)
     tasks[:] = sorted
 
+def _hash_all(tasks):
+    for t in tasks:
+        t.hash()
+
+def hash_tasks(tasks, nr_threads):
+    '''
+    hash_tasks(tasks, nr_threads)
+
+    Computes the hashes of ``tasks`` (which are then cached) using
+    ``nr_threads`` threads.
+
+    The hashes of the dependencies of a task are part of its hash, so tasks
+    are hashed in waves: first, the tasks without dependencies, then those
+    which only depend on these, &c. Hashing large buffers (e.g., numpy arrays)
+    does not hold the GIL, so this is faster than hashing them one by one.
+
+    Parameters
+    ----------
+    tasks : list of Task
+        Tasks in topological order (e.g., ``jug.task.alltasks``)
+    nr_threads : int
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    level = {}
+    waves = []
+    for t in tasks:
+        if '__jug_hash__' in t.__dict__:
+            # Already computed
+            level[t] = -1
+            continue
+        lv = 0
+        for dep in t.dependencies():
+            lv = max(lv, level.get(dep, -1) + 1)
+        level[t] = lv
+        if lv == len(waves):
+            waves.append([])
+        waves[lv].append(t)
+    with ThreadPoolExecutor(nr_threads) as pool:
+        for wave in waves:
+            if len(wave) < 2 * nr_threads:
+                _hash_all(wave)
+                continue
+            # A few chunks per thread (submitting each task separately would
+            # cost more than hashing most tasks)
+            step = -(-len(wave) // (4 * nr_threads))
+            for f in [pool.submit(_hash_all, wave[i:i+step]) for i in range(0, len(wave), step)]:
+                f.result()
+
 def recursive_dependencies(t, max_level=-1):
     '''
     for dep in recursive_dependencies(t, max_level=-1):
@@ -617,10 +749,60 @@ class TaskGenerator:
     2. call ``add`` with the result of that and the value 2
     2. call ``add`` again with the result of the previous call
 
+    Execution hints can be passed as arguments to the decorator::
+
+        @TaskGenerator(executor='thread')
+        def fetch(url):
+            ...
+
+    Parameters
+    ----------
+    executor : str, optional
+        If ``'thread'``, ``jug execute`` will run these tasks on a pool of
+        threads (see ``--threads``). This is useful for tasks that spend their
+        time waiting for I/O or in code that releases the GIL. By default,
+        tasks are run in the main thread.
+    priority : number, optional
+        Among the tasks which are ready to run, ``jug execute`` starts the
+        ones with higher priority first (default: 0).
+    resources : dict, optional
+        Resources needed by each task, e.g., ``{'mem': '30G', 'cpus': 16}``.
+        ``jug execute`` only runs the tasks on nodes with enough capacity and
+        does not run more tasks at the same time than fit on the node.
+    persist : bool, optional
+        If False, the results are never saved: they are computed (in the
+        process which needs them) whenever a task that depends on them is
+        run. This is useful for very cheap tasks, for which saving and
+        loading the result takes longer than computing it (default: True).
+        Hashes are not affected.
+    retries : int, optional
+        Number of times that ``jug execute`` runs a task again after it fails
+        (default: the value of ``jug execute --retries``, which is 0).
+    retry_backoff : float, optional
+        Seconds to wait before the first retry. The wait doubles after each
+        further failure (default: the value of ``jug execute
+        --retry-backoff``).
     '''
     _jug_is_task_generator = True
-    def __init__(self, f):
+    # Execution hints, which are copied to the generated tasks
+    _hints = ('executor', 'priority', 'resources', 'persist', 'retries', 'retry_backoff')
+    executor = None
+    priority = None
+    resources = None
+    persist = None
+    retries = None
+    retry_backoff = None
+    def __init__(self, f=None, executor=None, priority=None, resources=None, persist=None, retries=None, retry_backoff=None):
+        from .resources import parse_resources
+        if executor not in (None, 'thread'):
+            raise ValueError("jug.TaskGenerator: unknown executor '{}' (valid options are None or 'thread')".format(executor))
         self.f = f
+        self.executor = executor
+        self.priority = priority
+        self.resources = (parse_resources(resources) if resources is not None else None)
+        self.persist = persist
+        self.retries = retries
+        self.retry_backoff = retry_backoff
 
     def __getstate__(self):
         from sys import modules
@@ -637,7 +819,17 @@ class TaskGenerator:
         self.f = getattr(modules[modname], fname)
 
     def __call__(self, *args, **kwargs):
-        return Task(self.f, *args, **kwargs)
+        if self.f is None:
+            # Used as a decorator with arguments: @TaskGenerator(executor=...)
+            f, = args
+            self.f = f
+            return self
+        t = Task(self.f, *args, **kwargs)
+        for hint in self._hints:
+            val = getattr(self, hint)
+            if val is not None:
+                setattr(t, hint, val)
+        return t
 
 
 # This is lower case to be used like a function
@@ -0,0 +1,19 @@
+import asyncio
+from jug import TaskGenerator
+
+running = [0, 0]
+
+@TaskGenerator
+async def wait_for(i):
+    running[0] += 1
+    running[1] = max(running)
+    await asyncio.sleep(.05)
+    running[0] -= 1
+    return running[1]
+
+@TaskGenerator
+def max_concurrent(vals):
+    return max(vals)
+
+vals = [wait_for(i) for i in range(8)]
+nr_concurrent = max_concurrent(vals)
@@ -0,0 +1,15 @@
+from jug import TaskGenerator
+
+@TaskGenerator
+def load(i):
+    return list(range(i))
+
+@TaskGenerator
+def clean(xs):
+    return [x for x in xs if x % 2 == 0]
+
+@TaskGenerator
+def featurize(xs):
+    return sum(xs)
+
+features = [featurize(clean(load(i))) for i in range(8)]
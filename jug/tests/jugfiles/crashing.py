@@ -0,0 +1,15 @@
+import os
+from jug import TaskGenerator
+
+@TaskGenerator
+def crash_on(x, bad):
+    if x == bad:
+        # As if killed (e.g., for using too much memory)
+        os._exit(1)
+    return x
+
+@TaskGenerator
+def plus1(x):
+    return x + 1
+
+vals = [plus1(crash_on(i, 3)) for i in range(8)]
@@ -0,0 +1,16 @@
+from jug import TaskGenerator
+
+@TaskGenerator
+def double(x):
+    return 2*x
+
+@TaskGenerator(persist=False)
+def params(n):
+    return {'n': n, 'scale': 3}
+
+@TaskGenerator
+def apply(p, x):
+    return p['scale']*x + p['n']
+
+ps = params(double(1))
+vals = [apply(ps, double(i)) for i in range(4)]
@@ -0,0 +1,24 @@
+from jug import TaskGenerator
+
+attempts = {}
+
+def fail_twice(key):
+    attempts[key] = attempts.get(key, 0) + 1
+    if attempts[key] < 3:
+        raise IOError('Transient failure ({})'.format(key))
+
+@TaskGenerator
+def flaky(i):
+    fail_twice(('flaky', i))
+    return i
+
+@TaskGenerator(executor='thread')
+def flaky_thread(i):
+    fail_twice(('flaky_thread', i))
+    return i
+
+@TaskGenerator
+def add(a, b):
+    return a + b
+
+vals = [add(flaky(i), flaky_thread(i)) for i in range(3)]
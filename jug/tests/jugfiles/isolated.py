@@ -0,0 +1,19 @@
+from time import sleep
+from jug import TaskGenerator
+
+@TaskGenerator
+def hang():
+    sleep(60)
+
+@TaskGenerator
+def hog():
+    return bytearray(4 * 1024**3)
+
+@TaskGenerator
+def ok(x):
+    return x + 1
+
+hung = hang()
+hogged = hog()
+one = ok(0)
+two = ok(one)
@@ -0,0 +1,27 @@
+import threading
+from time import sleep
+from jug import TaskGenerator
+
+_lock = threading.Lock()
+
+@TaskGenerator(executor='thread')
+def hold():
+    with _lock:
+        sleep(.5)
+    return 1
+
+@TaskGenerator
+def pause():
+    sleep(.1)
+
+@TaskGenerator
+def use_lock(_):
+    # Would never be acquired if the process was forked while ``hold`` had it
+    if not _lock.acquire(timeout=5):
+        raise RuntimeError('lock not available')
+    _lock.release()
+    return 2
+
+held = hold()
+# ``pause`` makes sure that ``hold`` has the lock by then
+used = use_lock(pause())
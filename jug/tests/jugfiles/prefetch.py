@@ -0,0 +1,13 @@
+from jug import TaskGenerator
+
+# All the inputs are computed first (and, with a small --memory-budget, unloaded)
+@TaskGenerator(priority=1)
+def make_input(i):
+    return list(range(i))
+
+@TaskGenerator
+def total(xs):
+    return sum(xs)
+
+inputs = [make_input(i) for i in range(8)]
+totals = [total(x) for x in inputs]
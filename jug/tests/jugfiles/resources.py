@@ -0,0 +1,29 @@
+import threading
+from time import sleep
+from jug import TaskGenerator
+
+running = [0, 0]
+_lock = threading.Lock()
+
+@TaskGenerator(executor='thread', resources={'cpus': 2})
+def work(i):
+    with _lock:
+        running[0] += 1
+        running[1] = max(running)
+    sleep(.05)
+    with _lock:
+        running[0] -= 1
+    return running[1]
+
+@TaskGenerator(resources={'mem': '2T'})
+def huge():
+    return 0
+
+@TaskGenerator
+def max_concurrent(vals):
+    return max(vals)
+
+vals = [work(i) for i in range(8)]
+nr_concurrent = max_concurrent(vals)
+big = huge()
+after_big = max_concurrent([big])
@@ -0,0 +1,13 @@
+import threading
+from jug import TaskGenerator
+
+@TaskGenerator(executor='thread')
+def in_main_thread(i):
+    return threading.current_thread() is threading.main_thread()
+
+@TaskGenerator
+def count_true(vals):
+    return sum(vals)
+
+vals = [in_main_thread(i) for i in range(16)]
+nr_main = count_true(vals)
@@ -0,0 +1,15 @@
+from jug import TaskGenerator
+
+@TaskGenerator
+def make(n):
+    return list(range(n))
+
+@TaskGenerator
+def join(a, b):
+    return a + b
+
+# ``a`` is only needed again after ``b`` and ``x`` have run
+a = make(2)
+b = make(3)
+x = join(b, b)
+y = join(a, x)
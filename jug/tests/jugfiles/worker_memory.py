@@ -0,0 +1,13 @@
+from jug import TaskGenerator
+from jug.task import alltasks
+
+@TaskGenerator
+def make(i):
+    return [i]
+
+@TaskGenerator
+def nr_loaded(x):
+    # Including ``x``
+    return sum(t.is_loaded() for t in alltasks)
+
+nrs = [nr_loaded(make(i)) for i in range(10)]
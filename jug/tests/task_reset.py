@@ -2,6 +2,7 @@ import pytest
 import jug.task
 from jug.backends.dict_store import dict_store
 from jug.hooks import reset_all_hooks
+from jug.hash import set_hash_algorithm
 
 @pytest.fixture(scope='function')
 def task_reset_at_exit():
@@ -15,6 +16,7 @@ def task_reset_at_exit():
     while jug.task.alltasks:
         jug.task.alltasks.pop()
     reset_all_hooks()
+    set_hash_algorithm(None)
 
 def task_reset(f):
     return pytest.mark.usefixtures('task_reset_at_exit')(f)
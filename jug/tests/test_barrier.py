@@ -43,6 +43,48 @@ def test_barrier_once():
     jug.subcommands.execute.execute(options)
     assert 'four' in dir(sys.modules['wbarrier'])
 
+@task_reset
+def test_barrier_clears_hash_cache(monkeypatch):
+    import jug.hash
+    cleared = []
+    monkeypatch.setattr(jug.hash, 'clear_hash_cache', lambda: cleared.append(True))
+    options = default_options.copy()
+    options.jugdir = 'dict_store'
+    options.jugfile = find_test_jugfile('wbarrier.py')
+    jug.subcommands.execute.execute(options)
+    # Once per cycle: the jugfile is interpreted again after the barrier
+    assert len(cleared) == 2
+
+@task_reset
+def test_barrier_persistent():
+    import sys
+    from jug.task import alltasks
+    options = default_options.copy()
+    options.jugdir = 'dict_store'
+    options.jugfile = find_test_jugfile('wbarrier.py')
+    options.execute_persistent = True
+    jug.subcommands.execute.execute(options)
+    space = sys.modules['wbarrier'].__dict__
+    assert round(space['eight'].value()) == 8
+    # The jugfile was interpreted only once
+    assert len(alltasks) == 3
+    assert space['four'].args[0] is space['two']
+    assert all(t.can_load() for t in alltasks)
+
+@task_reset
+def test_bvalue_persistent():
+    import sys
+    options = default_options.copy()
+    options.jugdir = 'dict_store'
+    options.jugfile = find_test_jugfile('barrier_mapreduce.py')
+    options.execute_persistent = True
+    jug.subcommands.execute.execute(options)
+    assert sys.modules['barrier_mapreduce'].values == product(list(range(20)))
+
+    options.jugfile = find_test_jugfile('bvalue.py')
+    jug.subcommands.execute.execute(options)
+    assert sys.modules['bvalue'].four == 4
+
 @task_reset
 def test_bvalue():
     jugfile = find_test_jugfile('bvalue.py')
@@ -67,3 +109,20 @@ def test_recursive():
     store, space = jug.jug.init(jugfile, store)
     assert 's2' in space
 
+
+@task_reset
+def test_resumable_hash_threads():
+    from jug.task import alltasks
+    jugfile = jug.jug.ResumableJugfile(find_test_jugfile('wbarrier.py'), 'dict_store', hash_threads=2)
+    try:
+        jugfile.start()
+        assert len(alltasks) == 1
+        assert all('__jug_hash__' in t.__dict__ for t in alltasks)
+        alltasks[0].run()
+        jugfile.resume()
+        assert jugfile.finished
+        # The tasks defined after the barrier were hashed too
+        assert len(alltasks) == 3
+        assert all('__jug_hash__' in t.__dict__ for t in alltasks)
+    finally:
+        jugfile.close()
@@ -89,6 +89,27 @@ def test_pack_cleanup(tmpdir):
     assert len(list(fs.list())) == 2
 
 
+def test_pack_overwrite_none(tmpdir):
+    tmpdir = str(tmpdir)
+    key1 = hash_one('k1')
+    key2 = hash_one('k2')
+    fs = file_store(tmpdir)
+    fs.dump(None, key1)
+    fs.dump(None, key2)
+    assert fs.update_pack() == 2
+    fs.close()
+
+    fs = file_store(tmpdir)
+    fs.dump(1, key1)
+    fs.rename(key1, key2)
+    fs.close()
+
+    fs = file_store(tmpdir)
+    assert fs.load(key2) == 1
+    assert not fs.can_load(key1)
+    fs.close()
+
+
 def test_lock_permissions(tmpdir):
     tmpdir = str(tmpdir)
     os.makedirs(tmpdir, exist_ok=True)
@@ -111,3 +132,38 @@ def test_pack_decode_error_does_not_leak_sys_path(tmpdir):
     with pytest.raises(Exception):
         file_store(tmpdir)
     assert sys.path == before
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is only available on Linux')
+def test_watch(tmpdir):
+    import threading
+    from time import time
+    from jug.backends.file_store import inotify_watcher
+    fs = file_store(str(tmpdir))
+    watcher = fs.watch()
+    assert isinstance(watcher, inotify_watcher)
+    try:
+        assert not watcher.wait(.01)
+        # Result written into a new shard directory
+        threading.Timer(.1, fs.dump, (1, hash_one('k0'))).start()
+        start = time()
+        assert watcher.wait(10) == set([hash_one('k0')])
+        assert time() - start < 5
+
+        # Result written into an existing shard directory
+        key = hash_one('k0')
+        other = key[:2] + b'0' * (len(key) - 2)
+        threading.Timer(.1, fs.dump, (2, other)).start()
+        written = set()
+        while other not in written:
+            changed = watcher.wait(10)
+            assert changed
+            written.update(changed)
+        while watcher.wait(.2):
+            pass
+
+        # Locks are not results
+        threading.Timer(.05, fs.getlock(hash_one('k1')).get).start()
+        assert not watcher.wait(.5)
+    finally:
+        watcher.close()
@@ -1,3 +1,4 @@
+from .task_reset import task_reset_at_exit, task_reset
 from jug.hash import hash_one
 from jug.unsafe import NoHash
 import numpy as np
@@ -38,3 +39,324 @@ def test_hash_set():
 def test_unsafe_nohash():
     assert hash_one([1,2,NoHash(3)]) == hash_one([1,2,NoHash(7)])
 
+
+
+def test_parse_hash_algorithm():
+    import pytest
+    from jug.hash import parse_hash_algorithm
+    assert parse_hash_algorithm('sha1')[0] == 'sha1'
+    assert parse_hash_algorithm('BLAKE2b-20')[0] == 'blake2b-20'
+    # The default digest size is not part of the name
+    assert parse_hash_algorithm('blake2b-64')[0] == 'blake2b'
+    assert len(parse_hash_algorithm('blake2b-20')[1]().digest()) == 20
+    for invalid in ['md17', 'sha1-20', 'blake2s-33', 'shake_128']:
+        with pytest.raises(ValueError):
+            parse_hash_algorithm(invalid)
+
+
+@task_reset
+def test_set_hash_algorithm():
+    import jug.task
+    from jug.hash import set_hash_algorithm, hash_algorithm, load_hash_algorithm
+    from jug.task import Task
+    def double(x):
+        return 2*x
+    h_sha1 = Task(double, 2).hash()
+    assert len(h_sha1) == 40
+    set_hash_algorithm('blake2b-16')
+    assert hash_algorithm() == 'blake2b-16'
+    # Empty stores record the algorithm
+    assert load_hash_algorithm(jug.task.Task.store) == 'blake2b-16'
+    h = Task(double, 2).hash()
+    assert len(h) == 32
+    assert h != h_sha1
+    set_hash_algorithm(None)
+    assert Task(double, 2).hash() == h_sha1
+
+
+@task_reset
+def test_hash_algorithm_mixed():
+    import pytest
+    import jug.task
+    from jug.hash import set_hash_algorithm, select_hash_algorithm, hash_algorithm
+    from jug.task import Task
+    def double(x):
+        return 2*x
+    store = jug.task.Task.store
+    Task(double, 2).run()
+    # The store has results computed with sha1
+    with pytest.raises(RuntimeError):
+        set_hash_algorithm('sha256')
+    set_hash_algorithm(None)
+    store.dump('blake2b-20', b'jug-hash-algorithm')
+    # Without a request, the recorded algorithm is used
+    assert select_hash_algorithm(store) == 'blake2b-20'
+    assert hash_algorithm() == 'blake2b-20'
+
+
+@task_reset
+def test_rehash(tmpdir):
+    import jug.jug
+    import jug.task
+    from jug.hash import hash_algorithm, load_hash_algorithm
+    from jug.subcommands.rehash import rehash_store
+    from jug.tests.utils import simple_execute
+    from .utils import find_test_jugfile
+    jugfile = find_test_jugfile('simple.py')
+    store, space = jug.jug.init(jugfile, str(tmpdir))
+    tasks = jug.task.alltasks[:]
+    simple_execute()
+    nr_moved, nr_missing = rehash_store(store, tasks, 'blake2b-20')
+    assert nr_moved == len(tasks)
+    assert nr_missing == 0
+    assert load_hash_algorithm(store) == 'blake2b-20'
+
+    # A new process uses the recorded algorithm and finds all the results
+    jug.hash.set_hash_algorithm(None)
+    del jug.task.alltasks[:]
+    store, space = jug.jug.init(jugfile, str(tmpdir))
+    assert hash_algorithm() == 'blake2b-20'
+    assert all(t.can_load() for t in jug.task.alltasks)
+    assert space['vals'][0].value() == 6
+
+
+@task_reset
+def test_rehash_not_persisted(tmpdir):
+    import jug.jug
+    import jug.task
+    from jug.subcommands.rehash import rehash_store
+    from jug.tests.utils import simple_execute
+    from .utils import find_test_jugfile
+    jugfile = find_test_jugfile('ephemeral.py')
+    store, space = jug.jug.init(jugfile, str(tmpdir))
+    tasks = jug.task.alltasks[:]
+    simple_execute()
+    # ``double(1)`` appears twice
+    nr_persisted = len(set(t.hash() for t in tasks if t.persist))
+    nr_moved, nr_missing = rehash_store(store, tasks, 'blake2b-20')
+    assert nr_moved == nr_persisted
+    assert nr_missing == 0
+
+    # The tasks which depend on a task which is not persisted are found too
+    jug.hash.set_hash_algorithm(None)
+    del jug.task.alltasks[:]
+    store, space = jug.jug.init(jugfile, str(tmpdir))
+    assert all(t.can_load() for t in jug.task.alltasks)
+    assert [v.value() for v in space['vals']] == [3*2*i + 2 for i in range(4)]
+
+
+def _reference_hash_update(M, elems):
+    # Recursive implementation used by previous versions of jug
+    import pickle
+    from jug.hash import new_hash_object
+    def ref_hash_one(obj):
+        h = new_hash_object()
+        _reference_hash_update(h, [('hash1', obj)])
+        return h.hexdigest().encode('utf-8')
+    for n,e in elems:
+        M.update(pickle.dumps(n))
+        if hasattr(e, '__jug_hash__'):
+            M.update(e.__jug_hash__())
+        elif type(e) in (list, tuple):
+            M.update(repr(type(e)).encode('utf-8'))
+            _reference_hash_update(M, enumerate(e))
+        elif type(e) == set:
+            M.update(b'set')
+            items = [ref_hash_one(el) for el in e]
+            items.sort()
+            _reference_hash_update(M, enumerate(items))
+        elif type(e) == dict:
+            M.update(b'dict')
+            items = [(ref_hash_one(k),v) for k,v in e.items()]
+            items.sort(key=(lambda k_v:k_v[0]))
+            _reference_hash_update(M, items)
+        elif type(e) == np.ndarray:
+            M.update(b'np.ndarray')
+            M.update(pickle.dumps(e.dtype))
+            M.update(pickle.dumps(e.shape))
+            try:
+                M.update(e.data)
+            except:
+                M.update(e.copy().data)
+        else:
+            M.update(pickle.dumps(e))
+    return M
+
+
+def test_hash_unchanged():
+    from jug.hash import new_hash_object, hash_update
+    from jug.utils import CustomHash
+    values = [
+        0, 3, -7, 1023, 1024, 2**70, 1.5, -0.0, float('nan'), 1+2j,
+        'hello', 'x' * 100, b'abc', None, True, False,
+        [1, 'a', (2.0, None)], (1, [2, [3, [4]]]), [[], (), {}, set()],
+        {1, 2, 'x'}, {'a': 1, 2: [3, {'b': (4,)}], (1, 2): 'c'},
+        {frozenset([1,2,3]): 4, 'hello': 2}, range(3),
+        np.arange(6, dtype=np.int32).reshape(2, 3), np.arange(20.)[::3],
+        np.asfortranarray(np.arange(12.).reshape(3, 4)),
+        CustomHash(12, lambda x: b'twelve'),
+        ]
+    for v in values:
+        expected = _reference_hash_update(new_hash_object(), [('hash1', v)]).hexdigest()
+        assert hash_update(new_hash_object(), [('hash1', v)]).hexdigest() == expected
+
+
+def test_hash_deep_nesting():
+    v = []
+    for _ in range(10000):
+        v = [v]
+    assert len(hash_one(v)) == 40
+
+
+def test_register_hash_encoder():
+    import pytest
+    from jug.hash import register_hash_encoder, _encoders
+    class Point:
+        def __init__(self, x, y):
+            self.x = x
+            self.y = y
+    register_hash_encoder(Point, lambda M, p: M.update('Point({},{})'.format(p.x, p.y).encode('utf-8')))
+    try:
+        assert hash_one(Point(1, 2)) == hash_one(Point(1, 2))
+        assert hash_one(Point(1, 2)) != hash_one(Point(2, 1))
+        assert hash_one([Point(1, 2)]) == hash_one([Point(1, 2)])
+    finally:
+        del _encoders[Point]
+    with pytest.raises(ValueError):
+        register_hash_encoder(int, lambda M, i: None)
+
+
+@task_reset
+def test_merkle_hashing():
+    import jug.hash
+    from jug.hash import set_hash_algorithm
+    big = tuple(range(1000))
+    h_sha1 = hash_one(big)
+    # The default algorithm does not cache digests
+    assert not jug.hash._digests
+
+    set_hash_algorithm('blake2b-20')
+    h = hash_one(big)
+    assert id(big) in jug.hash._digests
+    assert hash_one(big) == h
+    # The hash depends only on the contents
+    assert hash_one(tuple(range(1000))) == h
+    assert hash_one(tuple(range(1001))) != h
+    assert len(h) == len(h_sha1)
+
+    # Containers which can be modified are not cached
+    jug.hash.clear_hash_cache()
+    for e in [list(range(1000)), set(range(1000)), dict.fromkeys(range(1000)), (list(range(10)),) * 300]:
+        hash_one(e)
+        assert not jug.hash._digests
+    jug.hash.clear_hash_cache()
+    assert not jug.hash._digests
+
+
+@task_reset
+def test_merkle_hashing_mutable_inline(monkeypatch):
+    import jug.hash
+    from jug.hash import set_hash_algorithm
+    set_hash_algorithm('blake2b-20')
+    digested = []
+    container_digest = jug.hash._container_digest
+    def record(e, use_cache):
+        digested.append(type(e))
+        return container_digest(e, use_cache)
+    monkeypatch.setattr(jug.hash, '_container_digest', record)
+    # Lists, sets, and dictionaries are hashed inline (no separate digest)
+    for e in [list(range(1000)), set(range(1000)), dict.fromkeys(range(1000))]:
+        hash_one(e)
+    assert not digested
+    hash_one([tuple(range(1000))])
+    assert digested == [tuple]
+
+
+@task_reset
+def test_merkle_hashing_modified_list():
+    from jug.hash import set_hash_algorithm
+    from jug.task import Task
+    def count(xs, i):
+        return len(xs) + i
+    set_hash_algorithm('blake2b-20')
+    L = list(range(300))
+    t1 = Task(count, L, 0)
+    t1.hash()
+    L[0] = 99
+    t2 = Task(count, L, 0)
+    assert t1.hash() != t2.hash()
+
+    # The same for a tuple which contains a list
+    L = list(range(3))
+    T = (L,) * 300
+    t1 = Task(count, T, 0)
+    t1.hash()
+    L.append(3)
+    t2 = Task(count, T, 0)
+    assert t1.hash() != t2.hash()
+
+
+@task_reset
+def test_merkle_hashing_numpy():
+    import gc
+    import jug.hash
+    from jug.hash import set_hash_algorithm
+    set_hash_algorithm('blake2b-20')
+    A = np.arange(1 << 18, dtype=np.float64)
+    h = hash_one(A)
+    # Writeable arrays are not cached
+    assert not jug.hash._array_digests
+    A[0] = 1.
+    assert hash_one(A) != h
+    A[0] = 0.
+    # Neither are read-only views of writeable arrays
+    V = A.view()
+    V.flags.writeable = False
+    assert hash_one(V) == h
+    assert not jug.hash._array_digests
+
+    A.flags.writeable = False
+    assert hash_one(A) == h
+    assert id(A) in jug.hash._array_digests
+    assert hash_one(A.copy()) == h
+    assert hash_one(A[::2]) != h
+    del A, V
+    gc.collect()
+    assert not jug.hash._array_digests
+
+
+def test_hash_numpy_strided_chunks(monkeypatch):
+    import hashlib
+    import jug.hash
+    from jug.hash import _hash_array_chunks
+    # Several chunks per array (and chunks which do not divide the rows)
+    monkeypatch.setattr(jug.hash, '_ARRAY_CHUNK_NBYTES', 24)
+    arrays = [
+        np.arange(100.)[::3],
+        np.asfortranarray(np.arange(120).reshape(4, 5, 6)),
+        np.arange(120).reshape(4, 5, 6)[:, ::2, 1:],
+        np.array([(1, 2.), (3, 4.), (5, 6.)], dtype=[('a', 'i4'), ('b', 'f8')])[::-1],
+        np.array(['ab', 'cde', 'f'])[::2],
+        np.arange(10, dtype=np.complex64)[::-2],
+        np.zeros((4, 0))[::2],
+        ]
+    for A in arrays:
+        expected = hashlib.sha1(A.copy().data).hexdigest()
+        M = hashlib.sha1()
+        _hash_array_chunks(M, A)
+        assert M.hexdigest() == expected
+
+
+def test_hash_numpy_strided_memory():
+    import tracemalloc
+    A = np.arange(1 << 22, dtype=np.float64)
+    expected = hash_one(A[::2].copy())
+    tracemalloc.start()
+    try:
+        h = hash_one(A[::2])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert h == expected
+    # A copy of the view would take 16MiB
+    assert peak < (4 << 20)
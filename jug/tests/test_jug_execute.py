@@ -9,6 +9,7 @@ from .utils import find_test_jugfile
 import pytest
 
 import random
+import sys
 jug.jug.silent = True
 
 
@@ -49,7 +50,9 @@ def test_jug_execute_deps():
       'tasklets.py',
       'barrier_mapreduce.py',
       'compound_nonsimple.py',
-      'slice_task.py'])
+      'slice_task.py',
+      'ephemeral.py',
+      'threaded.py'])
 def test_aggressive_unload(jugfile):
     from jug.jug import execution_loop
     from jug.task import alltasks
@@ -60,6 +63,20 @@ def test_aggressive_unload(jugfile):
     store, space = jug.jug.init(find_test_jugfile(jugfile), 'dict_store')
     execution_loop(alltasks, options)
 
+@task_reset
+def test_memory_budget():
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+
+    options = parse(['execute', '--memory-budget', '64'])
+    options.execute_target = None
+    store, space = jug.jug.init(find_test_jugfile('simple.py'), 'dict_store')
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert all(t.can_load() for t in tasks)
+    assert sum(1 for t in tasks if t.is_loaded()) < len(tasks)
+    assert space['vals'][0].value() == 6
+
 @task_reset
 def test_target_exact():
     from jug.jug import execution_loop
@@ -140,9 +157,585 @@ def test_failed_task():
     except FailingTask:  # Using a custom exception to make sure we don't silence any errors
         pass
 
-    # The third task fails so we get 2 results and 1 failed lock
+    # Each task is followed by its dependent (whose input is loaded), so the
+    # fifth task (the third some_fail) fails: we get 4 results and 1 failed lock
     # NOTE: This might be incorrect if order of execution is not guaranteed
-    assert len(store.store) == 3
-    # 10 tasks could be run and were taken. Only the 10 waiting remain
-    assert len(alltasks) == 10
+    assert len(store.store) == 5
+    # 5 tasks were taken. The 7 remaining independent tasks and their 8
+    # dependents remain
+    assert len(alltasks) == 15
     assert len([x for x in alltasks_copy if x.is_failed()]) == 1
+
+@task_reset
+def test_execute_jobs(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '-j', '4'])
+    options.jugfile = find_test_jugfile('simple.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert all(t.can_load() for t in tasks)
+    assert not store.listlocks()
+    assert space['vals'][0].value() == 6
+
+@task_reset
+def test_execute_lock_batch(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--lock-batch', '4'])
+    options.jugfile = find_test_jugfile('simple.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert all(t.can_load() for t in tasks)
+    assert not store.listlocks()
+    assert space['vals'][0].value() == 6
+
+@task_reset
+def test_execute_lock_batch_release(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    from jug.hooks import register_hook
+    options = parse(['execute', '--lock-batch', '4'])
+    options.jugfile = find_test_jugfile('simple.py')
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    nr_locks = []
+    register_hook('execute.task-executed1', lambda t: nr_locks.append(len(store.listlocks())))
+    assert not execution_loop(alltasks, options)
+    # The locks of each batch are released once it is finished (and not only
+    # when no claims are left)
+    assert max(nr_locks) <= 2 * 4
+    assert not store.listlocks()
+
+@task_reset
+def test_execute_lock_batch_failed(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--lock-batch', '4'])
+    options.jugfile = find_test_jugfile('failing.py')
+    options.execute_keep_going = True
+    options.execute_keep_failed = True
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    assert execution_loop(alltasks, options)
+    # Only the failed tasks keep their locks
+    assert len(store.listlocks()) == 3
+
+@task_reset
+def test_execute_fuse(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--fuse'])
+    options.jugfile = find_test_jugfile('chains.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    batches = []
+    lock_many = store.lock_many
+    def counting_lock_many(names):
+        batches.append(len(names))
+        return lock_many(names)
+    store.lock_many = counting_lock_many
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    # Each chain is locked at once
+    assert batches == [3 for _ in range(8)]
+    assert all(t.can_load() for t in tasks)
+    assert not store.listlocks()
+    assert space['features'][5].value() == 6
+
+@task_reset
+def test_execute_fuse_finished_elsewhere(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    from jug.hooks import register_hook
+    options = parse(['execute', '--fuse'])
+    options.jugfile = find_test_jugfile('chains.py')
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    last = space['features'][0]
+    lock_many = store.lock_many
+    def finishing_lock_many(names):
+        if last.hash() in names and not last.can_load():
+            # Another process runs it just before the chain is locked
+            store.dump(-1, last.hash())
+        return lock_many(names)
+    store.lock_many = finishing_lock_many
+    executed = []
+    register_hook('execute.task-executed1', executed.append)
+    assert not execution_loop(alltasks, options)
+    assert last not in executed
+    assert last.value() == -1
+    assert not store.listlocks()
+
+@task_reset
+def test_execute_fuse_failed(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--fuse'])
+    options.jugfile = find_test_jugfile('failing.py')
+    options.execute_keep_going = True
+    options.execute_keep_failed = True
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    alltasks_copy = alltasks[:]
+    assert execution_loop(alltasks, options)
+    assert len([t for t in alltasks_copy if t.can_load()]) == 14
+    # Only the failed tasks keep their locks
+    assert len(store.listlocks()) == 3
+
+@task_reset
+def test_execute_prefetch(tmpdir):
+    import threading
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--prefetch', '--memory-budget', '1'])
+    options.jugfile = find_test_jugfile('prefetch.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    background = []
+    load = store.load
+    def recording_load(name):
+        background.append(threading.current_thread() is not threading.main_thread())
+        return load(name)
+    store.load = recording_load
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert all(t.can_load() for t in tasks)
+    # Inputs were loaded in the background
+    assert any(background)
+    assert [t.value() for t in space['totals']] == [sum(range(i)) for i in range(8)]
+
+@task_reset
+def test_execute_write_behind(tmpdir):
+    import threading
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--write-behind', '2', '--aggressive-unload'])
+    options.jugfile = find_test_jugfile('simple.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    writes = []
+    dump = store.dump
+    def recording_dump(obj, name):
+        # (in background thread, lock is still held)
+        writes.append((threading.current_thread() is not threading.main_thread(),
+                        store.getlock(name).is_locked()))
+        return dump(obj, name)
+    store.dump = recording_dump
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert writes == [(True, True) for _ in tasks]
+    assert all(t.can_load() for t in tasks)
+    assert not store.listlocks()
+    assert space['vals'][0].value() == 6
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+@task_reset
+def test_execute_ephemeral(tmpdir, jobs):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '-j', jobs])
+    options.jugfile = find_test_jugfile('ephemeral.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert not alltasks
+    assert all(t.can_load() for t in tasks)
+    assert not store.can_load(space['ps'].hash())
+    assert not store.listlocks()
+    assert [v.value() for v in space['vals']] == [2, 8, 14, 20]
+
+@task_reset
+def test_execute_jobs_failed(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '-j', '3'])
+    options.jugfile = find_test_jugfile('failing.py')
+    options.execute_keep_going = True
+    options.execute_keep_failed = True
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    alltasks_copy = alltasks[:]
+    assert execution_loop(alltasks, options)
+    assert len([t for t in alltasks_copy if t.can_load()]) == 14
+    assert len([t for t in alltasks_copy if t.is_failed()]) == 3
+
+@task_reset
+def test_execute_threads():
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--threads', '3'])
+    options.jugfile = find_test_jugfile('threaded.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, 'dict_store')
+    assert not execution_loop(alltasks, options)
+    assert space['nr_main'].value() == 0
+    assert not list(store.listlocks())
+
+@task_reset
+def test_execute_async():
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--async-concurrency', '4'])
+    options.jugfile = find_test_jugfile('async_tasks.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, 'dict_store')
+    assert not execution_loop(alltasks, options)
+    assert space['nr_concurrent'].value() == 4
+    assert not list(store.listlocks())
+
+@task_reset
+def test_execute_resources():
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--threads', '8', '--resources', 'cpus=5,mem=1G'])
+    options.jugfile = find_test_jugfile('resources.py')
+    options.execute_target = None
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+
+    store, space = jug.jug.init(options.jugfile, 'dict_store')
+    assert space['big'].resources == {'mem': 2*1024**4}
+    execution_loop(alltasks, options)
+    assert space['nr_concurrent'].value() == 2
+    # Too large for this node: it was neither run nor locked
+    assert not space['big'].can_load()
+    assert not space['big'].is_locked()
+
+
+@task_reset
+def test_execute_resources_too_large(tmpdir, capsys):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    from jug.hooks import register_hook
+    from jug.scheduler import save_runtimes
+    options = parse(['execute', '--resources', 'cpus=5,mem=1G', '--speculate', '1'])
+    options.jugfile = find_test_jugfile('resources.py')
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    too_large = []
+    register_hook('execute.task-too-large', too_large.append)
+    # As if it had been running elsewhere for much longer than usual
+    save_runtimes(store, {space['big'].name: [1e-3]})
+    assert space['big'].lock()
+    execution_loop(alltasks, options)
+    assert too_large == [space['big']]
+    # --speculate does not run it here
+    assert not space['big'].can_load()
+    space['big'].unlock()
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='Uses /proc to find the size of the process')
+@task_reset
+def test_execute_isolate(tmpdir):
+    from time import time
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    import mmap
+    options = parse(['execute', '--timeout', '2', '--memory-limit', '512M'])
+    options.jugfile = find_test_jugfile('isolated.py')
+    options.execute_target = None
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    # The address space which the children inherit (larger than the limit)
+    # does not count
+    reserved = mmap.mmap(-1, 1024**3)
+    start = time()
+    try:
+        assert execution_loop(alltasks, options)
+    finally:
+        reserved.close()
+    assert time() - start < 30
+    assert space['hung'].is_failed()
+    assert space['hogged'].is_failed()
+    assert space['two'].can_load()
+    assert space['two'].value() == 2
+
+@task_reset
+def test_async_run():
+    store, space = jug.jug.init(find_test_jugfile('async_tasks.py'), 'dict_store')
+    t = space['vals'][0]
+    assert t.run() == 1
+    assert t.can_load()
+
+@task_reset
+def test_execute_speculate(tmpdir):
+    import os
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    from jug.scheduler import save_runtimes
+    options = parse(['execute', '--speculate', '3'])
+    options.jugfile = find_test_jugfile('simple.py')
+    options.execute_target = None
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    tasks = alltasks[:]
+    save_runtimes(store, {'simple.double': [1., 1., 2.]})
+    # Another process has been running the first task for 10 seconds
+    straggler = tasks[0]
+    lock = store.getlock(straggler.hash())
+    assert lock.get()
+    t = os.stat(lock.fullname).st_mtime - 10.
+    os.utime(lock.fullname, (t, t))
+    assert lock.age() > 9.
+
+    assert not execution_loop(alltasks, options)
+    assert all(t.can_load() for t in tasks)
+    # The lock still belongs to the other process
+    assert lock.is_locked()
+
+@task_reset
+def test_execute_critical_path():
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    from jug.scheduler import load_runtimes
+    options = parse(['execute', '--schedule=critical-path'])
+    options.jugfile = find_test_jugfile('simple.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, 'dict_store')
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert all(t.can_load() for t in tasks)
+    runtimes = load_runtimes(store)
+    assert len(runtimes['simple.double']) == 8
+    assert len(runtimes['simple.sum2']) == 16
+
+@task_reset
+def test_execute_retries(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--retries', '2', '--retry-backoff', '0.01'])
+    options.jugfile = find_test_jugfile('flaky.py')
+    options.execute_target = None
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    alltasks_copy = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    assert all(t.can_load() for t in alltasks_copy)
+    assert [t.value() for t in space['vals']] == [0, 2, 4]
+    # The number of attempts is not kept
+    assert not [k for k in store.list() if k.endswith(b'-attempts')]
+    assert not store.listlocks()
+
+@task_reset
+def test_execute_retries_exhausted(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--retries', '1', '--retry-backoff', '0.01', '--keep-going', '--keep-failed'])
+    options.jugfile = find_test_jugfile('flaky.py')
+    options.execute_target = None
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    alltasks_copy = alltasks[:]
+    assert execution_loop(alltasks, options)
+    assert not any(t.can_load() for t in alltasks_copy)
+    # Only the tasks which failed are locked
+    assert len(store.listlocks()) == 6
+
+@task_reset
+def test_aggressive_unload_refcount():
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+
+    options = parse(['execute', '--aggressive-unload'])
+    options.execute_target = None
+    store, space = jug.jug.init(find_test_jugfile('unload.py'), 'dict_store')
+    loads = []
+    load = store.load
+    def recording_load(name):
+        loads.append(name)
+        return load(name)
+    store.load = recording_load
+    tasks = alltasks[:]
+    assert not execution_loop(alltasks, options)
+    # Results stay loaded for as long as a task needs them, but no longer
+    assert not loads
+    assert not any(t.is_loaded() for t in tasks)
+    assert space['y'].value() == [0, 1, 0, 1, 2, 0, 1, 2]
+
+
+@task_reset
+def test_wait_cycles_deadline():
+    from time import time
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+
+    class spurious_watcher(object):
+        # Wakes up immediately (as if other results were being written)
+        nr_wakeups = 0
+        def wait(self, timeout):
+            spurious_watcher.nr_wakeups += 1
+            return True
+        def close(self):
+            pass
+
+    options = parse(['execute'])
+    options.jugfile = find_test_jugfile('simple.py')
+    options.execute_nr_wait_cycles = 2
+    options.execute_wait_cycle_time = .1
+    store, space = jug.jug.init(options.jugfile, 'dict_store')
+    store.watch = spurious_watcher
+    # Being run elsewhere
+    assert store.getlock(alltasks[0].hash()).get()
+    start = time()
+    execution_loop(alltasks, options)
+    assert time() - start >= .2
+    assert spurious_watcher.nr_wakeups > 2
+    assert not alltasks[0].can_load()
+
+@task_reset
+def test_wait_refreshes_written():
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+
+    options = parse(['execute'])
+    options.jugfile = find_test_jugfile('simple.py')
+    store, space = jug.jug.init(options.jugfile, 'dict_store')
+    # Being run elsewhere
+    first = alltasks[0]
+    assert store.getlock(first.hash()).get()
+
+    checked = []
+    can_load = store.can_load
+    def recording_can_load(name):
+        checked.append(name)
+        return can_load(name)
+    store.can_load = recording_can_load
+
+    class writing_watcher(object):
+        # Other results are written before the one we are waiting for
+        nr_wakeups = 0
+        def __init__(self):
+            del checked[:]
+        def wait(self, timeout):
+            writing_watcher.nr_wakeups += 1
+            if writing_watcher.nr_wakeups < 10:
+                return set([b'unrelated'])
+            first.run()
+            store.getlock(first.hash()).release()
+            return set([first.hash()])
+        def close(self):
+            pass
+    store.watch = writing_watcher
+    assert not execution_loop(alltasks, options)
+    assert space['vals'][0].value() == 6
+    # Each wake up only checks the results which were written (instead of
+    # all the tasks still waiting)
+    assert len(checked) < 20
+
+
+@task_reset
+def test_execute_jobs_worker_dies(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '-j', '2', '--keep-going'])
+    options.jugfile = find_test_jugfile('crashing.py')
+    options.execute_nr_wait_cycles = 1
+    options.execute_wait_cycle_time = 0
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    tasks = alltasks[:]
+    assert execution_loop(alltasks, options)
+    # Only the task which killed its worker (and the one depending on it)
+    # were not run
+    assert [t.can_load() for t in tasks].count(False) == 2
+    assert not store.listlocks()
+    assert [v.value() for i, v in enumerate(space['vals']) if i != 3] == [1, 2, 3, 5, 6, 7, 8]
+
+
+@task_reset
+def test_execute_jobs_unload(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '-j', '2'])
+    options.jugfile = find_test_jugfile('worker_memory.py')
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    assert not execution_loop(alltasks, options)
+    # Workers do not keep the results which they loaded
+    assert [t.value() for t in space['nrs']] == [1] * 10
+
+@task_reset
+def test_execute_jobs_memory_budget(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '-j', '2', '--memory-budget', '1G'])
+    options.jugfile = find_test_jugfile('worker_memory.py')
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    assert not execution_loop(alltasks, options)
+    # Within the budget, the results are kept
+    assert max(t.value() for t in space['nrs']) > 1
+
+def test_new_worker_pool():
+    from jug.jug import _new_worker_pool
+    pool = _new_worker_pool(2)
+    try:
+        # Forked right away (and not when the first task is submitted, when
+        # other threads may be running)
+        assert len(pool._processes) == 2
+    finally:
+        pool.shutdown(wait=True)
+
+@task_reset
+def test_execute_lock_batch_stopped(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    from jug.hooks import register_hook
+    options = parse(['execute', '--lock-batch', '4'])
+    options.jugfile = find_test_jugfile('simple.py')
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    executed = []
+    def stop(t):
+        executed.append(t)
+        if len(executed) == 2:
+            # As with SIGTERM (see jug.subcommands.execute._sigterm)
+            raise SystemExit(1)
+    register_hook('execute.task-executed1', stop)
+    with pytest.raises(SystemExit):
+        execution_loop(alltasks, options)
+    # The claimed tasks which were not run are returned
+    assert not store.listlocks()
+
+
+@task_reset
+def test_execute_isolate_threads(tmpdir):
+    from jug.jug import execution_loop
+    from jug.task import alltasks
+    options = parse(['execute', '--isolate', '--threads', '2'])
+    options.jugfile = find_test_jugfile('isolated_threads.py')
+
+    store, space = jug.jug.init(options.jugfile, str(tmpdir))
+    assert not execution_loop(alltasks, options)
+    assert space['used'].value() == 2
@@ -65,6 +65,24 @@ def test_cleanup():
     jug.subcommands.cleanup.cleanup(store, opts)
     assert not store.can_load(h)
 
+@task_reset
+def test_cleanup_runtimes():
+    from jug.scheduler import load_runtimes, save_runtimes
+    jugfile = os.path.join(_jugdir, 'tasklets.py')
+    store, space = jug.jug.init(jugfile, 'dict_store')
+    simple_execute()
+    output = []
+    opts = Options(default_options)
+    opts.print_out = output.append
+    jug.subcommands.cleanup.cleanup(store, opts)
+
+    save_runtimes(store, {space['t'].name: [1.5]})
+    del output[:]
+    jug.subcommands.cleanup.cleanup(store, opts)
+    # The runtimes (used by --schedule=critical-path and --speculate) are kept
+    assert load_runtimes(store) == {space['t'].name: [1.5]}
+    assert output == ['Removed 0 objects']
+
 @task_reset
 def test_shell_invalidate():
     jugfile = os.path.join(_jugdir, 'iteratetask.py')
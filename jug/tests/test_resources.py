@@ -0,0 +1,35 @@
+from pytest import raises
+
+from jug.resources import fits, node_capacity, parse_resources
+
+
+def test_parse_resources():
+    assert parse_resources(None) == {}
+    assert parse_resources({'mem': '2K', 'cpus': 4}) == {'mem': 2048, 'cpus': 4.}
+    assert parse_resources('mem=1M, cpus=2,gpus=1') == {'mem': 1024*1024, 'cpus': 2., 'gpus': 1.}
+    with raises(ValueError):
+        parse_resources('cpus')
+    with raises(ValueError):
+        parse_resources({'cpus': 'many'})
+    with raises(ValueError):
+        parse_resources({'cpus': -1})
+
+
+def test_node_capacity():
+    capacity = node_capacity()
+    assert capacity['cpus'] >= 1
+    capacity = node_capacity('cpus=3,gpus=2')
+    assert capacity['cpus'] == 3
+    assert capacity['gpus'] == 2
+
+
+def test_fits():
+    capacity = {'cpus': 4, 'mem': 1000}
+    assert fits({}, {}, capacity)
+    assert fits({'cpus': 4}, {}, capacity)
+    assert not fits({'cpus': 4}, {'cpus': 1}, capacity)
+    assert fits({'cpus': 2, 'mem': 500}, {'cpus': 2, 'mem': 500}, capacity)
+    assert not fits({'mem': 1001}, {}, capacity)
+    # Resources which the node does not have
+    assert not fits({'gpus': 1}, {}, capacity)
+    assert fits({'gpus': 0}, {}, capacity)
@@ -0,0 +1,58 @@
+import numpy as np
+from pytest import raises
+
+from jug.task import Task
+from jug.result_cache import ResultCache, parse_size, result_size
+from .task_reset import task_reset_at_exit, task_reset
+
+
+def zeros(n):
+    return np.zeros(n, np.uint8)
+
+def total(x, y):
+    return int(x.sum() + y.sum())
+
+
+def test_parse_size():
+    assert parse_size('8G') == 8*1024**3
+    assert parse_size('512m') == 512*1024**2
+    assert parse_size('1.5KB') == 1536
+    assert parse_size('100') == 100
+    assert parse_size(100) == 100
+    with raises(ValueError):
+        parse_size('lots')
+
+
+def test_result_size():
+    assert result_size(np.zeros(1000, np.uint8)) == 1000
+    assert result_size(3) > 0
+
+
+@task_reset
+def test_lru_eviction():
+    a = Task(zeros, 1000)
+    b = Task(zeros, 1000)
+    c = Task(zeros, 1000)
+    d = Task(total, a, c)
+    cache = ResultCache('2500')
+    for t in [a, b]:
+        t.run()
+        cache.use(t)
+        assert cache.evict() == 0
+    c.run()
+    cache.use(c)
+    # a is the least recently used
+    assert cache.evict() == 1
+    assert not a.is_loaded()
+    assert b.is_loaded()
+    assert c.is_loaded()
+
+    # d reloads a; b is now the least recently used, but it is pinned
+    d.run()
+    cache.use(d)
+    assert a.is_loaded()
+    assert cache.evict(pinned=[b]) == 1
+    assert b.is_loaded()
+    assert not a.is_loaded()
+    assert c.is_loaded()
+    assert cache.total <= cache.budget
@@ -0,0 +1,309 @@
+from jug.task import Task
+from jug.scheduler import ReadyQueue
+from .task_reset import task_reset_at_exit, task_reset
+
+
+def double(x):
+    return 2*x
+
+def add(a, b):
+    return a + b
+
+
+@task_reset
+def test_ready_queue_order():
+    a = Task(double, 1)
+    b = Task(double, 2)
+    c = Task(add, a, b)
+    d = Task(double, c)
+    queue = ReadyQueue([a, b, c, d])
+    assert queue.refresh() == []
+    assert len(queue) == 4
+    assert queue.pop() is a
+    queue.start(a)
+    a.run()
+    queue.done(a)
+    assert queue.pop() is b
+    queue.start(b)
+    assert queue.pop() is None
+    b.run()
+    queue.done(b)
+    assert queue.pop() is c
+    queue.start(c)
+    c.run()
+    queue.done(c)
+    assert queue.pop() is d
+    assert queue.remaining() == [d]
+    queue.start(d)
+    assert queue.remaining() == []
+
+
+@task_reset
+def test_ready_queue_refresh():
+    a = Task(double, 1)
+    b = Task(double, a)
+    c = Task(double, b)
+    queue = ReadyQueue([a, b, c])
+    assert queue.pop() is a
+    queue.start(a)
+    queue.running_elsewhere(a)
+    assert queue.pop() is None
+    assert queue.remaining() == [b, c]
+
+    # Another process runs a
+    a.run()
+    a.unload()
+    assert queue.refresh() == [a]
+    assert queue.pop() is b
+
+
+@task_reset
+def test_ready_queue_refresh_names():
+    a = Task(double, 1)
+    b = Task(double, 2)
+    c = Task(double, b)
+    queue = ReadyQueue([a, b, c])
+    for t in (a, b):
+        assert queue.pop() is t
+        queue.start(t)
+        queue.running_elsewhere(t)
+    a.run()
+    b.run()
+    b.unload()
+    # Only the results which were written are checked
+    assert queue.refresh(set([b.hash(), b'other'])) == [b]
+    assert queue.pop() is c
+    assert queue.refresh(set()) == []
+    assert queue.refresh() == [a]
+
+
+@task_reset
+def test_ready_queue_external_dependencies():
+    a = Task(double, 1)
+    b = Task(double, a)
+    # a is not part of the queue (as when running with --target)
+    queue = ReadyQueue([b])
+    assert queue.pop() is None
+    assert len(queue) == 1
+    assert queue.refresh() == []
+    a.run()
+    a.unload()
+    assert queue.refresh() == []
+    assert queue.pop() is b
+
+
+@task_reset
+def test_ready_queue_failed():
+    a = Task(double, 1)
+    b = Task(double, a)
+    queue = ReadyQueue([a, b])
+    t = queue.pop()
+    queue.start(t)
+    queue.failed(t)
+    assert queue.has_dependents(t)
+    assert queue.pop() is None
+    assert queue.remaining() == [b]
+
+
+@task_reset
+def test_ready_queue_priority():
+    a = Task(double, 1)
+    b = Task(double, 2)
+    b.priority = 2
+    c = Task(add, 1, 2)
+    c.priority = 1
+    queue = ReadyQueue([a, b, c])
+    assert [queue.pop() for _ in range(3)] == [b, c, a]
+
+
+@task_reset
+def test_ready_queue_peek():
+    a = Task(double, 1)
+    b = Task(double, 2)
+    b.priority = 1
+    c = Task(double, a)
+    queue = ReadyQueue([a, b, c])
+    assert queue.peek() is b
+    assert queue.pop() is b
+    queue.start(b)
+    assert queue.peek() is a
+    queue.start(queue.pop())
+    assert queue.peek() is None
+    a.run()
+    queue.done(a)
+    assert queue.peek() is c
+    assert queue.pop() is c
+
+
+@task_reset
+def test_ready_queue_critical_path():
+    short = Task(double, 1)
+    start = Task(add, 1, 2)
+    chain = Task(double, start)
+    chain = Task(double, chain)
+    runtimes = {
+        'jug.tests.test_scheduler.double': [1.],
+        'jug.tests.test_scheduler.add': [1.],
+        }
+    queue = ReadyQueue([short, start] + [chain.args[0], chain], policy='fifo', runtimes=runtimes)
+    assert queue.pop() is short
+    queue = ReadyQueue([short, start] + [chain.args[0], chain], policy='critical-path', runtimes=runtimes)
+    assert queue.pop() is start
+
+
+@task_reset
+def test_runtimes_roundtrip():
+    from jug.scheduler import load_runtimes, save_runtimes
+    store = Task.store
+    assert load_runtimes(store) == {}
+    save_runtimes(store, {'f': [1., 2.]})
+    save_runtimes(store, {'f': [3.], 'g': [.5]})
+    assert load_runtimes(store) == {'f': [1., 2., 3.], 'g': [.5]}
+
+
+def make_list(n):
+    return list(range(n))
+
+def length(xs):
+    return len(xs)
+
+@task_reset
+def test_locality():
+    small = Task(make_list, 2)
+    large = Task(make_list, 1000)
+    other = Task(double, 3)
+    after_small = Task(length, small)
+    after_large = Task(length, large)
+    queue = ReadyQueue([small, large, other, after_small, after_large])
+    assert queue.pop() is small
+    queue.start(small)
+    assert queue.pop() is large
+    queue.start(large)
+    for t in [small, large]:
+        t.run()
+        queue.done(t)
+    # Tasks whose inputs are loaded are preferred (larger inputs first)
+    assert queue.pop() is after_large
+    queue.start(after_large)
+    assert queue.pop() is after_small
+    queue.start(after_small)
+    assert queue.pop() is other
+
+    # ... but not over tasks with a higher priority
+    other.priority = 1
+    queue = ReadyQueue([small, large, other, after_small, after_large])
+    assert queue.refresh() == [small, large]
+    assert queue.pop() is other
+    queue.start(other)
+
+    # Tasks which are returned to the queue keep their place
+    assert queue.pop() is after_large
+    queue.push_back(after_large)
+    assert queue.pop() is after_large
+
+
+def wait(secs):
+    return secs
+
+def slow_length(xs):
+    return len(xs)
+
+@task_reset
+def test_locality_critical_path():
+    small = Task(make_list, 2)
+    slow = Task(wait, [40])
+    after_small = Task(length, small)
+    after_slow = Task(slow_length, slow)
+    runtimes = {small.name: [1.], slow.name: [1.], after_small.name: [1.], after_slow.name: [40.]}
+    queue = ReadyQueue([small, slow, after_small, after_slow], policy='critical-path', runtimes=runtimes)
+    assert queue.pop() is slow
+    queue.start(slow)
+    assert queue.pop() is small
+    queue.start(small)
+    small.run()
+    slow.run()
+    slow.unload()
+    queue.done(small)
+    queue.done(slow)
+    # Loaded inputs do not take precedence over a longer critical path...
+    assert queue.pop() is after_slow
+    queue.start(after_slow)
+    assert queue.pop() is after_small
+
+    # ... but break ties
+    a = Task(make_list, 3)
+    b = Task(make_list, 4)
+    after_a = Task(length, a)
+    after_b = Task(length, b)
+    runtimes = {a.name: [1.], after_a.name: [1.]}
+    queue = ReadyQueue([a, b, after_b, after_a], policy='critical-path', runtimes=runtimes)
+    for t in [queue.pop(), queue.pop()]:
+        queue.start(t)
+        t.run()
+    b.unload()
+    queue.done(a)
+    queue.done(b)
+    assert queue.pop() is after_a
+
+
+@task_reset
+def test_chain():
+    a = Task(double, 1)
+    b = Task(double, a)
+    c = Task(double, b)
+    d = Task(add, c, c)
+    e = Task(double, 2)
+    f = Task(add, d, e)
+    queue = ReadyQueue([a, b, c, d, e, f])
+    assert queue.chain(a) == [b, c, d]
+    assert queue.chain(a, accept=lambda t: t is not c) == [b]
+    # f also waits on e
+    assert queue.chain(d) == []
+    e.run()
+    queue.done(e)
+    assert queue.chain(d) == [f]
+
+
+@task_reset
+def test_retry():
+    a = Task(double, 1)
+    b = Task(double, a)
+    queue = ReadyQueue([a, b])
+    assert queue.retry_delay() is None
+    assert queue.pop() is a
+    queue.start(a)
+    queue.retry(a, 60.)
+    assert 0. < queue.retry_delay() <= 60.
+    assert queue.pop() is None
+    assert len(queue) == 2
+    queue.retry(a, 0.)
+    assert queue.retry_delay() == 0.
+    assert queue.pop() is a
+    queue.start(a)
+    assert queue.retry_delay() is None
+    a.run()
+    queue.done(a)
+    assert queue.pop() is b
+
+
+@task_reset
+def test_unused():
+    a = Task(double, 1)
+    b = Task(double, 2)
+    c = Task(add, a, b)
+    d = Task(add, a, c)
+    queue = ReadyQueue([a, b, c, d])
+    for t in [a, b]:
+        queue.pop()
+        queue.start(t)
+        queue.done(t)
+    assert queue.unused() == []
+    queue.pop()
+    queue.start(c)
+    queue.done(c)
+    assert queue.unused() == [b]
+    queue.pop()
+    queue.start(d)
+    queue.failed(d)
+    assert set(queue.unused()) == set([a, c])
+    assert queue.unused() == []
@@ -0,0 +1,88 @@
+from jug.task import Task
+from jug.options import default_options
+from jug.subcommands.simulate import critical_path, estimate_runtimes, simulate, simulate_execution
+from .task_reset import task_reset_at_exit, task_reset
+from .utils import find_test_jugfile
+import jug
+
+
+def double(x):
+    return 2*x
+
+def add(a, b):
+    return a + b
+
+
+@task_reset
+def test_estimate_runtimes():
+    a = Task(double, 1)
+    b = Task(add, a, 2)
+    c = Task(double, b)
+    c.persist = False
+    estimates, missing = estimate_runtimes([a, b, c], {a.name: [1., 3.]})
+    assert estimates == {a: 2., b: 2., c: 0.}
+    assert missing == set([b.name])
+
+
+@task_reset
+def test_simulate_execution():
+    # Four independent chains of two tasks (1s + 2s) and a final task (1s)
+    firsts = [Task(double, i) for i in range(4)]
+    seconds = [Task(add, f, 1) for f in firsts]
+    final = Task(sum, seconds)
+    tasks = firsts + seconds + [final]
+    estimates = dict((t, 1.) for t in tasks)
+    for t in seconds:
+        estimates[t] = 2.
+
+    length, path = critical_path(tasks, estimates)
+    assert length == 4.
+    assert path == [firsts[0], seconds[0], final]
+
+    r = simulate_execution(tasks, estimates, 1)
+    assert r.makespan == 13.
+    assert r.work == 13.
+    assert all(abs(u - 1.) < 1e-9 for u in r.utilization)
+
+    r = simulate_execution(tasks, estimates, 4)
+    assert r.makespan == 4.
+    assert abs(r.utilization[-1] - .25) < 1e-9
+
+    r = simulate_execution(tasks, estimates, 8)
+    assert r.makespan == 4.
+
+    # Finished tasks are left out
+    r = simulate_execution(seconds + [final], estimates, 2)
+    assert r.makespan == 5.
+
+
+@task_reset
+def test_simulate_locality():
+    a = Task(double, 1)
+    b = Task(double, 2)
+    c = Task(double, 3)
+    after_a = Task(double, a)
+    tasks = [a, b, c, after_a]
+    estimates = {a: 1., b: 5., c: 5., after_a: 10.}
+    # As in jug execute, after_a is preferred to c once a has finished (as
+    # its input is loaded)
+    r = simulate_execution(tasks, estimates, 2)
+    assert r.makespan == 11.
+
+
+@task_reset
+def test_simulate_command():
+    jugfile = find_test_jugfile('simple.py')
+    store, space = jug.jug.init(jugfile, 'dict_store')
+
+    output = []
+    options = default_options.copy()
+    options.jugdir = store
+    options.jugfile = jugfile
+    options.simulate_workers = '1,8'
+    options.print_out = lambda *args: output.append(' '.join(map(str, args)))
+    simulate.run(store, options)
+    output = '\n'.join(output)
+    # No runtimes recorded, so each task is assumed to take 1s
+    assert 'Tasks: 32 (total work: 32s)' in output
+    assert 'Critical path: 4s (4 tasks)' in output
@@ -69,3 +69,46 @@ def test_cache_bvalue():
     simple_execute()
     assert status.status(options) == 1
 
+
+@task_reset
+def test_ephemeral():
+    jugfile = os.path.join(_jugdir, 'ephemeral.py')
+    store, space = jug.jug.init(jugfile, 'dict_store')
+
+    options = default_options.copy()
+    options.jugdir = store
+    options.jugfile = jugfile
+    options.verbose = 'quiet'
+    simple_execute()
+    # The ephemeral task is not counted as finished
+    assert status.status(options) == 5 + 4
+
+@task_reset
+def test_ephemeral_table():
+    jugfile = os.path.join(_jugdir, 'ephemeral.py')
+    store, space = jug.jug.init(jugfile, 'dict_store')
+
+    options = default_options.copy()
+    options.jugdir = store
+    options.jugfile = jugfile
+    output = []
+    options.print_out = lambda *args: output.append(' '.join(map(str, args)))
+    status.status(options)
+    # No extra column (which would not fit in an 80 column terminal)
+    assert len(output[0].split()) == 5 + 2
+    assert output[-1] == '2 tasks are not saved (persist=False).'
+
+@task_reset
+def test_ephemeral_cache():
+    jugfile = os.path.join(_jugdir, 'ephemeral.py')
+    store, space = jug.jug.init(jugfile, 'dict_store')
+
+    options = default_options.copy()
+    options.jugdir = store
+    options.jugfile = jugfile
+    options.verbose = 'quiet'
+    options.status_cache = True
+    options.status_cache_file = ':memory:'
+    assert status.status(options) == 0
+    simple_execute()
+    assert status.status(options) == 5 + 4
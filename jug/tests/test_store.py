@@ -62,6 +62,20 @@ def test_lock(store):
     assert lock2.get()
     lock2.release()
 
+def test_lock_many(store):
+    keys = [b'jugisbestthingever', b'jugisbestthingeverandever', b'jugisok']
+    assert store.getlock(keys[1]).get()
+    assert store.lock_many(keys) == [True, False, True]
+    assert store.lock_many(keys) == [False, False, False]
+    assert len(list(store.listlocks())) == 3
+    store.release_many([keys[0], keys[2]])
+    assert len(list(store.listlocks())) == 1
+    assert store.getlock(keys[1]).is_locked()
+
+    store.getlock(keys[1]).fail()
+    assert store.lock_many(keys[1:2]) == [False]
+    assert store.getlock(keys[1]).is_failed()
+
 def test_lock_remove(store):
     assert len(list(store.listlocks())) == 0
     key = b'jugisbestthingever'
@@ -290,3 +290,108 @@ def test_describe_task_with_kwargs():
     assert desc['name'].endswith('add')
     assert 'kwargs' in desc
 
+
+@task_reset
+def test_taskgenerator_executor():
+    @jug.task.TaskGenerator(executor='thread')
+    def double(x):
+        return 2*x
+    t = double(2)
+    assert t.executor == 'thread'
+    assert t.hash() == jug.task.Task(double.f, 2).hash()
+    assert jug.task.Task(double.f, 2).executor is None
+    with raises(ValueError):
+        jug.task.TaskGenerator(executor='gpu')
+
+
+@task_reset
+def test_taskgenerator_persist():
+    @jug.task.TaskGenerator(persist=False)
+    def double(x):
+        return 2*x
+    a = Task(add1, 1)
+    t = double(a)
+    b = Task(add2, t)
+    assert not t.persist
+    assert t.hash() == jug.task.Task(double.f, a).hash()
+    assert not t.can_load()
+    assert not b.can_run()
+    a.run()
+    assert t.can_load()
+    assert b.can_run()
+    assert b.run() == 6
+    assert t.is_loaded()
+    assert not t.store.can_load(t.hash())
+    t.unload()
+    t.run()
+    assert not t.store.can_load(t.hash())
+    # The result is computed again when needed
+    t.unload()
+    assert t.value() == 4
+
+
+@task_reset
+def test_load_not_persisted_locks():
+    # Loading the dependencies of a task which is not persisted must not
+    # happen while holding one of the shared locks (two threads could take
+    # them in opposite orders)
+    from jug.task import _load_locks
+    nr_locked = []
+    class checking_store(jug.task.Task.store.__class__):
+        def load(self, name):
+            nr_locked.append(sum(lock.locked() for lock in _load_locks))
+            return super(checking_store, self).load(name)
+    jug.task.Task.store = checking_store()
+
+    @jug.task.TaskGenerator(persist=False)
+    def total(xs):
+        return sum(xs)
+    deps = [Task(add1, i) for i in range(len(_load_locks))]
+    for d in deps:
+        d.run()
+        d.unload()
+    t = total(deps)
+    assert t.value() == sum(range(1, len(deps) + 1))
+    # Only the lock of the task being loaded
+    assert nr_locked == [1] * len(deps)
+
+@task_reset
+def test_taskgenerator_retries():
+    @jug.task.TaskGenerator(retries=3, retry_backoff=.5)
+    def double(x):
+        return 2*x
+    t = double(2)
+    assert t.retries == 3
+    assert t.retry_backoff == .5
+    assert Task(add1, 1).retries is None
+    assert t.hash() == jug.task.Task(double.f, 2).hash()
+
+def first(x, _):
+    return x
+
+@task_reset
+def test_hash_tasks():
+    import numpy as np
+    from jug.task import hash_tasks
+
+    def build():
+        ts = [Task(add1, i) for i in range(20)]
+        ts += [Task(first, np.arange(100) * i, t) for i, t in enumerate(ts)]
+        ts.append(Task(first, ts[20:], ts[0]))
+        return ts
+    expected = [t.hash() for t in build()]
+    tasks = build()
+    hash_tasks(tasks, 4)
+    assert all('__jug_hash__' in t.__dict__ for t in tasks)
+    assert [t.hash() for t in tasks] == expected
+    # Tasks which were already hashed are skipped
+    hash_tasks(tasks, 4)
+    assert [t.hash() for t in tasks] == expected
+
+
+@task_reset
+def test_init_hash_threads():
+    from jug.jug import init
+    init(os.path.join(_jugdir, 'simple.py'), 'dict_store', hash_threads=2)
+    assert jug.task.alltasks
+    assert all('__jug_hash__' in t.__dict__ for t in jug.task.alltasks)